@@ -0,0 +1,139 @@
+"""
+Retrieval benchmark of the chunking strategies of the lwip RAG index.
+
+Every documented function of the corpus becomes a query: the first
+sentence of its doc comment. The chunks of each splitter config in
+rag_index.py are embedded and ranked for every query, then scored against
+the line range of the function:
+
+- precision@k: share of the top k chunks that overlap the function
+- coverage@k: share of the function lines contained in the top k chunks
+- steps: retriever calls (k chunks each) until the whole function was seen,
+  a proxy for the agent steps spent collecting fragments
+
+    python bench_rag_chunking.py --queries 100 --k 7
+"""
+import argparse
+import json
+import math
+import random
+import re
+import time
+
+import numpy as np
+from langchain_community.embeddings import HuggingFaceEmbeddings
+
+from c_chunker import function_ranges
+from rag_index import RECURSIVE_SPLITTER_CONFIG, SOURCE_DIRECTORY, SPLITTER_CONFIG, load_text_files, make_splitter
+
+# Steps are counted up to this many retriever calls
+MAX_STEPS = 10
+
+# Function to build the queries from the doc comments right above the functions
+def build_queries(docs, num_queries, seed=0):
+    queries = []
+    for doc in docs:
+        lines = doc.page_content.splitlines(keepends=True)
+        for start, end, name in function_ranges(doc.metadata["path"], lines):
+            # Walk up over the return type to the end of a /** comment
+            i = start - 2
+            while i >= 0 and lines[i].strip() and not lines[i].strip().endswith("*/"):
+                i -= 1
+            if i < 0 or not lines[i].strip().endswith("*/"):
+                continue
+            comment_end = i
+            while i >= 0 and "/**" not in lines[i]:
+                i -= 1
+            if i < 0:
+                continue
+            comment = " ".join(re.sub(r"^\s*/?\*+/?", "", line).strip() for line in lines[i:comment_end + 1])
+            comment = re.split(r"\s@|\s\\\w", comment)[0].strip(" */")
+            sentence = re.split(r"(?<=\.)\s", comment)[0]
+            if len(sentence.split()) >= 3:
+                queries.append({"query": sentence, "source": doc.metadata["source"], "start": start, "end": end, "function": name})
+    random.Random(seed).shuffle(queries)
+    return queries[:num_queries]
+
+# Function to attach the line range of every chunk of a split
+def chunk_lines(chunk, doc):
+    if "start_line" in chunk.metadata:
+        return chunk.metadata["start_line"], chunk.metadata["end_line"]
+    start_index = chunk.metadata["start_index"]
+    start = doc.page_content.count("\n", 0, start_index) + 1
+    return start, start + chunk.page_content.count("\n")
+
+def evaluate(config, docs, queries, embedding_model, k):
+    split = make_splitter(config)
+    start_time = time.perf_counter()
+    chunks = []
+    for doc in docs:
+        for chunk in split(doc):
+            chunks.append((doc.metadata["source"],) + chunk_lines(chunk, doc) + (chunk.page_content,))
+    split_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    vectors = np.asarray(embedding_model.embed_documents([text for _, _, _, text in chunks]), dtype=np.float32)
+    query_vectors = np.asarray(embedding_model.embed_documents([q["query"] for q in queries]), dtype=np.float32)
+    embed_seconds = time.perf_counter() - start_time
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    scores = query_vectors @ vectors.T
+
+    precision, coverage, steps = [], [], []
+    for query, row in zip(queries, scores):
+        needed = set(range(query["start"], query["end"] + 1))
+        hits = []
+        for rank, index in enumerate(np.argsort(-row)[:k * MAX_STEPS]):
+            source, start, end, _ = chunks[index]
+            if source == query["source"] and start <= query["end"] and end >= query["start"]:
+                hits.append((rank, needed & set(range(start, end + 1))))
+
+        seen = set()
+        completed_at = None
+        for rank, lines in hits:
+            seen |= lines
+            if seen == needed:
+                completed_at = rank
+                break
+        precision.append(sum(1 for rank, _ in hits if rank < k) / k)
+        coverage.append(len(set().union(*(lines for rank, lines in hits if rank < k))) / len(needed))
+        steps.append(MAX_STEPS if completed_at is None else math.ceil((completed_at + 1) / k))
+
+    token_counts = [len(text) / 4 for _, _, _, text in chunks]
+    return {
+        "splitter": config["splitter"],
+        "chunks": len(chunks),
+        "mean_chunk_tokens": float(np.mean(token_counts)) if chunks else 0.0,
+        "precision_at_k": float(np.mean(precision)),
+        "coverage_at_k": float(np.mean(coverage)),
+        "mean_steps": float(np.mean(steps)),
+        "complete_in_one_step": float(np.mean([s == 1 for s in steps])),
+        "split_seconds": split_seconds,
+        "embed_seconds": embed_seconds,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the retrieval quality of the RAG chunking strategies')
+    parser.add_argument('--source', default=SOURCE_DIRECTORY, help='Directory of the C sources')
+    parser.add_argument('--queries', type=int, default=100, help='Number of documented functions to query')
+    parser.add_argument('--k', type=int, default=7, help='Chunks returned per retriever call')
+    parser.add_argument('--output', help='Write the results as JSON')
+    args = parser.parse_args()
+
+    docs = load_text_files(args.source)
+    queries = build_queries(docs, args.queries)
+    print(f"{len(queries)} queries over {len(docs)} files")
+    embedding_model = HuggingFaceEmbeddings(model_name=SPLITTER_CONFIG["embedding_model"])
+
+    results = [evaluate(config, docs, queries, embedding_model, args.k)
+               for config in (RECURSIVE_SPLITTER_CONFIG, SPLITTER_CONFIG)]
+    print(f"{'splitter':<10} {'chunks':>7} {'tokens':>7} {'prec@k':>7} {'cover@k':>8} {'steps':>6} {'1-step':>7}")
+    for r in results:
+        print(f"{r['splitter']:<10} {r['chunks']:>7} {r['mean_chunk_tokens']:>7.0f} {r['precision_at_k']:>7.2f} "
+              f"{r['coverage_at_k']:>8.2f} {r['mean_steps']:>6.2f} {r['complete_in_one_step']:>7.2f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"k": args.k, "queries": len(queries), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
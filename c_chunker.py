@@ -0,0 +1,227 @@
+"""
+Function-boundary chunking of C sources for retrieval.
+
+Every function becomes one chunk, together with the comment and return
+type lines right above it. Functions longer than the chunk budget are cut
+at line boundaries into sub-chunks that all start with the function
+signature, so every piece still says where it comes from. The code between
+functions (includes, macros, declarations, the structure of a header) is
+split at blank lines and packed up to the budget.
+
+Function ranges come from compare/func_ranges.py (ctags); without ctags
+they are found by a top-level brace scan, shared with
+deep_pysearch/semantic_index.py.
+"""
+import os
+import re
+import sys
+from typing import Callable, Dict, List, Optional, Tuple
+
+# The function range extraction lives with the refactoring tools
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "compare"))
+from func_ranges import get_function_ranges
+
+MAX_CHUNK_TOKENS = 400
+# Rough size of a token, used when no tokenizer is given
+CHARS_PER_TOKEN = 4
+# Lines of a signature repeated at the start of each sub-chunk
+MAX_SIGNATURE_LINES = 5
+
+# Keywords that look like a function name before a parenthesis, and C comments
+NOT_FUNCTIONS = {"if", "for", "while", "switch", "return", "sizeof", "defined"}
+COMMENT = re.compile(r"/\*.*?\*/|//[^\n]*", re.S)
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def top_level_blocks(lines: List[str]) -> List[Tuple[int, int]]:
+    """
+    Top-level brace blocks (function bodies, structs, initializers) of C source.
+
+    Returns:
+        List of (open, close) line numbers of the lines with the opening and
+        the closing brace, 1-based and inclusive (equal for a one-line block);
+        a block left open runs to the last line
+    """
+    blocks = []
+    depth = 0
+    for number, line in enumerate(lines, start=1):
+        if depth == 0 and "{" in line:
+            open_line = number
+        was_top_level = depth == 0
+        depth = max(0, depth + line.count("{") - line.count("}"))
+        if depth == 0 and (not was_top_level or "{" in line):
+            blocks.append((open_line, number))
+    if depth > 0:
+        blocks.append((open_line, len(lines)))
+    return blocks
+
+def _signature_start(lines: List[str], open_line: int) -> Optional[Tuple[int, str]]:
+    """
+    Line and name of the function definition whose body opens at open_line, None if the block is no function.
+
+    The name and its parameter list, (...), must be followed by nothing but
+    comments and the opening brace, with no blank line in between, so a
+    bodiless macro line such as LWIP_MEMPOOL_DECLARE(...) right above a
+    function is not taken for its start.
+    """
+    first = open_line
+    while first > 1 and lines[first - 2].strip():
+        first -= 1
+    # Preprocessor lines (e.g. #if around parameters) and comments are blanked, keeping the offsets
+    text = "".join(" " * (len(line) - 1) + "\n" if line.startswith("#") else line for line in lines[first - 1:open_line])
+    text = COMMENT.sub(lambda match: re.sub(r"[^\n]", " ", match.group()), text)
+    brace = text.find("{", len(text) - len(lines[open_line - 1]))
+    end = len(text[:brace].rstrip()) - 1
+    if brace < 0 or end < 0 or text[end] != ")":
+        return None
+    depth = 0
+    for position in range(end, -1, -1):
+        depth += {")": 1, "(": -1}.get(text[position], 0)
+        if depth == 0:
+            break
+    name = re.search(r"([A-Za-z_]\w*)\s*$", text[:position])
+    if depth or name is None or name.group(1) in NOT_FUNCTIONS:
+        return None
+    number = first + text.count("\n", 0, name.start(1))
+    # Definitions start at column 0, unlike calls in a macro body or an initializer
+    if not re.match(r"[A-Za-z_]", lines[number - 1]) or lines[number - 1].startswith("typedef"):
+        return None
+    return number, name.group(1)
+
+def _scan_function_ranges(lines: List[str]) -> List[Tuple[int, int, str]]:
+    """Function ranges by a top-level brace scan: (start, end, name), 1-based and inclusive."""
+    ranges = []
+    for open_line, close_line in top_level_blocks(lines):
+        signature = _signature_start(lines, open_line)
+        if signature is not None:
+            ranges.append((signature[0], close_line, signature[1]))
+    return ranges
+
+def function_ranges(filepath: Optional[str], lines: List[str]) -> List[Tuple[int, int, str]]:
+    """
+    Function ranges of a C file, sorted by start line.
+
+    Returns:
+        List of (start, end, name), 1-based and inclusive
+    """
+    if filepath is not None:
+        try:
+            ranges = get_function_ranges(filepath)
+            return sorted((start, end, name) for name, (start, end, content) in ranges.items())
+        except FileNotFoundError:
+            # ctags is not installed
+            pass
+    return _scan_function_ranges(lines)
+
+def _chunk(lines: List[str], start: int, end: int, name: str = "", prefix: str = "") -> Dict[str, object]:
+    return {"name": name, "start": start, "end": end, "text": prefix + "".join(lines[start - 1:end])}
+
+def _pack_lines(lines: List[str], start: int, end: int, budget: int, count_tokens: Callable[[str], int]):
+    """Consecutive line ranges of start..end with at most budget tokens each (single lines excepted)."""
+    pieces = []
+    piece_start, size = start, 0
+    for number in range(start, end + 1):
+        tokens = count_tokens(lines[number - 1])
+        if number > piece_start and size + tokens > budget:
+            pieces.append((piece_start, number - 1))
+            piece_start, size = number, 0
+        size += tokens
+    if piece_start <= end:
+        pieces.append((piece_start, end))
+    return pieces
+
+def _gap_chunks(lines, start, end, max_tokens, count_tokens):
+    """Chunks of the code between functions, split at blank lines and packed up to max_tokens."""
+    blocks = []
+    block_start = None
+    for number in range(start, end + 2):
+        blank = number > end or not lines[number - 1].strip()
+        if blank and block_start is not None:
+            blocks.append((block_start, number - 1))
+            block_start = None
+        elif not blank and block_start is None:
+            block_start = number
+
+    chunks = []
+    current, size = None, 0
+    for block_start, block_end in blocks:
+        tokens = count_tokens("".join(lines[block_start - 1:block_end]))
+        if current is not None and size + tokens > max_tokens:
+            chunks.append(_chunk(lines, *current))
+            current, size = None, 0
+        if tokens > max_tokens:
+            chunks.extend(_chunk(lines, *piece) for piece in _pack_lines(lines, block_start, block_end, max_tokens, count_tokens))
+            continue
+        current = (current[0] if current else block_start, block_end)
+        size += tokens
+    if current is not None:
+        chunks.append(_chunk(lines, *current))
+    return chunks
+
+def _function_chunks(lines, lead_start, start, end, name, max_tokens, count_tokens):
+    """One chunk for a function with its leading comment, or signature-prefixed sub-chunks if it is too long."""
+    if count_tokens("".join(lines[lead_start - 1:end])) <= max_tokens:
+        return [_chunk(lines, lead_start, end, name)]
+
+    # The signature runs from the return type up to the opening brace
+    signature_end = start
+    while signature_end < min(end, start + MAX_SIGNATURE_LINES - 1) and "{" not in lines[signature_end - 1]:
+        signature_end += 1
+    type_start = start
+    while type_start > lead_start and not lines[type_start - 2].lstrip().startswith(("*", "/*", "//")):
+        type_start -= 1
+    signature = "".join(lines[type_start - 1:signature_end])
+    if not signature.endswith("\n"):
+        signature += "\n"
+    prefix = signature + "  /* ... */\n"
+
+    pieces = _pack_lines(lines, lead_start, end, max_tokens - count_tokens(prefix), count_tokens)
+    return [
+        _chunk(lines, piece_start, piece_end, name, prefix if piece_start > signature_end else "")
+        for piece_start, piece_end in pieces
+    ]
+
+def split_c_code(text: str, filepath: Optional[str] = None, max_tokens: int = MAX_CHUNK_TOKENS,
+                 count_tokens: Callable[[str], int] = estimate_tokens) -> List[Dict[str, object]]:
+    """
+    Split C source into function-level chunks.
+
+    Args:
+        text: Source text
+        filepath: Path of the source on disk, used to run ctags (None skips ctags)
+        max_tokens: Token budget of a chunk
+        count_tokens: Token counter (default: estimated from the length)
+
+    Returns:
+        List of chunk dicts with the function name ("" between functions),
+        the 1-based start and end line and the text, in file order
+    """
+    lines = text.splitlines(keepends=True)
+    chunks = []
+    position = 1
+    for start, end, name in function_ranges(filepath, lines):
+        if start < position:
+            # Nested in or overlapping the previous function
+            continue
+        # The comment and return type lines right above the function belong to it
+        lead_start = start
+        while lead_start > position and lines[lead_start - 2].strip():
+            lead_start -= 1
+        chunks.extend(_gap_chunks(lines, position, lead_start - 1, max_tokens, count_tokens))
+        chunks.extend(_function_chunks(lines, lead_start, start, end, name, max_tokens, count_tokens))
+        position = end + 1
+    chunks.extend(_gap_chunks(lines, position, len(lines), max_tokens, count_tokens))
+    return chunks
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <file.c> [max_tokens]")
+        sys.exit(1)
+    path = sys.argv[1]
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        source = f.read()
+    for chunk in split_c_code(source, path, int(sys.argv[2]) if len(sys.argv) > 2 else MAX_CHUNK_TOKENS):
+        print(f"===== {chunk['name'] or '(top level)'} {chunk['start']}-{chunk['end']} "
+              f"({estimate_tokens(chunk['text'])} tokens) =====")
+        print(chunk["text"])
@@ -1,6 +1,7 @@
 # pip install pandas langchain langchain-community sentence-transformers faiss-cpu --upgrade
 #
 import os
+import sys
 from dotenv import load_dotenv
 from glob import glob
 from tqdm import tqdm
@@ -18,6 +19,10 @@ import random
 from models.reviewer import Reviewer
 from utils.response_parser import ResponseParser
 
+# The text scanning engine is shared with the other tools, at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import text_scan
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -229,98 +234,27 @@ class FunctionEmbedder:
 def full_text_search(query: str, directory: str, max_results: int = 20) -> str:
     """Searches for a query string in all *.c and *.h files under the given directory."""
     results = []
-    context_lines = 3  # Number of lines to show before and after the match
+    patterns = [text_scan.literal_pattern(query)]
 
     # Also look for inline function definition patterns if the query appears to be a function name
-    inline_patterns = [
-        f"static\\s+inline\\s+[\\w\\*]+\\s+{query}\\s*\\(",  # static inline return_type function_name(
-        f"inline\\s+static\\s+[\\w\\*]+\\s+{query}\\s*\\(",  # inline static return_type function_name(
-        f"IRAM_ATTR\\s+[\\w\\*]+\\s+{query}\\s*\\(",         # IRAM_ATTR return_type function_name(
-        f"INLINE_FN\\s+[\\w\\*]+\\s+{query}\\s*\\("          # INLINE_FN return_type function_name(
-    ]
-
-    # Skip build directories and other common directories to ignore
-    skip_dirs = {'build', 'build_esp32_default', '.git', 'cmake-build'}
-
-    for root, dirs, files in os.walk(directory):
-        # Skip build directories
-        dirs[:] = [d for d in dirs if d not in skip_dirs]
-
-        for file in files:
-            if file.endswith(".c") or file.endswith(".h"):
-                filepath = os.path.join(root, file)
-                # Skip files in build directories
-                if any(skip_dir in filepath for skip_dir in skip_dirs):
-                    continue
-
-                try:
-                    with open(filepath, "r", encoding="utf-8") as f:
-                        lines = f.readlines()
-
-                        # First look for exact matches
-                        for i, line in enumerate(lines):
-                            if query.lower() in line.lower():
-                                # Calculate start and end indices for context
-                                start_idx = max(0, i - context_lines)
-                                end_idx = min(len(lines), i + context_lines + 1)
-
-                                # Get the context lines
-                                context = lines[start_idx:end_idx]
-
-                                # Format the output with line numbers and highlight the match
-                                context_str = "".join([
-                                    f"{j+1:4d} | {line.rstrip()}\n"
-                                    for j, line in enumerate(context, start=start_idx)
-                                ])
-
-                                results.append(f"Found match in: {filepath}\n{context_str}")
-
-                                # Check if we've reached the maximum number of results
-                                if len(results) >= max_results:
-                                    break_message = f"Reached maximum of {max_results} results. Consider refining your search."
-                                    return "\n".join(results) + f"\n\n{break_message}"
-
-                        # For function names, also look for inline function definitions using regex
-                        if len(query.split()) == 1:  # Likely a function name if it's a single word
-                            file_content = ''.join(lines)
-                            for pattern in inline_patterns:
-                                for match in re.finditer(pattern, file_content, re.MULTILINE | re.IGNORECASE):
-                                    match_pos = match.start()
-
-                                    # Find the line number of the match
-                                    line_num = file_content[:match_pos].count('\n')
-
-                                    # Calculate start and end indices for context
-                                    start_idx = max(0, line_num - context_lines)
-                                    end_idx = min(len(lines), line_num + context_lines + 1)
-
-                                    # Get the context lines
-                                    context = lines[start_idx:end_idx]
-
-                                    # Format the output with line numbers
-                                    context_str = "".join([
-                                        f"{j+1:4d} | {line.rstrip()}\n"
-                                        for j, line in enumerate(context, start=start_idx)
-                                    ])
-
-                                    results.append(f"Found inline function in: {filepath}\n{context_str}")
-
-                                    # Check if we've reached the maximum number of results
-                                    if len(results) >= max_results:
-                                        break_message = f"Reached maximum of {max_results} results. Consider refining your search."
-                                        return "\n".join(results) + f"\n\n{break_message}"
-                except Exception as e:
-                    # Only report errors if the file actually exists
-                    if os.path.exists(filepath):
-                        results.append(f"Error reading {filepath}: {e}")
-
-                # Break out of file loop if max results reached
-                if len(results) >= max_results:
-                    break
-
-        # Break out of directory loop if max results reached
+    if len(query.split()) == 1:  # Likely a function name if it's a single word
+        name = re.escape(query)
+        inline_patterns = [
+            f"static\\s+inline\\s+[\\w\\*]+\\s+{name}\\s*\\(",  # static inline return_type function_name(
+            f"inline\\s+static\\s+[\\w\\*]+\\s+{name}\\s*\\(",  # inline static return_type function_name(
+            f"IRAM_ATTR\\s+[\\w\\*]+\\s+{name}\\s*\\(",         # IRAM_ATTR return_type function_name(
+            f"INLINE_FN\\s+[\\w\\*]+\\s+{name}\\s*\\("          # INLINE_FN return_type function_name(
+        ]
+        patterns += [re.compile(p.encode("utf-8"), re.MULTILINE | re.IGNORECASE) for p in inline_patterns]
+
+    # Exact matches come first in each file, then the inline function definitions
+    for hit in text_scan.scan_directory(directory, patterns):
+        results.append(hit.format("Found match in" if hit.pattern <= 0 else "Found inline function in"))
+
+        # Check if we've reached the maximum number of results
         if len(results) >= max_results:
-            break
+            break_message = f"Reached maximum of {max_results} results. Consider refining your search."
+            return "\n".join(results) + f"\n\n{break_message}"
 
     return "\n".join(results) if results else "No matches found."
 
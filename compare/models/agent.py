@@ -1,7 +1,11 @@
 import os
+import sys
 import time
 import random
-from openai import OpenAI
+
+# The record/replay layer is shared with the other tools, at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from llm_replay import openai_client
 
 class Agent:
     """Base Agent class for interacting with OpenAI API."""
@@ -14,12 +18,15 @@ class Agent:
             system_prompt (str): The system prompt to use for the agent
             model (str): The OpenAI model to use
         """
-        self.client = OpenAI(
+        # LLM_REPLAY_MODE=record/replay captures or replays the completions
+        self.client = openai_client(
             api_key=os.environ.get("API_KEY", ""),
             base_url=os.environ.get("BASE_URL", "https://api.openai.com/v1")
         )
         self.model = model or os.environ.get("MODEL", "gpt-4-0125-preview")
         self.system_prompt = system_prompt or os.environ.get("SYSTEM_PROMPT", "You are a helpful assistant specializing in code analysis.")
+        # Token usage of every call, to see how much of the prompts the provider serves from its cache
+        self.usage = []
 
     def generate_response(self, user_prompt):
         """
@@ -49,11 +56,13 @@ class Agent:
 
         while retry_count < max_retries:
             try:
+                start = time.time()
                 response = self.client.chat.completions.create(
                     model=self.model,
                     messages=messages,
                     temperature=0.5
                 )
+                self.log_usage(response, time.time() - start)
                 return response.choices[0].message.content
             except Exception as e:
                 retry_count += 1
@@ -66,3 +75,25 @@ class Agent:
                 print(f"API error: {str(e)}. Retrying in {delay:.2f} seconds (attempt {retry_count}/{max_retries})...")
                 time.sleep(delay)
                 print("Retrying now...")
+
+    def log_usage(self, response, elapsed):
+        """
+        Record and print the token usage of a response.
+
+        Args:
+            response: The chat completion
+            elapsed (float): Seconds the request took
+        """
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+        self.usage.append({
+            "prompt_tokens": usage.prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "seconds": elapsed
+        })
+        print(f"LLM call: {usage.prompt_tokens} prompt tokens ({cached_tokens} cached), "
+              f"{usage.completion_tokens} completion tokens, {elapsed:.2f}s")
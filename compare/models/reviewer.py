@@ -76,8 +76,10 @@ mdns_init
 the new mdns_init function does not check if the pcb is not NULL.
 </concern>
 ```"""
+        # The instructions are the same for every function and come first, so the
+        # provider can serve them from its prompt cache; the function and context follow
         return f"""
-Please review the following refactoring of the function {original_func_name}. Mostly code structure changes and renaming.
+Please review the following refactoring of a function. Mostly code structure changes and renaming.
 The below context shows the original function and the refactored code containing multiple functions that might replace the original function.
 Your goal is to find the actual refactored function and point out subtle bugs or concerns, introduced by the refactoring.
 Do not jump to conclusions from the short context, if unsure, or have a suspicion, please summarize what you learned and give follow up questions, so the next reviewer has more context information.
@@ -104,7 +106,7 @@ mdns_receiver_init
 </search_refactored>
 ```
 
-## Original function
+## Original function `{original_func_name}`
 
 ```c
 {func_content}
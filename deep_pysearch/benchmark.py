@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the research flow in main.py.
+
+Runs `run_research` over a generated lwip-like source tree for every
+breadth/depth combination and writes wall time, LLM calls, tokens, search
+time and peak RSS per run as JSON. Each run is a fresh subprocess, so the
+peak RSS and the in-process caches (tokenizer, semantic index) belong to
+that run only.
+
+The LLM is either a deterministic stub that answers any schema with
+synthetic but well-formed JSON (default, no network), or the recordings of
+llm_replay.py (`--llm replay --recordings DIR`). `--llm record` runs against
+the real endpoint from .env and stores the answers for later replays.
+
+Example:
+    python benchmark.py --breadth 1 2 4 --depth 1 2 3 --output benchmark.json
+    python benchmark.py --baseline benchmark.json --output new.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+# Metrics compared against a baseline, lower is better
+TRACKED_METRICS = ["wall_seconds", "search_seconds", "llm_calls", "prompt_tokens", "completion_tokens", "peak_rss_kb"]
+
+# Vocabulary of the synthetic corpus, loosely following lwip's TCP implementation
+MODULES = {
+    "src/core": ["tcp", "tcp_in", "tcp_out", "pbuf", "mem", "memp", "netif", "udp", "raw", "timeouts", "init", "def"],
+    "src/core/ipv4": ["ip4", "ip4_addr", "ip4_frag", "etharp", "icmp", "igmp", "dhcp", "autoip"],
+    "src/core/ipv6": ["ip6", "ip6_addr", "ip6_frag", "nd6", "icmp6", "mld6", "dhcp6", "ethip6"],
+    "src/api": ["api_lib", "api_msg", "sockets", "netbuf", "netdb", "tcpip", "err", "if_api"],
+    "src/netif": ["ethernet", "bridgeif", "slipif", "lowpan6", "zepif"],
+    "src/apps": ["httpd", "mqtt", "sntp", "mdns", "lwiperf", "tftp", "snmp", "netbiosns"],
+}
+VERBS = ["input", "output", "process", "alloc", "free", "init", "update", "send", "recv", "handle",
+         "enqueue", "dequeue", "rexmit", "timer", "parse", "check", "set", "get", "reset", "abort"]
+NOUNS = ["segment", "window", "cwnd", "ssthresh", "ack", "seqno", "pcb", "option", "flags", "rto",
+         "mss", "queue", "buffer", "header", "checksum", "state", "persist", "keepalive", "fin", "syn"]
+COMMENTS = [
+    "Congestion avoidance: increase cwnd by roughly one MSS per RTT (RFC 5681).",
+    "Slow start: cwnd grows by the number of bytes acknowledged, capped at one SMSS.",
+    "Fast retransmit after three duplicate ACKs, then enter fast recovery.",
+    "Set ssthresh to half of the flight size, but never below 2*SMSS.",
+    "Restart the retransmission timer with exponential backoff.",
+    "Limited transmit: send new data on the first two duplicate ACKs (RFC 3042).",
+    "Update the round-trip time estimate (Karn's algorithm ignores retransmissions).",
+    "Nagle's algorithm: hold back small segments while unacknowledged data is in flight.",
+    "Validate the checksum before the segment is processed any further.",
+    "Window scaling is only negotiated on SYN segments (RFC 7323).",
+    "Free the pbuf chain once all references are gone.",
+    "Queue the segment on the unacked list until it is acknowledged.",
+]
+
+def log(*args):
+    print(*args)
+
+# Function to generate a deterministic lwip-like source tree
+def build_corpus(directory: str, functions_per_file: int = 40, seed: int = 0) -> Dict[str, int]:
+    """
+    Write a synthetic C source tree shaped like lwip.
+
+    Every module gets a .c file with `functions_per_file` functions and a
+    header under src/include/lwip. Identifiers and comments are drawn from a
+    TCP/congestion control vocabulary, so the research queries find matches.
+
+    Args:
+        directory: Root directory of the tree (created if missing)
+        functions_per_file: Number of functions per source file
+        seed: Seed for the generator, the same seed gives the same tree
+
+    Returns:
+        Dict with the number of files and bytes written
+    """
+    rng = random.Random(seed)
+    files = 0
+    total_bytes = 0
+    for subdir, modules in MODULES.items():
+        for module in modules:
+            source = [f'/**\n * @file\n * {module} module\n */\n\n#include "lwip/opt.h"\n#include "lwip/{module}.h"\n']
+            header = [f"#ifndef LWIP_HDR_{module.upper()}_H\n#define LWIP_HDR_{module.upper()}_H\n\n"
+                      f"struct {module}_pcb {{\n  u32_t cwnd;\n  u32_t ssthresh;\n  u16_t mss;\n  u8_t flags;\n}};\n\n"]
+            for _ in range(functions_per_file):
+                name = f"{module}_{rng.choice(VERBS)}_{rng.choice(NOUNS)}"
+                field = rng.choice(["cwnd", "ssthresh", "mss", "flags"])
+                lines = [f"/**\n * {rng.choice(COMMENTS)}\n */",
+                         f"err_t\n{name}(struct {module}_pcb *pcb, struct pbuf *p)\n{{",
+                         f"  LWIP_ASSERT(\"{name}: invalid pcb\", pcb != NULL);"]
+                for _ in range(rng.randint(3, 12)):
+                    lines.append(rng.choice([
+                        f"  pcb->{field} = LWIP_MIN(pcb->{field} + pcb->mss, 0xffff);",
+                        f"  if (pcb->flags & TF_INFR) {{\n    /* {rng.choice(COMMENTS)} */\n    pcb->{field} = pcb->ssthresh;\n  }}",
+                        f"  LWIP_DEBUGF(TCP_CWND_DEBUG, (\"{name}: cwnd %\"TCPWNDSIZE_F\"\\n\", pcb->cwnd));",
+                        f"  p = pbuf_{rng.choice(['alloc', 'free', 'header', 'cat'])}(p);",
+                        f"  tcp_{rng.choice(VERBS)}_{rng.choice(NOUNS)}(pcb);",
+                    ]))
+                lines.append("  return ERR_OK;\n}\n")
+                source.append("\n".join(lines) + "\n")
+                header.append(f"err_t {name}(struct {module}_pcb *pcb, struct pbuf *p);\n")
+            header.append(f"\n#endif /* LWIP_HDR_{module.upper()}_H */\n")
+
+            for path, parts in [
+                (os.path.join(directory, subdir, f"{module}.c"), source),
+                (os.path.join(directory, "src/include/lwip", f"{module}.h"), header),
+            ]:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                text = "".join(parts)
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(text)
+                files += 1
+                total_bytes += len(text.encode("utf-8"))
+    return {"files": files, "bytes": total_bytes}
+
+class StubLLM:
+    """
+    Deterministic stand-in for an OpenAI client.
+
+    Answers every request with JSON that follows the schema in its
+    response_format. The content is derived from a hash of the request, so
+    the same prompts give the same answers in every run, and reported token
+    usage is counted from the actual prompt and completion text. Cached
+    tokens are the longest prefix shared with an earlier prompt, as a server
+    with prefix caching would report them.
+    """
+
+    def __init__(self, latency: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.seed = seed
+        # Prompts seen so far, to report cached tokens like a server with prefix caching
+        self.prompts: List[str] = []
+        self.api_key = "stub"
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **request):
+        from llm_provider import count_tokens
+        from llm_replay import request_key, replay_chunks, to_namespace
+
+        rng = random.Random(f"{self.seed}:{request_key(request)}")
+        prompt = "\n".join(message["content"] for message in request["messages"])
+        cached = max((len(os.path.commonprefix([prompt, seen])) for seen in self.prompts), default=0)
+        self.prompts.append(prompt)
+        schema = (request.get("response_format") or {}).get("schema") or {"type": "string"}
+        content = json.dumps(self._fake(schema, rng, _prompt_words(prompt)))
+        response = {
+            "id": "stub", "object": "chat.completion", "created": 0, "model": request.get("model"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": count_tokens(prompt), "completion_tokens": count_tokens(content),
+                      "total_tokens": count_tokens(prompt) + count_tokens(content),
+                      "prompt_tokens_details": {"cached_tokens": count_tokens(prompt[:cached])}},
+        }
+        if request.get("stream"):
+            return self._stream([to_namespace(chunk) for chunk in replay_chunks({"response": response})])
+        if self.latency:
+            time.sleep(self.latency)
+        return to_namespace(response)
+
+    def _stream(self, chunks):
+        if self.latency:
+            time.sleep(self.latency)
+        yield from chunks
+
+    def _fake(self, schema: Dict[str, Any], rng: random.Random, words: List[str]) -> Any:
+        kind = schema.get("type")
+        if kind == "object":
+            return {key: self._fake(value, rng, words) for key, value in schema.get("properties", {}).items()}
+        if kind == "array":
+            # Descriptions say e.g. "List of learnings, max of 3"
+            match = re.search(r"max of (\d+)", schema.get("description", ""))
+            count = int(match.group(1)) if match else 3
+            return [self._fake(schema.get("items", {"type": "string"}), rng, words) for _ in range(count)]
+        if kind in ("integer", "number"):
+            return rng.randint(0, 100)
+        if kind == "boolean":
+            return rng.random() < 0.5
+        return " ".join(rng.choice(words) for _ in range(rng.randint(2, 12)))
+
+def _prompt_words(prompt: str) -> List[str]:
+    """Identifiers of the prompt, so stub answers refer to code the search found."""
+    words = sorted(set(re.findall(r"[A-Za-z_][A-Za-z0-9_]{3,}", prompt)))
+    return words or NOUNS
+
+def _peak_rss_kb() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def run_one(config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run the research flow once in this process.
+
+    Args:
+        config: breadth, depth, corpus, workdir, llm, recordings, latency, search_tool
+
+    Returns:
+        Metrics of the run
+    """
+    os.environ["SEARCH_DIRECTORY"] = config["corpus"]
+    os.environ["SEARCH_TOOL"] = config["search_tool"]
+    os.environ["SEMANTIC_INDEX_DIR"] = os.path.join(config["workdir"], ".semantic_index")
+    if config["llm"] in ("replay", "record"):
+        # Read by llm_replay at import time
+        os.environ["LLM_REPLAY_MODE"] = config["llm"]
+        os.environ["LLM_REPLAY_DIR"] = config["recordings"]
+
+    import llm_provider
+    from main import INITIAL_QUERY, run_research
+    from scheduler import ResearchBudget
+    from telemetry import Telemetry
+
+    if config["llm"] == "stub":
+        stub = StubLLM(latency=config["latency"], seed=config["seed"])
+        llm_provider.create_openai_client = lambda: stub
+
+    run_telemetry = Telemetry()
+    error = None
+    start = time.perf_counter()
+    # The research flow logs every step, keep stdout for the result line
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            result = asyncio.run(run_research(
+                INITIAL_QUERY,
+                breadth=config["breadth"],
+                depth=config["depth"],
+                report_path=os.path.join(config["workdir"], "report.md"),
+                telemetry=run_telemetry,
+                budget=ResearchBudget(max_tokens=config["budget_tokens"]) if config.get("budget_tokens") else None
+            ))
+        except Exception as e:
+            result = {"learnings": [], "sources": []}
+            error = f"{type(e).__name__}: {e}"
+    wall_seconds = time.perf_counter() - start
+
+    total = run_telemetry.summary()
+    stages = run_telemetry.aggregate()
+    return {
+        "breadth": config["breadth"],
+        "depth": config["depth"],
+        "wall_seconds": wall_seconds,
+        "llm_calls": total["llm_calls"],
+        "prompt_tokens": total["prompt_tokens"],
+        "completion_tokens": total["completion_tokens"],
+        "cached_tokens": total["cached_tokens"],
+        "first_token_seconds": total["first_token_seconds"],
+        "search_seconds": sum(r["seconds"] for r in stages if r["stage"] == "local_search"),
+        "bytes_searched": total["bytes_searched"],
+        "peak_rss_kb": _peak_rss_kb(),
+        "learnings": len(result["learnings"]),
+        "sources": len(result["sources"]),
+        "stages": stages,
+        "error": error,
+    }
+
+def run_subprocess(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one configuration in a fresh interpreter and return its metrics."""
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-one", json.dumps(config)],
+        cwd=config["workdir"], capture_output=True, text=True
+    )
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        raise RuntimeError(f"Benchmark run failed ({completed.returncode}):\n{completed.stderr[-2000:]}")
+    return json.loads(lines[-1])
+
+def _medians(runs: List[Dict[str, Any]]) -> Dict[Any, Dict[str, Any]]:
+    """Median of every tracked metric over the repeated runs of each (breadth, depth), with the run count."""
+    grouped: Dict[Any, List[Dict[str, Any]]] = {}
+    for run in runs:
+        grouped.setdefault((run["breadth"], run["depth"]), []).append(run)
+    medians = {}
+    for key, group in grouped.items():
+        medians[key] = {"runs": len(group)}
+        for metric in TRACKED_METRICS:
+            values = [run[metric] for run in group if run.get(metric) is not None]
+            medians[key][metric] = statistics.median(values) if values else None
+    return medians
+
+def compare(runs: List[Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Compare runs with a baseline result file.
+
+    Repeated runs (--repeat) of a configuration are compared by the median
+    of each metric, on both sides.
+
+    Returns:
+        One line per metric that got worse by more than `threshold` (relative)
+    """
+    previous = _medians(baseline["runs"])
+    regressions = []
+    for (breadth, depth), new in sorted(_medians(runs).items()):
+        old = previous.get((breadth, depth))
+        if not old:
+            continue
+        for metric in TRACKED_METRICS:
+            if old.get(metric) and new[metric] is not None and new[metric] > old[metric] * (1 + threshold):
+                regressions.append(f"breadth={breadth} depth={depth} {metric}: "
+                                   f"{old[metric]:.6g} -> {new[metric]:.6g} (+{new[metric] / old[metric] - 1:.0%}, "
+                                   f"median of {old['runs']} -> {new['runs']} runs)")
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the research flow over a synthetic lwip-like corpus')
+    parser.add_argument('--breadth', type=int, nargs='+', default=[1, 2, 4], help='Breadth values to sweep')
+    parser.add_argument('--depth', type=int, nargs='+', default=[1, 2], help='Depth values to sweep')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per configuration')
+    parser.add_argument('--llm', choices=['stub', 'replay', 'record'], default='stub',
+                        help='Stub LLM, recorded answers, or the real endpoint while recording')
+    parser.add_argument('--recordings', default='benchmark_recordings', help='Recording directory for --llm replay/record')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated seconds per stub LLM call')
+    parser.add_argument('--budget-tokens', type=int, help='Run the budget-driven scheduler with this token budget')
+    parser.add_argument('--search-tool', choices=['text', 'hybrid'], default='text', help='SEARCH_TOOL for the runs')
+    parser.add_argument('--corpus', help='Existing source tree to search instead of the synthetic corpus')
+    parser.add_argument('--functions-per-file', type=int, default=40, help='Size of the synthetic corpus')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the corpus and stub LLM')
+    parser.add_argument('--output', default='benchmark.json', help='Result file')
+    parser.add_argument('--baseline', help='Earlier result file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative change reported as a regression')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.run_one:
+        print(json.dumps(run_one(json.loads(args.run_one))))
+        return
+
+    with tempfile.TemporaryDirectory(prefix="deep_research_bench_") as tmp:
+        if args.corpus:
+            corpus = os.path.abspath(args.corpus)
+            corpus_stats = {"path": corpus}
+        else:
+            corpus = os.path.join(tmp, "lwip")
+            corpus_stats = build_corpus(corpus, args.functions_per_file, args.seed)
+            corpus_stats["functions_per_file"] = args.functions_per_file
+        log(f"Corpus: {corpus_stats}")
+
+        runs = []
+        for depth in args.depth:
+            for breadth in args.breadth:
+                for repeat in range(args.repeat):
+                    workdir = os.path.join(tmp, f"b{breadth}_d{depth}_r{repeat}")
+                    os.makedirs(workdir)
+                    run = run_subprocess({
+                        "breadth": breadth, "depth": depth, "corpus": corpus, "workdir": workdir,
+                        "llm": args.llm, "recordings": os.path.abspath(args.recordings),
+                        "latency": args.latency, "search_tool": args.search_tool, "seed": args.seed,
+                        "budget_tokens": args.budget_tokens,
+                    })
+                    run["repeat"] = repeat
+                    runs.append(run)
+                    log(f"breadth={breadth} depth={depth} run={repeat}: {run['wall_seconds']:.2f}s, "
+                        f"{run['llm_calls']} LLM calls, {run['prompt_tokens']}+{run['completion_tokens']} tokens, "
+                        f"search {run['search_seconds']:.2f}s, peak RSS {run['peak_rss_kb']} KB"
+                        + (f", ERROR {run['error']}" if run["error"] else ""))
+
+    result = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "llm": args.llm,
+            "latency": args.latency,
+            "search_tool": args.search_tool,
+            "budget_tokens": args.budget_tokens,
+            "seed": args.seed,
+            "corpus": corpus_stats,
+        },
+        "runs": runs,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    log(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(runs, json.load(f), args.threshold)
+        for line in regressions:
+            log(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        log("No regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
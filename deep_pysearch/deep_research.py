@@ -1,10 +1,20 @@
 #!/usr/bin/env python3
 
 import asyncio
+import json
 import os
+import sys
 from typing import Dict, List, Any, Optional, Callable
 
-from llm_provider import generate_with_schema, get_model, trim_prompt
+from llm_provider import generate_with_schema, stream_with_schema, extract_and_parse_json, get_model, prompt_budget, fit_blocks
+from json_stream import JsonStringFieldExtractor
+from learning_store import dedupe_learnings
+from telemetry import Telemetry, telemetry, record_bytes_searched
+from journal import ResearchJournal
+
+# The text scanning engine is shared with the other tools, at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import text_scan
 
 # Function for consistent logging
 def log(*args):
@@ -15,49 +25,15 @@ class Tool:
     """Base class for tools that can be executed by the LLM to query the codebase."""
 
     @staticmethod
-    def full_text_search(query: str, directory: str) -> str:
-        """Searches for a query string in all *.c and *.h files under the given directory."""
-        results = []
-        context_lines = 3  # Number of lines to show before and after the match
-
-        # Skip build directories and other common directories to ignore
-        skip_dirs = {'build', 'build_esp32_default', '.git', 'cmake-build'}
-
-        for root, dirs, files in os.walk(directory):
-            # Skip build directories
-            dirs[:] = [d for d in dirs if d not in skip_dirs]
-
-            for file in files:
-                if file.endswith(".c") or file.endswith(".h"):
-                    filepath = os.path.join(root, file)
-                    # Skip files in build directories
-                    if any(skip_dir in filepath for skip_dir in skip_dirs):
-                        continue
-
-                    try:
-                        with open(filepath, "r", encoding="utf-8") as f:
-                            lines = f.readlines()
-                            for i, line in enumerate(lines):
-                                if query.lower() in line.lower():
-                                    # Calculate start and end indices for context
-                                    start_idx = max(0, i - context_lines)
-                                    end_idx = min(len(lines), i + context_lines + 1)
-
-                                    # Get the context lines
-                                    context = lines[start_idx:end_idx]
-
-                                    # Format the output with line numbers and highlight the match
-                                    context_str = "".join([
-                                        f"{j+1:4d} | {line.rstrip()}\n"
-                                        for j, line in enumerate(context, start=start_idx)
-                                    ])
-
-                                    results.append(f"Found match in: {filepath}\n{context_str}")
-                    except Exception as e:
-                        # Only report errors if the file actually exists
-                        if os.path.exists(filepath):
-                            results.append(f"Error reading {filepath}: {e}")
-        return "\n".join(results) if results else "No matches found."
+    def full_text_search(query: str, directory: str, max_results: Optional[int] = None) -> str:
+        """
+        Searches for a query string in all *.c and *.h files under the given directory.
+        The scan stops as soon as max_results matches were found.
+        """
+        return text_scan.full_text_search(
+            query, directory, max_results=max_results,
+            on_file=lambda filepath, size: record_bytes_searched(size)
+        )
 
     @staticmethod
     def limited_text_search(query: str, directory: str, max_hits: int = 10) -> str:
@@ -85,7 +61,8 @@ class Tool:
 
         while words and len(all_results) < max_hits:
             # Perform the search with the current query
-            result_text = Tool.full_text_search(current_query, directory)
+            # Enough to find max_hits new matches even if all seen ones come first
+            result_text = Tool.full_text_search(current_query, directory, max_results=max_hits + len(seen_matches))
             # If we got results, add them to our collection
             if result_text != "No matches found.":
                 # Split the results into individual matches
@@ -142,9 +119,82 @@ class Tool:
 
         return "\n".join(all_results[:max_hits])
 
+    @staticmethod
+    def semantic_search(queries: List[str], directory: str, max_hits: int = 10) -> List[List[Dict[str, Any]]]:
+        """
+        Finds the code chunks semantically closest to each query.
+
+        Uses the persistent vector index of the directory (built or updated on
+        first use) and embeds all queries in a single batch.
+
+        Args:
+            queries: The search queries
+            directory: The directory to search in
+            max_hits: Maximum number of chunks per query
+
+        Returns:
+            For each query, a list of chunk dicts (file, start, end, text, score)
+        """
+        from semantic_index import get_semantic_index
+        return get_semantic_index(os.path.abspath(directory)).search(queries, k=max_hits)
+
+    @staticmethod
+    def hybrid_search(queries: List[str], directory: str, max_hits: int = 10) -> List[str]:
+        """
+        Combines limited_text_search and semantic_search by reciprocal rank fusion.
+
+        Text hits that fall inside a semantic chunk vote for that chunk, so code
+        found by both tools ranks first and is returned only once.
+
+        Args:
+            queries: The search queries
+            directory: The directory to search in
+            max_hits: Maximum number of search results per query
+
+        Returns:
+            For each query, the fused results formatted like limited_text_search
+        """
+        from semantic_index import format_chunk, reciprocal_rank_fusion
+
+        semantic_results = Tool.semantic_search(queries, directory, max_hits)
+        fused_results = []
+        for query, chunks in zip(queries, semantic_results):
+            text_results = Tool.limited_text_search(query, directory, max_hits)
+            text_hits = [] if text_results == "No matches found." else [
+                "Found match in: " + hit for hit in text_results.split("Found match in: ") if hit.strip()
+            ]
+
+            items = {}
+            chunk_ranking = []
+            for chunk in chunks:
+                key = ("chunk", os.path.abspath(chunk["file"]), chunk["start"])
+                items[key] = format_chunk(chunk)
+                chunk_ranking.append(key)
+
+            text_ranking = []
+            for hit in text_hits:
+                lines = hit.split("\n")
+                filepath = os.path.abspath(lines[0].replace("Found match in: ", ""))
+                try:
+                    line_num = int(lines[1].split("|")[0].strip())
+                except (ValueError, IndexError):
+                    line_num = 0
+                key = ("text", filepath, line_num)
+                for chunk in chunks:
+                    if os.path.abspath(chunk["file"]) == filepath and chunk["start"] <= line_num <= chunk["end"]:
+                        key = ("chunk", filepath, chunk["start"])
+                        break
+                items.setdefault(key, hit)
+                if key not in text_ranking:
+                    text_ranking.append(key)
+
+            fused = reciprocal_rank_fusion([text_ranking, chunk_ranking])[:max_hits]
+            fused_results.append("\n".join(items[key].rstrip("\n") + "\n" for key, _ in fused) if fused else "No matches found.")
+        return fused_results
+
 # Type for research progress tracking
 class ResearchProgress:
-    def __init__(self, depth: int, breadth: int):
+    def __init__(self, depth: int, breadth: int, telemetry: Telemetry = telemetry):
         self.current_depth = depth
         self.total_depth = depth
         self.current_breadth = breadth
@@ -152,6 +202,7 @@ class ResearchProgress:
         self.current_query = None
         self.total_queries = 0
         self.completed_queries = 0
+        self.telemetry = telemetry
 
 # Function to generate research queries based on the user's input
 async def generate_research_queries(
@@ -162,17 +213,15 @@ async def generate_research_queries(
     """Generate research queries based on the user's input."""
     model = get_model()
 
-    learnings_text = ""
-    if learnings:
-        learnings_text = f"Here are some learnings from previous research, use them to generate more specific queries: {chr(10).join(learnings)}"
-
-    prompt = f"""Given the following prompt from the user, generate a list of research queries to investigate the topic.
+    learnings = [learning for learning in learnings or [] if learning]
+    learnings_intro = "Here are some learnings from previous research, use them to generate more specific queries: " if learnings else ""
+    template = f"""Given the following prompt from the user, generate a list of research queries to investigate the topic.
 Return a maximum of {num_queries} queries, but feel free to return less if the original prompt is clear.
 Make sure each query is unique and not similar to each other:
 
 <prompt>{query}</prompt>
 
-{learnings_text}"""
+{learnings_intro}{{stuff}}"""
 
     schema = {
         "type": "object",
@@ -199,6 +248,10 @@ Make sure each query is unique and not similar to each other:
         "required": ["queries"]
     }
 
+    # Share the tokens left after the template and schema across the learnings
+    budget = prompt_budget(template + chr(10) * len(learnings) + json.dumps(schema))
+    prompt = template.replace("{stuff}", chr(10).join(fit_blocks(learnings, budget)))
+
     result = generate_with_schema(model, prompt, schema)
     log(f"Created {len(result['queries'])} queries", result["queries"])
 
@@ -212,22 +265,7 @@ async def process_research_results(
     num_follow_up_questions: int = 3
 ) -> Dict[str, Any]:
     """Process research results and extract learnings and follow-up questions."""
-    model = await get_model()
-
-    # Format the results for processing
-    contents = [trim_prompt(content, 25000) for content in results if content]
-    log(f"Processing research for '{query}', found {len(contents)} results")
-    stuff=chr(10).join([f"<content>\n{content}\n</content>" for content in contents])
-    prompt = f"""Given the following contents from a research query <query>{query}</query>,
-generate a list of learnings from the contents. Return a maximum of {num_learnings} learnings,
-but feel free to return less if the contents are clear. Make sure each learning is unique and not similar to each other.
-The learnings should be concise and to the point, as detailed and information dense as possible.
-Make sure to include any entities like people, places, companies, products, things, etc in the learnings,
-as well as any exact metrics, numbers, or dates. The learnings will be used to research the topic further.
-
-<contents>
-{stuff}
-</contents>"""
+    model = get_model()
 
     schema = {
         "type": "object",
@@ -246,7 +284,30 @@ as well as any exact metrics, numbers, or dates. The learnings will be used to r
         "required": ["learnings", "followUpQuestions"]
     }
 
-    result = await generate_with_schema(model, prompt, schema)
+    # Fixed instructions first and the query and contents last, for provider prompt caching
+    template = f"""Given the following contents from a research query,
+generate a list of learnings from the contents. Return a maximum of {num_learnings} learnings,
+but feel free to return less if the contents are clear. Make sure each learning is unique and not similar to each other.
+The learnings should be concise and to the point, as detailed and information dense as possible.
+Make sure to include any entities like people, places, companies, products, things, etc in the learnings,
+as well as any exact metrics, numbers, or dates. The learnings will be used to research the topic further.
+
+<query>{query}</query>
+
+<contents>
+{{stuff}}
+</contents>"""
+
+    # Share the tokens left after the template and schema across all results
+    results = [content for content in results if content]
+    wrappers = "".join("<content>\n\n</content>\n" for _ in results)
+    budget = prompt_budget(template + wrappers + json.dumps(schema))
+    contents = fit_blocks(results, budget)
+    log(f"Processing research for '{query}', found {len(contents)} results")
+    stuff=chr(10).join([f"<content>\n{content}\n</content>" for content in contents])
+    prompt = template.replace("{stuff}", stuff)
+
+    result = generate_with_schema(model, prompt, schema)
     log(f"Created {len(result['learnings'])} learnings", result["learnings"])
 
     return result
@@ -257,35 +318,55 @@ async def search_local_data(query: str) -> List[str]:
     Search local data sources based on a query using the Tool class.
     Performs a codebase search using the limited_text_search functionality.
     """
-    log(f"Searching local data for: {query}")
+    return (await search_local_data_many([query]))[0]
+
+async def search_local_data_many(queries: List[str]) -> List[List[str]]:
+    """
+    Search local data sources for several queries at once.
+
+    SEARCH_TOOL selects the tool: "text" (default) runs limited_text_search,
+    "hybrid" fuses it with the semantic index, embedding all queries in one batch.
+    """
+    for query in queries:
+        log(f"Searching local data for: {query}")
 
     # Define the directory to search - adjust this to your codebase path
     directory = os.environ.get("SEARCH_DIRECTORY", os.getcwd())
 
     # Use the Tool class to perform the search
-    search_results = Tool.limited_text_search(query, directory, max_hits=10)
-
-    # Convert the string results into a list to match the expected return type
-    if search_results == "No matches found.":
-        return [f"No matches found for query: {query}"]
+    if os.environ.get("SEARCH_TOOL", "text") == "hybrid":
+        all_search_results = Tool.hybrid_search(queries, directory, max_hits=10)
     else:
-        # Split the results into individual matches for better processing
-        results = search_results.split("Found match in: ")
-        results = ["Found match in: " + r for r in results if r.strip()]
-        return results
+        all_search_results = [Tool.limited_text_search(query, directory, max_hits=10) for query in queries]
+
+    all_results = []
+    for query, search_results in zip(queries, all_search_results):
+        # Convert the string results into a list to match the expected return type
+        if search_results == "No matches found.":
+            all_results.append([f"No matches found for query: {query}"])
+        else:
+            # Split the results into individual matches for better processing
+            results = search_results.split("Found match in: ")
+            all_results.append(["Found match in: " + r for r in results if r.strip()])
+    return all_results
 
 # Function to write the final report
 async def write_final_report(
     prompt: str,
     learnings: List[str],
-    sources: List[str]
+    sources: List[str],
+    stream: bool = False,
+    output_path: Optional[str] = None
 ) -> str:
-    """Write a final research report based on the learnings."""
-    model = await get_model()
+    """
+    Write a final research report based on the learnings.
 
-    learnings_text = chr(10).join([f"<learning>\n{learning}\n</learning>" for learning in learnings])
+    In streaming mode the report text is extracted from the JSON completion
+    while it is generated and written to stdout and `output_path` as it arrives.
+    """
+    model = get_model()
 
-    prompt_text = f"""Given the following prompt from the user, write a final report on the topic using the learnings from research.
+    template = f"""Given the following prompt from the user, write a final report on the topic using the learnings from research.
 Make it as detailed as possible, aim for 3 or more pages, include ALL the learnings from research:
 
 <prompt>{prompt}</prompt>
@@ -293,7 +374,7 @@ Make it as detailed as possible, aim for 3 or more pages, include ALL the learni
 Here are all the learnings from previous research:
 
 <learnings>
-{learnings_text}
+{{stuff}}
 </learnings>"""
 
     schema = {
@@ -307,12 +388,49 @@ Here are all the learnings from previous research:
         "required": ["reportMarkdown"]
     }
 
-    result = await generate_with_schema(model, prompt_text, schema)
+    # Share the tokens left after the template and schema across the learnings
+    learnings = [learning for learning in learnings if learning]
+    wrappers = "".join("<learning>\n\n</learning>\n" for _ in learnings)
+    budget = prompt_budget(template + wrappers + json.dumps(schema))
+    learnings_text = chr(10).join([f"<learning>\n{learning}\n</learning>" for learning in fit_blocks(learnings, budget)])
+    prompt_text = template.replace("{stuff}", learnings_text)
 
     # Append the sources section to the report
     sources_section = f"\n\n## Sources\n\n{chr(10).join([f'- {source}' for source in sources])}"
 
-    return result["reportMarkdown"] + sources_section
+    if not stream:
+        result = generate_with_schema(model, prompt_text, schema)
+        return result["reportMarkdown"] + sources_section
+
+    extractor = JsonStringFieldExtractor("reportMarkdown")
+    raw = []
+    out = open(output_path, "w", encoding="utf-8") if output_path else None
+    try:
+        for chunk in stream_with_schema(model, prompt_text, schema):
+            raw.append(chunk)
+            text = extractor.feed(chunk)
+            if text:
+                print(text, end="", flush=True)
+                if out:
+                    out.write(text)
+                    out.flush()
+
+        report = extractor.value
+        if not extractor.found:
+            # The model did not stream the expected JSON, parse what we got
+            report = extract_and_parse_json("".join(raw))["reportMarkdown"]
+            print(report, end="", flush=True)
+            if out:
+                out.write(report)
+
+        print(sources_section)
+        if out:
+            out.write(sources_section)
+    finally:
+        if out:
+            out.close()
+
+    return report + sources_section
 
 
 # Main deep research function
@@ -322,17 +440,23 @@ async def deep_research(
     depth: int,
     learnings: List[str] = None,
     sources: List[str] = None,
-    on_progress: Callable[[ResearchProgress], None] = None
+    on_progress: Callable[[ResearchProgress], None] = None,
+    telemetry: Telemetry = telemetry,
+    journal: Optional[ResearchJournal] = None,
+    node_path: str = ""
 ) -> Dict[str, List[str]]:
     """
     Perform deep research by iteratively generating queries, searching local data,
     and processing results to generate learnings.
+
+    With a journal, every generated query list and processed query is persisted
+    as soon as it is done, and steps already in the journal are not repeated.
     """
     learnings = learnings or []
     sources = sources or []
 
     # Initialize progress tracking
-    progress = ResearchProgress(depth, breadth)
+    progress = ResearchProgress(depth, breadth, telemetry)
 
     def report_progress(update: Dict[str, Any]):
         for key, value in update.items():
@@ -341,36 +465,79 @@ async def deep_research(
             on_progress(progress)
 
     # Generate research queries based on the initial query
-    research_queries = await generate_research_queries(
-        query=query,
-        num_queries=breadth,
-        learnings=learnings
-    )
+    research_queries = journal.get_queries(node_path, query) if journal is not None else None
+    if research_queries is None:
+        with progress.telemetry.stage("query_generation", depth):
+            research_queries = await generate_research_queries(
+                query=query,
+                num_queries=breadth,
+                learnings=learnings
+            )
+        if journal is not None:
+            journal.record_queries(node_path, query, research_queries)
 
     log(f"Research queries: {research_queries}")
-    exit(0)
     report_progress({
         "total_queries": len(research_queries),
         "current_query": research_queries[0]["query"] if research_queries else None
     })
 
+    child_paths = [f"{node_path}.{i}" if node_path else str(i) for i in range(len(research_queries))]
+    completed_nodes = [
+        journal.get_node(child_path, research_query["query"]) if journal is not None else None
+        for child_path, research_query in zip(child_paths, research_queries)
+    ]
+
+    # Search for all pending queries at once, so query embeddings are computed in one batch
+    pending = [rq["query"] for rq, completed in zip(research_queries, completed_nodes) if not completed]
+    prefetched = {}
+    if pending:
+        try:
+            with progress.telemetry.stage("local_search", depth):
+                prefetched = dict(zip(pending, await search_local_data_many(pending)))
+        except Exception as e:
+            log(f"Error searching local data: {str(e)}")
+
     # Process each research query
     all_results = []
     for i, research_query in enumerate(research_queries):
+        child_path = child_paths[i]
         try:
-            # Search local data sources for information
-            search_results = await search_local_data(research_query["query"])
-
-            # Process the search results to extract learnings and follow-up questions
-            processed_results = await process_research_results(
-                query=research_query["query"],
-                results=search_results,
-                num_follow_up_questions=max(1, breadth // 2)
-            )
+            completed = completed_nodes[i]
+            if completed:
+                log(f"Resuming '{research_query['query']}' from journal")
+                processed_results = {
+                    "learnings": completed["learnings"],
+                    "followUpQuestions": completed["followUpQuestions"]
+                }
+            else:
+                # Search local data sources for information
+                search_results = prefetched.get(research_query["query"])
+                if search_results is None:
+                    with progress.telemetry.stage("local_search", depth):
+                        search_results = await search_local_data(research_query["query"])
+
+                # Process the search results to extract learnings and follow-up questions
+                with progress.telemetry.stage("result_processing", depth):
+                    processed_results = await process_research_results(
+                        query=research_query["query"],
+                        results=search_results,
+                        num_follow_up_questions=max(1, breadth // 2)
+                    )
+
+                if journal is not None:
+                    journal.record_node(
+                        child_path,
+                        research_query["query"],
+                        research_query["researchGoal"],
+                        search_results,
+                        processed_results["learnings"],
+                        processed_results["followUpQuestions"]
+                    )
 
             # Update the lists of learnings and sources
             new_learnings = processed_results["learnings"]
-            all_learnings = list(set(learnings + new_learnings))
+            all_learnings = dedupe_learnings(learnings + new_learnings)
             all_sources = list(set(sources + [f"Local search for: {research_query['query']}"]))
 
             # If we still have depth to go, continue researching
@@ -399,7 +566,10 @@ Follow-up research directions: {chr(10).join(processed_results["followUpQuestion
                     depth=new_depth,
                     learnings=all_learnings,
                     sources=all_sources,
-                    on_progress=on_progress
+                    on_progress=on_progress,
+                    telemetry=telemetry,
+                    journal=journal,
+                    node_path=child_path
                 )
 
                 all_results.append(deeper_results)
@@ -423,7 +593,7 @@ Follow-up research directions: {chr(10).join(processed_results["followUpQuestion
             })
 
     # Combine results from all research paths
-    combined_learnings = list(set(sum([r.get("learnings", []) for r in all_results], [])))
+    combined_learnings = dedupe_learnings(sum([r.get("learnings", []) for r in all_results], []))
     combined_sources = list(set(sum([r.get("sources", []) for r in all_results], [])))
 
     return {
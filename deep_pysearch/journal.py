@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+class ResearchJournal:
+    """
+    Append-only JSON lines journal of the research tree.
+
+    Every finished step is written as one line and flushed to disk right away,
+    so a run that dies halfway keeps everything done so far. Entries are keyed
+    by the node path in the tree ("" for the root, "0", "0.1", ...) together
+    with the query text, so a resumed run only reuses work for the same question.
+
+    Entry types:
+        queries: the research queries generated for a node
+        node: a processed research query (search hits, learnings, follow-ups)
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        """
+        Open a journal.
+
+        Args:
+            path: Journal file path
+            resume: Load existing entries; otherwise the journal starts empty
+        """
+        self.path = path
+        self._entries: Dict[tuple, Dict[str, Any]] = {}
+
+        if resume and os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+            # A run killed mid-write leaves a last line without its newline, cut it off
+            # so that the next entry does not get appended to it
+            complete = data.rfind(b"\n") + 1
+            for line in data[:complete].splitlines():
+                try:
+                    entry = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue
+                self._entries[(entry["type"], entry["path"], entry["query"])] = entry
+            if complete < len(data):
+                with open(path, "r+b") as f:
+                    f.truncate(complete)
+            self._file = open(path, "a", encoding="utf-8")
+        else:
+            self._file = open(path, "w", encoding="utf-8")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self):
+        self._file.close()
+
+    def _append(self, entry: Dict[str, Any]):
+        self._entries[(entry["type"], entry["path"], entry["query"])] = entry
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def get_queries(self, path: str, query: str) -> Optional[List[Dict[str, str]]]:
+        """Research queries generated earlier for this node, or None."""
+        entry = self._entries.get(("queries", path, query))
+        return entry["queries"] if entry else None
+
+    def record_queries(self, path: str, query: str, queries: List[Dict[str, str]]):
+        """Persist the research queries generated for a node."""
+        self._append({"type": "queries", "path": path, "query": query, "queries": queries})
+
+    def get_node(self, path: str, query: str) -> Optional[Dict[str, Any]]:
+        """A processed research query from an earlier run, or None."""
+        return self._entries.get(("node", path, query))
+
+    def record_node(
+        self,
+        path: str,
+        query: str,
+        research_goal: str,
+        search_results: List[str],
+        learnings: List[str],
+        follow_up_questions: List[str]
+    ):
+        """Persist a processed research query as soon as it is finished."""
+        self._append({
+            "type": "node",
+            "path": path,
+            "query": query,
+            "researchGoal": research_goal,
+            "searchResults": search_results,
+            "learnings": learnings,
+            "followUpQuestions": follow_up_questions,
+        })
+
+    def tree(self) -> Dict[str, Any]:
+        """
+        Rebuild the research tree from the journal.
+
+        Returns:
+            Nested dict with the node entry (None for the root) and its children by path
+        """
+        root = {"path": "", "node": None, "children": {}}
+        nodes = sorted(
+            (entry for (kind, _, _), entry in self._entries.items() if kind == "node"),
+            key=lambda entry: [int(part) for part in entry["path"].split(".")]
+        )
+        for entry in nodes:
+            parent = root
+            parts = entry["path"].split(".")
+            for depth in range(1, len(parts)):
+                prefix = ".".join(parts[:depth])
+                parent = parent["children"].setdefault(prefix, {"path": prefix, "node": None, "children": {}})
+            child = parent["children"].setdefault(entry["path"], {"path": entry["path"], "node": None, "children": {}})
+            child["node"] = entry
+        return root
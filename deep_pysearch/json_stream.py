@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+
+import json
+import re
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_SPECIAL = re.compile(r'["\\]')
+
+def _hex(digits: str) -> int:
+    """Parse the four digits of a \\u escape, invalid ones decode to U+FFFD."""
+    try:
+        return int(digits, 16)
+    except ValueError:
+        return 0xFFFD
+
+class JsonStringFieldExtractor:
+    """
+    Incrementally extracts the value of one string field from streamed JSON.
+
+    Feed the completion text chunk by chunk; each call returns the newly
+    decoded part of the field value, so it can be shown while the model is
+    still generating. Escape sequences split across chunks are held back
+    until complete.
+
+    Example:
+        extractor = JsonStringFieldExtractor("reportMarkdown")
+        for chunk in stream:
+            print(extractor.feed(chunk), end="")
+    """
+
+    def __init__(self, key: str):
+        self._needle = f'"{key}"'
+        self._state = "search"  # search -> colon -> quote -> value -> done
+        self._buffer = ""
+        self.value_parts = []
+
+    @property
+    def found(self) -> bool:
+        """True once the opening quote of the value has been seen."""
+        return self._state in ("value", "done")
+
+    @property
+    def done(self) -> bool:
+        """True once the closing quote of the value has been seen."""
+        return self._state == "done"
+
+    @property
+    def value(self) -> str:
+        """The decoded value extracted so far."""
+        return "".join(self.value_parts)
+
+    def feed(self, chunk: str) -> str:
+        """
+        Consume the next piece of the completion.
+
+        Args:
+            chunk: Text delta from the stream
+
+        Returns:
+            Newly decoded text of the field value (may be empty)
+        """
+        if self._state == "done" or not chunk:
+            return ""
+        self._buffer += chunk
+        out = []
+
+        while self._buffer and self._state != "done":
+            if self._state == "search":
+                index = self._buffer.find(self._needle)
+                if index < 0:
+                    # Keep a tail in case the key is split across chunks
+                    self._buffer = self._buffer[-(len(self._needle) - 1):]
+                    break
+                self._buffer = self._buffer[index + len(self._needle):]
+                self._state = "colon"
+            elif self._state in ("colon", "quote"):
+                stripped = self._buffer.lstrip()
+                if not stripped:
+                    self._buffer = ""
+                    break
+                expected = ":" if self._state == "colon" else '"'
+                if stripped[0] != expected:
+                    # The key was a value somewhere else, keep looking
+                    self._buffer = stripped
+                    self._state = "search"
+                    continue
+                self._buffer = stripped[1:]
+                self._state = "quote" if self._state == "colon" else "value"
+            else:
+                if not self._decode_value(out):
+                    break
+
+        text = "".join(out)
+        if text:
+            self.value_parts.append(text)
+        return text
+
+    def _decode_value(self, out: list) -> bool:
+        """Decode as much of the buffered string value as possible, returns False when more input is needed."""
+        buffer = self._buffer
+        match = _SPECIAL.search(buffer)
+        if match is None:
+            out.append(buffer)
+            self._buffer = ""
+            return False
+
+        index = match.start()
+        out.append(buffer[:index])
+        if buffer[index] == '"':
+            self._buffer = buffer[index + 1:]
+            self._state = "done"
+            return True
+
+        # Backslash escape
+        if index + 1 >= len(buffer):
+            self._buffer = buffer[index:]
+            return False
+        code = buffer[index + 1]
+        if code != "u":
+            out.append(_ESCAPES.get(code, code))
+            self._buffer = buffer[index + 2:]
+            return True
+
+        if index + 6 > len(buffer):
+            self._buffer = buffer[index:]
+            return False
+        codepoint = _hex(buffer[index + 2:index + 6])
+        end = index + 6
+        if 0xD800 <= codepoint < 0xDC00:
+            # High surrogate, wait for the low half
+            if end + 6 > len(buffer):
+                self._buffer = buffer[index:]
+                return False
+            if buffer[end:end + 2] == "\\u":
+                low = _hex(buffer[end + 2:end + 6])
+                if 0xDC00 <= low < 0xE000:
+                    codepoint = 0x10000 + ((codepoint - 0xD800) << 10) + (low - 0xDC00)
+                    end += 6
+        if 0xD800 <= codepoint < 0xE000:
+            # Unpaired surrogate, not encodable as UTF-8
+            codepoint = 0xFFFD
+        out.append(chr(codepoint))
+        self._buffer = buffer[end:]
+        return True
+
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+_NUMBER_CHARS = re.compile(r"[-+.eE0-9]*")
+_WHITESPACE = re.compile(r"[ \t\r\n]*")
+# Characters ending a plain run inside a string: quote, backslash and the control characters JSON forbids there
+_STRING_SPECIAL = re.compile(r'["\\\x00-\x1f]')
+_HEX4 = re.compile(r"[0-9a-fA-F]{4}")
+_LITERALS = {"t": "true", "f": "false", "n": "null"}
+_FIRST_CHAR_TYPES = {'"': "string", "t": "boolean", "f": "boolean", "n": "null", "{": "object", "[": "array"}
+
+class JsonStreamError(ValueError):
+    """The streamed JSON is malformed or does not match the schema."""
+
+    def __init__(self, message: str, path: str = ""):
+        super().__init__(f"{message} at {path or '<root>'}")
+        self.path = path
+
+def _type_matches(schema: dict, json_type: str) -> bool:
+    expected = schema.get("type")
+    if expected is None:
+        return True
+    expected = expected if isinstance(expected, list) else [expected]
+    return json_type in expected or (json_type == "integer" and "number" in expected)
+
+class IncrementalJsonParser:
+    """
+    Incrementally parses and validates a JSON object from streamed text.
+
+    Every value is checked against the schema as soon as its first character
+    arrives (type), and objects as soon as they close (required properties),
+    so a generation that goes wrong can be aborted without waiting for the
+    rest of it. Text before the top-level value, e.g. a markdown fence or a
+    preamble, and text after it are ignored. A preamble containing a brace
+    ("Results for {topic}:", a C snippet) is skipped too: an error before the
+    first member of the top-level value is parsed restarts the parse at the
+    next opener instead of aborting. Each character is scanned about once,
+    the final value is decoded with json.loads.
+
+    Supported schema keywords: type, properties, required, items, enum.
+
+    Example:
+        parser = IncrementalJsonParser(schema)
+        for chunk in stream:
+            parser.feed(chunk)  # raises JsonStreamError on the first violation
+        result = parser.close()
+    """
+
+    def __init__(self, schema: dict = None):
+        self.schema = schema or {}
+        self._reset()
+
+    def _reset(self):
+        self._parts = []        # consumed text of the top-level value
+        self._text = ""         # text not consumed yet
+        self._pos = 0
+        self._started = False
+        self._done = False
+        self._stack = []        # open objects and arrays
+        self._expect = "value"  # value, key, colon, next (after a value) or string (inside one)
+        self._value_schema = self.schema
+        self._value_path = ""
+        self._committed = False  # a member of the top-level value was accepted, errors are final
+
+    @property
+    def done(self) -> bool:
+        """True once the top-level value is complete."""
+        return self._done
+
+    @property
+    def value(self):
+        """The parsed top-level value, once done."""
+        if not self._done:
+            raise JsonStreamError("Incomplete JSON", self._path())
+        return json.loads("".join(self._parts))
+
+    def feed(self, chunk: str):
+        """
+        Consume the next piece of the completion.
+
+        Args:
+            chunk: Text delta from the stream
+
+        Raises:
+            JsonStreamError: On the first syntax error or schema violation
+        """
+        if self._done or not chunk:
+            return
+        self._text += chunk
+        while True:
+            if not self._started:
+                # Skip everything before the top-level value
+                index = self._find_start()
+                if index < 0:
+                    return
+                self._text = self._text[index:]
+                self._started = True
+            try:
+                while not self._done and self._step():
+                    pass
+                break
+            except JsonStreamError:
+                if self._committed:
+                    raise
+                # The opener was part of a preamble, start over after it
+                text = "".join(self._parts) + self._text
+                self._reset()
+                self._text = text[1:]
+        # Move the consumed text out of the buffer, only a pending token stays
+        self._parts.append(self._text[:self._pos])
+        self._text = "" if self._done else self._text[self._pos:]
+        self._pos = 0
+
+    def close(self):
+        """
+        Signal the end of the stream.
+
+        Returns:
+            The parsed top-level value
+
+        Raises:
+            JsonStreamError: If the stream ended before the value was complete
+        """
+        if not self._done:
+            raise JsonStreamError("Truncated JSON", self._path())
+        return self.value
+
+    def _find_start(self) -> int:
+        openers = {"object": "{", "array": "["}
+        expected = self.schema.get("type")
+        expected = expected if isinstance(expected, list) else [expected] if expected else ["object", "array"]
+        indexes = [self._text.find(openers[t]) for t in expected if t in openers]
+        indexes = [i for i in indexes if i >= 0]
+        return min(indexes) if indexes else -1
+
+    def _path(self) -> str:
+        if self._expect in ("value", "string"):
+            return self._value_path
+        return self._stack[-1]["path"] if self._stack else ""
+
+    def _string_end(self, pos: int) -> int:
+        """Offset after the closing quote of the string starting at pos, or -1 if incomplete."""
+        i = pos + 1
+        while True:
+            match = _STRING_SPECIAL.search(self._text, i)
+            if match is None:
+                return -1
+            i = match.start()
+            if self._text[i] == '"':
+                return i + 1
+            i = self._escape_end(i)
+            if i < 0:
+                return -1
+
+    def _escape_end(self, i: int) -> int:
+        """
+        Offset after the escape sequence at i, or -1 if it is incomplete.
+
+        Raises:
+            JsonStreamError: On a control character or an invalid escape, which json.loads would reject
+        """
+        text = self._text
+        if text[i] != "\\":
+            raise JsonStreamError(f"Control character {text[i]!r} in string", self._path())
+        if i + 1 >= len(text):
+            return -1
+        code = text[i + 1]
+        if code != "u":
+            if code not in _ESCAPES:
+                raise JsonStreamError(f"Invalid escape {text[i:i + 2]!r} in string", self._path())
+            return i + 2
+        digits = text[i + 2:i + 6]
+        if not _HEX4.match(digits):
+            if len(digits) < 4 and all(c in "0123456789abcdefABCDEF" for c in digits):
+                return -1
+            raise JsonStreamError(f"Invalid escape {text[i:i + 6]!r} in string", self._path())
+        return i + 6
+
+    def _step(self) -> bool:
+        """Consume one token, returns False when more input is needed."""
+        text = self._text
+        if self._expect == "string":
+            # Inside a string value, consumed text is committed so long strings are scanned once
+            match = _STRING_SPECIAL.search(text, self._pos)
+            if match is None:
+                self._pos = len(text)
+                return False
+            i = match.start()
+            if text[i] == '"':
+                self._pos = i + 1
+                self._expect = "next"
+                return True
+            end = self._escape_end(i)
+            if end < 0:
+                self._pos = i
+                return False
+            self._pos = end
+            return True
+
+        self._pos = _WHITESPACE.match(text, self._pos).end()
+        pos = self._pos
+        if pos >= len(text):
+            return False
+        char = text[pos]
+        frame = self._stack[-1] if self._stack else None
+
+        if self._expect == "value":
+            return self._start_value(char)
+
+        if self._expect == "key":
+            if char == "}" and not frame["keys"] and frame["allow_close"]:
+                return self._close_container()
+            if char != '"':
+                raise JsonStreamError(f"Expected a property name, got {char!r}", frame["path"])
+            end = self._string_end(pos)
+            if end < 0:
+                return False
+            key = json.loads(text[pos:end])
+            frame["keys"].add(key)
+            frame["key"] = key
+            self._pos = end
+            self._expect = "colon"
+            return True
+
+        if self._expect == "colon":
+            if char != ":":
+                raise JsonStreamError(f"Expected ':', got {char!r}", frame["path"])
+            self._pos += 1
+            properties = frame["schema"].get("properties", {})
+            self._value_schema = properties.get(frame["key"], {})
+            self._value_path = f"{frame['path']}.{frame['key']}" if frame["path"] else frame["key"]
+            self._expect = "value"
+            return True
+
+        # After a value inside a container: "," or the closing bracket
+        closer = "}" if frame["kind"] == "object" else "]"
+        if char == closer:
+            return self._close_container()
+        if char != ",":
+            raise JsonStreamError(f"Expected ',' or '{closer}', got {char!r}", frame["path"])
+        self._pos += 1
+        if frame["kind"] == "object":
+            self._expect = "key"
+            frame["allow_close"] = False
+        else:
+            self._expect_item(frame)
+        return True
+
+    def _expect_item(self, frame: dict):
+        self._value_schema = frame["schema"].get("items", {})
+        self._value_path = f"{frame['path']}[{frame['count']}]"
+        frame["count"] += 1
+        self._expect = "value"
+
+    def _start_value(self, char: str) -> bool:
+        schema, path = self._value_schema, self._value_path
+        frame = self._stack[-1] if self._stack else None
+        if char == "]" and frame and frame["kind"] == "array" and frame["count"] == 1:
+            # Empty array
+            frame["count"] = 0
+            return self._close_container()
+
+        if char not in '"{[-tfn' and not char.isdigit():
+            raise JsonStreamError(f"Unexpected character {char!r}", path)
+
+        # Check the type on the first character, before the value is complete
+        json_type = _FIRST_CHAR_TYPES.get(char, "number")
+        if not _type_matches(schema, json_type) and not (json_type == "number" and _type_matches(schema, "integer")):
+            raise JsonStreamError(f"Expected {schema.get('type')}, got {json_type}", path)
+        if len(self._stack) == 1:
+            self._committed = True
+
+        text, pos = self._text, self._pos
+        if char in "{[":
+            self._pos += 1
+            new_frame = {"kind": json_type, "schema": schema, "path": path, "keys": set(), "key": None,
+                         "count": 0, "allow_close": True}
+            self._stack.append(new_frame)
+            if json_type == "object":
+                self._expect = "key"
+            else:
+                self._expect_item(new_frame)
+            return True
+
+        if char == '"':
+            if "enum" not in schema:
+                self._pos += 1
+                self._expect = "string"
+                return True
+            end = self._string_end(pos)
+            if end < 0:
+                return False
+        elif char not in _LITERALS:
+            end = _NUMBER_CHARS.match(text, pos).end()
+            if end >= len(text):
+                # The number may continue in the next chunk
+                return False
+            match = _NUMBER.fullmatch(text, pos, end)
+            if match is None:
+                raise JsonStreamError(f"Invalid number {text[pos:end]!r}", path)
+            if not match.group().lstrip("-").isdigit() and not _type_matches(schema, "number"):
+                raise JsonStreamError(f"Expected {schema.get('type')}, got number", path)
+        else:
+            literal = _LITERALS[char]
+            candidate = text[pos:pos + len(literal)]
+            if not literal.startswith(candidate):
+                raise JsonStreamError(f"Invalid literal {candidate!r}", path)
+            if len(candidate) < len(literal):
+                return False
+            end = pos + len(literal)
+
+        if "enum" in schema and json.loads(text[pos:end]) not in schema["enum"]:
+            raise JsonStreamError(f"Value {text[pos:end]} not in {schema['enum']}", path)
+        self._pos = end
+        self._expect = "next"
+        return True
+
+    def _close_container(self) -> bool:
+        frame = self._stack.pop()
+        if frame["kind"] == "object":
+            missing = [key for key in frame["schema"].get("required", []) if key not in frame["keys"]]
+            if missing:
+                raise JsonStreamError(f"Missing required properties {missing}", frame["path"])
+        self._pos += 1
+        self._expect = "next"
+        if not self._stack:
+            self._done = True
+        return True
+
+def validate(value, schema: dict):
+    """
+    Validate an already parsed value against a schema.
+
+    Raises:
+        JsonStreamError: If the value does not match the schema
+    """
+    parser = IncrementalJsonParser(schema)
+    parser.feed(json.dumps(value))
+    parser.close()
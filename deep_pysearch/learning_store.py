@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import re
+from typing import Dict, Iterable, List, Optional
+
+from llm_provider import embed_texts
+
+# Cosine similarity above which two learnings are considered the same
+DEFAULT_SIMILARITY_THRESHOLD = 0.9
+
+# Embeddings are cached by text, learnings get passed down the research tree repeatedly
+_embedding_cache: Dict[str, List[float]] = {}
+
+def information_density(text: str) -> float:
+    """
+    Score how much information a learning carries.
+
+    Distinct words count once, numbers and code identifiers (names with
+    underscores, digits or mixed case, e.g. TCP_WND or tcp_rexmit) count
+    twice since those are what the report needs to cite.
+
+    Args:
+        text: The learning to score
+
+    Returns:
+        Information density score, higher is better
+    """
+    words = set(re.findall(r"\w+", text))
+    specific = [w for w in words if "_" in w or any(c.isdigit() for c in w) or (w != w.lower() and w != w.capitalize())]
+    return len(words) + len(specific)
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    # Vectors are already normalized by embed_texts
+    return sum(x * y for x, y in zip(a, b))
+
+class LearningStore:
+    """
+    Collection of learnings that merges near-duplicates by embedding similarity.
+
+    When a new learning is closer than the threshold to a stored one, only the
+    more information-dense of the two is kept, in the position of the first.
+    """
+
+    def __init__(self, learnings: Optional[Iterable[str]] = None, threshold: float = DEFAULT_SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self._learnings: List[str] = []
+        self._vectors: List[List[float]] = []
+        if learnings:
+            self.add(learnings)
+
+    def __len__(self) -> int:
+        return len(self._learnings)
+
+    @property
+    def learnings(self) -> List[str]:
+        return list(self._learnings)
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        missing = [t for t in dict.fromkeys(texts) if t not in _embedding_cache]
+        for text, vector in zip(missing, embed_texts(missing)):
+            _embedding_cache[text] = vector
+        return [_embedding_cache[t] for t in texts]
+
+    def novelty(self, learnings: Iterable[str]) -> float:
+        """
+        Score how much new information learnings would add to the store.
+
+        Args:
+            learnings: Candidate learnings (not added)
+
+        Returns:
+            Mean cosine distance of each learning to its closest stored one,
+            1.0 for an empty store and 0.0 if there are no learnings
+        """
+        texts = [l.strip() for l in learnings if l and l.strip()]
+        if not texts:
+            return 0.0
+        if not self._vectors:
+            return 1.0
+        distances = [1.0 - max(_cosine(vector, stored) for stored in self._vectors) for vector in self._embed(texts)]
+        return max(0.0, sum(distances) / len(distances))
+
+    def add(self, learnings: Iterable[str]) -> List[str]:
+        """
+        Add learnings to the store, merging near-duplicates.
+
+        Args:
+            learnings: Learnings to add
+
+        Returns:
+            The learnings that were stored as new entries
+        """
+        texts = [l.strip() for l in learnings if l and l.strip()]
+        added = []
+        for text, vector in zip(texts, self._embed(texts)):
+            best_index, best_score = -1, -1.0
+            for i, stored in enumerate(self._vectors):
+                score = _cosine(vector, stored)
+                if score > best_score:
+                    best_index, best_score = i, score
+
+            if best_score >= self.threshold:
+                if information_density(text) > information_density(self._learnings[best_index]):
+                    self._learnings[best_index] = text
+                    self._vectors[best_index] = vector
+                continue
+
+            self._learnings.append(text)
+            self._vectors.append(vector)
+            added.append(text)
+        return added
+
+def dedupe_learnings(learnings: Iterable[str], threshold: float = DEFAULT_SIMILARITY_THRESHOLD) -> List[str]:
+    """
+    Merge near-duplicate learnings, keeping the most information-dense variant.
+
+    Args:
+        learnings: Learnings to deduplicate, in order
+        threshold: Cosine similarity above which learnings are merged
+
+    Returns:
+        Deduplicated learnings in first-seen order
+    """
+    return LearningStore(learnings, threshold).learnings
@@ -1,35 +1,65 @@
 #!/usr/bin/env python3
 
 import os
+import re
+import sys
 import json
-from typing import Any, Dict, Optional
+import math
+import zlib
+import time
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional
 from datetime import datetime
 
-from openai import OpenAI
 from dotenv import load_dotenv
 
 from system_prompt import system_prompt
+from telemetry import record_usage, record_retry
+from json_stream import IncrementalJsonParser, JsonStreamError, validate
+
+# The record/replay layer is shared with the other tools, at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from llm_replay import openai_client
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
 
 # Load environment variables
 load_dotenv()
 
-# Constants
-MIN_CHUNK_SIZE = 140
+# Constants (all sizes are in tokens)
 DEFAULT_CONTEXT_SIZE = 128000
+DEFAULT_RESPONSE_RESERVE = 8192
+# Rough chars-per-token ratio used when no tokenizer is available
+CHARS_PER_TOKEN = 4
+# Dimension of the hashed bag-of-words vectors used without sentence-transformers
+HASHED_EMBEDDING_DIM = 1024
 
 # Get configuration from environment variables
 API_KEY = os.getenv("API_KEY")
 BASE_URL = os.getenv("BASE_URL", "https://api.openai.com/v1")
 MODEL = os.getenv("MODEL", "gpt-4o-mini")
+CONTEXT_SIZE = int(os.getenv("CONTEXT_SIZE", DEFAULT_CONTEXT_SIZE))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "thenlper/gte-small")
+# Extra attempts for a completion that does not match its schema
+MAX_SCHEMA_RETRIES = int(os.getenv("MAX_SCHEMA_RETRIES", "2"))
 
 def create_openai_client():
     """
     Creates an OpenAI client using environment variables.
+    Honours LLM_REPLAY_MODE to record or replay the completions.
 
     Returns:
         OpenAI client instance
     """
-    return OpenAI(
+    return openai_client(
         api_key=API_KEY,
         base_url=BASE_URL
     )
@@ -50,6 +80,30 @@ def get_model() -> Dict[str, Any]:
         "endpoint": BASE_URL
     }
 
+def build_messages(prompt: str, schema: Dict[str, Any]) -> List[Dict[str, str]]:
+    """
+    Lay out a structured-output request for provider prompt caching.
+
+    The system prompt, the JSON instructions and the schema do not change
+    between calls of the same kind, so they come first and are serialized
+    byte for byte the same way every time. Only the user message varies.
+    Servers with prefix caching (OpenAI, vLLM, llama.cpp) then reuse the
+    prefix instead of processing it again.
+
+    Args:
+        prompt: Instructions followed by the variable content of the request
+        schema: JSON schema of the expected response
+
+    Returns:
+        Chat messages
+    """
+    return [
+        {"role": "system", "content": system_prompt()
+            + "\nPlease format your response as JSON, **exactly** according to the provided schema."
+            + "\n\nRespond using JSON format with this schema provided\n" + json.dumps(schema, sort_keys=True)},
+        {"role": "user", "content": prompt}
+    ]
+
 def generate_with_schema(
     model: Dict[str, Any],
     prompt: str,
@@ -59,6 +113,10 @@ def generate_with_schema(
     """
     Generate a response from the LLM with structured output based on a JSON schema.
 
+    The completion is streamed and validated against the schema while it is
+    generated. A malformed generation is aborted at the first violation and
+    requested again, up to MAX_SCHEMA_RETRIES times.
+
     Args:
         model: Model configuration dict
         prompt: The prompt to send to the model
@@ -68,37 +126,96 @@ def generate_with_schema(
     Returns:
         Parsed JSON object matching the schema
     """
-    model_id = model.get("modelId", MODEL)
+    error = None
+    for attempt in range(MAX_SCHEMA_RETRIES + 1):
+        if attempt:
+            record_retry()
+            print(f"Retrying malformed response ({error}), attempt {attempt + 1}")
+
+        parser = IncrementalJsonParser(schema)
+        parts = []
+        stream = stream_with_schema(model, prompt, schema, temperature)
+        try:
+            for content in stream:
+                parts.append(content)
+                parser.feed(content)
+        except JsonStreamError as e:
+            # Closing the stream drops the connection, the rest is never generated
+            stream.close()
+            error = e
+            continue
 
-    # Create OpenAI client
-    client = create_openai_client()
+        content = "".join(parts)
+        print(content)
+        try:
+            if parser.done:
+                return parser.value
+            # No complete JSON value in the stream, try the lenient extraction
+            result = extract_and_parse_json(content)
+            validate(result, schema)
+            return result
+        except (json.JSONDecodeError, JsonStreamError) as e:
+            error = e
+
+    raise Exception(f"Failed to parse response: {str(error)}")
+
+def stream_with_schema(
+    model: Dict[str, Any],
+    prompt: str,
+    schema: Dict[str, Any],
+    temperature: float = 0.7
+) -> Iterator[str]:
+    """
+    Stream a structured response from the LLM as it is generated.
 
-    # Prepare request
-    messages = [
-        {"role": "system", "content": system_prompt() + "\nPlease format your response as JSON, **exactly** according to the provided schema."},
-        {"role": "user", "content": prompt + f"\n\nRespond using JSON format with this schema provided\n {schema}"}
-    ]
+    Same request as generate_with_schema, but yields the raw content deltas
+    of the JSON completion instead of the parsed object. The token usage,
+    including the prompt tokens served from the provider cache, and the time
+    to the first token are logged and recorded for every call.
+
+    Args:
+        model: Model configuration dict
+        prompt: The prompt to send to the model
+        schema: JSON schema defining the structure of the expected response
+        temperature: Controls randomness in generation
+
+    Yields:
+        Pieces of the completion text
+    """
+    model_id = model.get("modelId", MODEL)
+    client = create_openai_client()
+    messages = build_messages(prompt, schema)
 
-    # Make API request
-    response = client.chat.completions.create(
+    start = time.perf_counter()
+    first_token = None
+    stream = client.chat.completions.create(
         model=model_id,
         messages=messages,
         temperature=temperature,
-        response_format={"type": "json_object", "schema": schema}
+        response_format={"type": "json_object", "schema": schema},
+        stream=True,
+        stream_options={"include_usage": True}
     )
 
     try:
-        # print(response)
-        content = response.choices[0].message.content
-        print(content)
-        # The 'reasoning' attribute may not exist in all models/responses
-        if hasattr(response.choices[0].message, 'reasoning'):
-            print(response.choices[0].message.reasoning)
-
-        # Improved JSON parsing that extracts JSON even if other text is present
-        return extract_and_parse_json(content)
-    except Exception as e:
-        raise Exception(f"Failed to parse response: {str(e)}")
+        for chunk in stream:
+            # The last chunk carries only the usage, without choices
+            if getattr(chunk, "usage", None):
+                call = record_usage(chunk.usage, first_token)
+                print(f"LLM call: {call['prompt_tokens']} prompt tokens ({call['cached_tokens']} cached), "
+                      f"{call['completion_tokens']} completion tokens, first token after {call['first_token_seconds']:.2f}s")
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                yield content
+    finally:
+        # Release the connection when the caller stops early
+        close = getattr(stream, "close", None)
+        if close:
+            close()
 
 def extract_and_parse_json(text: str) -> Dict[str, Any]:
     """
@@ -127,50 +244,220 @@ def extract_and_parse_json(text: str) -> Dict[str, Any]:
         except json.JSONDecodeError:
             continue
 
-    # Try to find JSON object by braces
-    try:
-        # Find the first opening brace
-        start_idx = text.find('{')
-        if start_idx >= 0:
-            # Find the matching closing brace
-            brace_count = 0
-            for i in range(start_idx, len(text)):
-                if text[i] == '{':
-                    brace_count += 1
-                elif text[i] == '}':
-                    brace_count -= 1
-                    if brace_count == 0:
-                        # Extract and parse the JSON object
-                        json_str = text[start_idx:i+1]
-                        return json.loads(json_str)
-    except:
-        pass
+    # Try to find a JSON object in the surrounding text, decoding from each opening brace
+    decoder = json.JSONDecoder()
+    start_idx = text.find('{')
+    while start_idx >= 0:
+        try:
+            return decoder.raw_decode(text, start_idx)[0]
+        except json.JSONDecodeError:
+            start_idx = text.find('{', start_idx + 1)
 
     # If all methods fail, raise exception
     raise json.JSONDecodeError("Failed to extract valid JSON from the response", text, 0)
 
-def trim_prompt(prompt: str, context_size: int = DEFAULT_CONTEXT_SIZE) -> str:
+@lru_cache(maxsize=None)
+def get_tokenizer(model_id: str = MODEL):
+    """
+    Returns a cached tokenizer for the given model.
+
+    Falls back to the o200k_base encoding for models unknown to tiktoken
+    (e.g. OpenRouter model names) and to None if tiktoken is not installed.
+
+    Args:
+        model_id: Name of the model
+
+    Returns:
+        tiktoken Encoding instance or None
+    """
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_id.split("/")[-1])
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def _encode(text: str, model_id: str) -> Optional[List[int]]:
+    """Encodes text with the model tokenizer, or returns None if there is no tokenizer."""
+    encoder = get_tokenizer(model_id)
+    if encoder is None:
+        return None
+    return encoder.encode(text, disallowed_special=())
+
+def _decode(tokens: List[int], model_id: str) -> str:
+    return get_tokenizer(model_id).decode(tokens)
+
+def count_tokens(text: str, model_id: str = MODEL) -> int:
+    """
+    Count the tokens of a text for the given model.
+
+    Args:
+        text: Text to measure
+        model_id: Name of the model whose tokenizer is used
+
+    Returns:
+        Number of tokens (estimated from the length if no tokenizer is available)
+    """
+    if not text:
+        return 0
+    tokens = _encode(text, model_id)
+    if tokens is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(tokens)
+
+def trim_prompt(prompt: str, context_size: int = CONTEXT_SIZE, model_id: str = MODEL) -> str:
     """
     Trim a prompt to fit within the specified context size.
 
+    The prompt is tokenized once and cut at the token limit, so trimming
+    is a single O(n) step.
+
     Args:
         prompt: The prompt to trim
-        context_size: Maximum number of characters to allow
+        context_size: Maximum number of tokens to allow
+        model_id: Name of the model whose tokenizer is used
 
     Returns:
         Trimmed prompt
     """
-    if not prompt:
+    if not prompt or context_size <= 0:
         return ""
 
-    # Simple character-based trimming
-    # In a production implementation, this would use proper tokenization
-    if len(prompt) <= context_size:
+    tokens = _encode(prompt, model_id)
+    if tokens is None:
+        return prompt[:context_size * CHARS_PER_TOKEN]
+    if len(tokens) <= context_size:
         return prompt
+    return _decode(tokens[:context_size], model_id)
+
+def prompt_budget(
+    fixed_text: str,
+    context_size: int = CONTEXT_SIZE,
+    reserve: int = DEFAULT_RESPONSE_RESERVE,
+    model_id: str = MODEL
+) -> int:
+    """
+    Compute how many tokens are left for variable content in a prompt.
 
-    # If exceeding context size, trim to fit
-    overflow = len(prompt) - context_size
-    chunk_size = max(MIN_CHUNK_SIZE, len(prompt) - overflow)
+    Accounts for the system prompt, the fixed part of the user prompt
+    (template and schema) and the tokens reserved for the response.
 
-    # Simple recursive trimming
-    return trim_prompt(prompt[:chunk_size], context_size)
+    Args:
+        fixed_text: All prompt text that is sent regardless of the content blocks
+        context_size: Context window of the model in tokens
+        reserve: Tokens reserved for the completion
+        model_id: Name of the model whose tokenizer is used
+
+    Returns:
+        Number of tokens available for content blocks
+    """
+    used = count_tokens(system_prompt(), model_id) + count_tokens(fixed_text, model_id)
+    return max(0, context_size - reserve - used)
+
+def fit_blocks(blocks: List[str], budget: int, model_id: str = MODEL) -> List[str]:
+    """
+    Trim a list of content blocks so that together they fit in a token budget.
+
+    The budget is shared max-min fairly: blocks shorter than their fair share
+    are kept whole and the tokens they leave unused are redistributed among
+    the longer blocks. Each block is tokenized exactly once.
+
+    Args:
+        blocks: Content blocks, in prompt order
+        budget: Total number of tokens available for all blocks
+        model_id: Name of the model whose tokenizer is used
+
+    Returns:
+        The trimmed blocks in their original order (empty blocks are dropped)
+    """
+    blocks = [block for block in blocks if block]
+    if not blocks:
+        return []
+
+    encoded = [_encode(block, model_id) for block in blocks]
+    sizes = [
+        len(tokens) if tokens is not None else -(-len(block) // CHARS_PER_TOKEN)
+        for block, tokens in zip(blocks, encoded)
+    ]
+
+    # Water-filling: visit the blocks from shortest to longest
+    allowance = [0] * len(blocks)
+    remaining = max(0, budget)
+    order = sorted(range(len(blocks)), key=lambda i: sizes[i])
+    for position, i in enumerate(order):
+        share = remaining // (len(order) - position)
+        allowance[i] = min(sizes[i], share)
+        remaining -= allowance[i]
+
+    trimmed = []
+    for block, tokens, size, limit in zip(blocks, encoded, sizes, allowance):
+        if limit >= size:
+            trimmed.append(block)
+        elif tokens is None:
+            trimmed.append(block[:limit * CHARS_PER_TOKEN])
+        else:
+            trimmed.append(_decode(tokens[:limit], model_id))
+    return trimmed
+
+@lru_cache(maxsize=None)
+def get_embedding_model(model_name: str = EMBEDDING_MODEL):
+    """
+    Returns a cached sentence-transformers model, or None if it is not installed.
+
+    Args:
+        model_name: HuggingFace name of the embedding model
+
+    Returns:
+        SentenceTransformer instance or None
+    """
+    if SentenceTransformer is None:
+        return None
+    return SentenceTransformer(model_name)
+
+def embedding_backend(model_name: str = EMBEDDING_MODEL) -> Dict[str, Any]:
+    """
+    Describe the vector space embed_texts produces for a model name.
+
+    Vectors of different backends or dimensions can't be compared, so
+    persisted vectors record this and are rebuilt when it changes.
+
+    Args:
+        model_name: HuggingFace name of the embedding model
+
+    Returns:
+        Dict with the "backend" ("sentence-transformers" or "hashed") and the vector "dim"
+    """
+    encoder = get_embedding_model(model_name)
+    if encoder is None:
+        return {"backend": "hashed", "dim": HASHED_EMBEDDING_DIM}
+    return {"backend": "sentence-transformers", "dim": int(encoder.get_sentence_embedding_dimension())}
+
+def _hashed_embedding(text: str) -> List[float]:
+    """Unit-length hashed bag-of-words vector, a cheap stand-in for a real embedding."""
+    vector = [0.0] * HASHED_EMBEDDING_DIM
+    for word in re.findall(r"\w+", text.lower()):
+        vector[zlib.crc32(word.encode("utf-8")) % HASHED_EMBEDDING_DIM] += 1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+def embed_texts(texts: List[str], model_name: str = EMBEDDING_MODEL) -> List[List[float]]:
+    """
+    Embed a batch of texts into unit-length vectors.
+
+    All texts are encoded in a single model call. Falls back to hashed
+    bag-of-words vectors if sentence-transformers is not installed.
+
+    Args:
+        texts: Texts to embed
+        model_name: HuggingFace name of the embedding model
+
+    Returns:
+        One normalized vector per text
+    """
+    if not texts:
+        return []
+    encoder = get_embedding_model(model_name)
+    if encoder is None:
+        return [_hashed_embedding(text) for text in texts]
+    vectors = encoder.encode(list(texts), normalize_embeddings=True)
+    return [list(map(float, vector)) for vector in vectors]
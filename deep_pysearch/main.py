@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 
 import os
+import argparse
 from dotenv import load_dotenv
 import asyncio
+from typing import Any, Dict, Optional
 
 from llm_provider import get_model
 from deep_research import deep_research, write_final_report
 from feedback import generate_feedback
+from telemetry import Telemetry, telemetry
+from journal import ResearchJournal
+from scheduler import ResearchBudget, scheduled_research
 
 # Load environment variables
 load_dotenv()
@@ -15,13 +20,20 @@ def log(*args):
     """Helper function for consistent logging"""
     print(*args)
 
-async def main():
-    """Run the research agent"""
-    model_id = get_model()
-    log(f"Using model: {model_id}")
-
-    # Get initial query
-    initial_query = """
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run deep research over the local codebase')
+    parser.add_argument('--journal', default="research_journal.jsonl",
+                        help='File to checkpoint the research tree to')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume from the journal, skipping research steps that already finished')
+    parser.add_argument('--budget-tokens', type=int,
+                        help='Token budget of the research; expands the most novel branches first and stops when spent')
+    parser.add_argument('--budget-seconds', type=float,
+                        help='Time budget of the research; expands the most novel branches first and stops when spent')
+    return parser.parse_args()
+
+# Feature the research agent is asked about
+INITIAL_QUERY = """
 Below is a description of a specific TCP/IP stack feature.
 Your goal is to research the feature and check if it's implemented in lwip stack.
 ---
@@ -33,20 +45,52 @@ wireless networks, research has shown that the impact is far less severe over lo
 wireless networks such as IEEE 802.15.4.
 
 """
-    # Get breadth and depth parameters
-    breadth = 2
-    depth = 2
-
-    combined_query = initial_query
 
-    log("\nStarting pysearch...\n")
-
-    # Run the deep research process
-    result = await deep_research(
-        query=combined_query,
-        breadth=breadth,
-        depth=depth
-    )
+async def run_research(
+    query: str,
+    breadth: int,
+    depth: int,
+    journal: Optional[ResearchJournal] = None,
+    report_path: str = "report.md",
+    telemetry: Telemetry = telemetry,
+    budget: Optional[ResearchBudget] = None
+) -> Dict[str, Any]:
+    """
+    Run the research tree and write the final report.
+
+    Without a budget the tree is researched level by level with the breadth
+    halved at every level; with a budget the most novel branches are expanded
+    first until the budget is spent.
+
+    Args:
+        query: The research question
+        breadth: Number of queries generated at the top level
+        depth: Number of research levels
+        journal: Optional journal to checkpoint the research tree to
+        report_path: File the report is streamed to
+        telemetry: Collector for the stage timings and token usage
+        budget: Optional token and time budget of the research
+
+    Returns:
+        Dict with the learnings, sources and report
+    """
+    if budget is not None:
+        result = await scheduled_research(
+            query=query,
+            breadth=breadth,
+            depth=depth,
+            budget=budget,
+            telemetry=telemetry,
+            journal=journal
+        )
+    else:
+        result = await deep_research(
+            query=query,
+            breadth=breadth,
+            depth=depth,
+            telemetry=telemetry,
+            journal=journal
+        )
 
     learnings = result["learnings"]
     sources = result["sources"]  # Instead of visitedUrls since we're not using web search
@@ -54,18 +98,55 @@ wireless networks such as IEEE 802.15.4.
     log(f"\n\nLearnings:\n\n{chr(10).join(learnings)}")
     log(f"\n\nSources ({len(sources)}):\n\n{chr(10).join(sources)}")
     log("Writing final report...")
+    log("\n\nFinal Report:\n")
+
+    with telemetry.stage("final_report"):
+        # The report is streamed to stdout and the report file while it is generated
+        report = await write_final_report(
+            prompt=query,
+            learnings=learnings,
+            sources=sources,
+            stream=True,
+            output_path=report_path
+        )
+
+    return {"learnings": learnings, "sources": sources, "report": report}
 
-    report = await write_final_report(
-        prompt=combined_query,
-        learnings=learnings,
-        sources=sources
-    )
+async def main():
+    """Run the research agent"""
+    args = parse_args()
+    model_id = get_model()
+    log(f"Using model: {model_id}")
+
+    # Get breadth and depth parameters
+    breadth = 2
+    depth = 2
+
+    combined_query = INITIAL_QUERY
 
-    with open("report.md", "w", encoding="utf-8") as f:
-        f.write(report)
+    journal = ResearchJournal(args.journal, resume=args.resume)
+    if args.resume:
+        log(f"Resuming from {args.journal} ({len(journal)} completed steps)")
+
+    log("\nStarting pysearch...\n")
+
+    # Run the deep research process
+    try:
+        budget = None
+        if args.budget_tokens is not None or args.budget_seconds is not None:
+            budget = ResearchBudget(max_tokens=args.budget_tokens, max_seconds=args.budget_seconds)
+        await run_research(combined_query, breadth, depth, journal=journal, report_path="report.md", budget=budget)
+    finally:
+        journal.close()
 
-    log(f"\n\nFinal Report:\n\n{report}")
     log("\nReport has been saved to report.md")
 
+    telemetry.to_json("telemetry.json")
+    telemetry.to_prometheus("telemetry.prom")
+    total = telemetry.summary()
+    log(f"Telemetry: {total['seconds']:.1f}s, {total['llm_calls']} LLM calls, "
+        f"{total['prompt_tokens']} prompt + {total['completion_tokens']} completion tokens, "
+        f"{total['bytes_searched']} bytes searched (telemetry.json, telemetry.prom)")
+
 if __name__ == "__main__":
     asyncio.run(main())
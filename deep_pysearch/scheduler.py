@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+import heapq
+import itertools
+import time
+from typing import Any, Dict, List, Optional
+
+from deep_research import generate_research_queries, process_research_results, search_local_data_many
+from learning_store import LearningStore
+from telemetry import Telemetry, telemetry
+from journal import ResearchJournal
+
+# Function for consistent logging
+def log(*args):
+    print(*args)
+
+class ResearchBudget:
+    """
+    Token and wall time limits of a research run.
+
+    Before each step the cost of the next step is estimated as the average
+    of the steps so far, and the step only runs if it still fits, so a run
+    ends close to its budget instead of overshooting it. The final report
+    is written after the research and is not part of the budget, and steps
+    resumed from a journal cost nothing.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, max_seconds: Optional[float] = None):
+        """
+        Args:
+            max_tokens: Prompt plus completion tokens the research may use
+            max_seconds: Wall time the research may take
+        """
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self._telemetry = telemetry
+        self._start = time.perf_counter()
+        self._start_tokens = 0
+
+    def start(self, telemetry: Telemetry):
+        """Start measuring, usage recorded earlier in the telemetry does not count."""
+        self._telemetry = telemetry
+        self._start = time.perf_counter()
+        self._start_tokens = self._total_tokens()
+
+    def _total_tokens(self) -> int:
+        total = self._telemetry.summary()
+        return total["prompt_tokens"] + total["completion_tokens"]
+
+    def spent(self) -> Dict[str, float]:
+        """Tokens and seconds used since start()."""
+        return {"tokens": self._total_tokens() - self._start_tokens, "seconds": time.perf_counter() - self._start}
+
+    def allows(self, steps: int) -> bool:
+        """
+        Check whether one more step fits in the budget.
+
+        Args:
+            steps: Number of steps taken so far
+
+        Returns:
+            True if the estimated cost of the next step still fits
+        """
+        spent = self.spent()
+        for limit, used in ((self.max_tokens, spent["tokens"]), (self.max_seconds, spent["seconds"])):
+            if limit is None:
+                continue
+            estimate = used / steps if steps else 0
+            if used + estimate > limit:
+                return False
+        return True
+
+async def scheduled_research(
+    query: str,
+    breadth: int,
+    depth: int,
+    budget: ResearchBudget,
+    learnings: List[str] = None,
+    sources: List[str] = None,
+    telemetry: Telemetry = telemetry,
+    journal: Optional[ResearchJournal] = None
+) -> Dict[str, List[str]]:
+    """
+    Best-first deep research within a token and time budget.
+
+    Instead of halving the breadth at every level, every research query
+    waits in a priority queue. A processed query is scored by the novelty of
+    its learnings against everything learned so far, and its follow-up
+    directions are expanded with that score, so productive branches are
+    explored first and repetitive ones last. Research stops when the budget
+    is spent or the tree is exhausted.
+
+    Uses the same stages, telemetry and journal (node paths) as deep_research,
+    so the results are interchangeable and a run can be resumed.
+
+    Args:
+        query: The research question
+        breadth: Number of queries generated per expansion
+        depth: Maximum number of research levels
+        budget: Token and time limits
+        learnings: Learnings known before the research
+        sources: Sources known before the research
+        telemetry: Collector for the stage timings and token usage
+        journal: Optional journal to checkpoint the research tree to
+
+    Returns:
+        Dict with the learnings and sources
+    """
+    store = LearningStore(learnings or [])
+    all_sources = list(sources or [])
+    budget.start(telemetry)
+
+    # Entries are (-priority, sequence, item), equal priorities are expanded in order
+    queue = []
+    sequence = itertools.count()
+    heapq.heappush(queue, (-1.0, next(sequence), {"kind": "expand", "query": query, "path": "", "depth": depth}))
+
+    steps = 0
+    while queue:
+        if not budget.allows(steps):
+            spent = budget.spent()
+            log(f"Research budget spent ({spent['tokens']} tokens, {spent['seconds']:.1f}s), "
+                f"{len(queue)} pending steps skipped")
+            break
+        negative_priority, _, item = heapq.heappop(queue)
+        priority = -negative_priority
+        steps += 1
+
+        if item["kind"] == "expand":
+            research_queries = journal.get_queries(item["path"], item["query"]) if journal is not None else None
+            if research_queries is None:
+                with telemetry.stage("query_generation", item["depth"]):
+                    research_queries = await generate_research_queries(
+                        query=item["query"],
+                        num_queries=breadth,
+                        learnings=store.learnings
+                    )
+                if journal is not None:
+                    journal.record_queries(item["path"], item["query"], research_queries)
+            log(f"Research queries (priority {priority:.2f}): {research_queries}")
+
+            # Search for all new queries at once, so query embeddings are computed in one batch
+            child_paths = [f"{item['path']}.{i}" if item["path"] else str(i) for i in range(len(research_queries))]
+            pending = [
+                rq["query"] for rq, path in zip(research_queries, child_paths)
+                if journal is None or not journal.get_node(path, rq["query"])
+            ]
+            prefetched = {}
+            if pending:
+                try:
+                    with telemetry.stage("local_search", item["depth"]):
+                        prefetched = dict(zip(pending, await search_local_data_many(pending)))
+                except Exception as e:
+                    log(f"Error searching local data: {str(e)}")
+
+            for research_query, path in zip(research_queries, child_paths):
+                heapq.heappush(queue, (-priority, next(sequence), {
+                    "kind": "query",
+                    "query": research_query["query"],
+                    "researchGoal": research_query["researchGoal"],
+                    "path": path,
+                    "depth": item["depth"],
+                    "searchResults": prefetched.get(research_query["query"])
+                }))
+            continue
+
+        try:
+            completed = journal.get_node(item["path"], item["query"]) if journal is not None else None
+            if completed:
+                log(f"Resuming '{item['query']}' from journal")
+                processed_results = {
+                    "learnings": completed["learnings"],
+                    "followUpQuestions": completed["followUpQuestions"]
+                }
+            else:
+                search_results = item["searchResults"]
+                if search_results is None:
+                    with telemetry.stage("local_search", item["depth"]):
+                        search_results = (await search_local_data_many([item["query"]]))[0]
+
+                with telemetry.stage("result_processing", item["depth"]):
+                    processed_results = await process_research_results(
+                        query=item["query"],
+                        results=search_results,
+                        num_follow_up_questions=max(1, breadth // 2)
+                    )
+
+                if journal is not None:
+                    journal.record_node(
+                        item["path"],
+                        item["query"],
+                        item["researchGoal"],
+                        search_results,
+                        processed_results["learnings"],
+                        processed_results["followUpQuestions"]
+                    )
+        except Exception as e:
+            log(f"Error processing query '{item['query']}': {str(e)}")
+            continue
+
+        novelty = store.novelty(processed_results["learnings"])
+        store.add(processed_results["learnings"])
+        all_sources.append(f"Local search for: {item['query']}")
+        log(f"Learnings of '{item['query']}' scored {novelty:.2f} novelty")
+
+        if item["depth"] > 1 and processed_results["followUpQuestions"]:
+            next_query = f"""
+Previous research goal: {item["researchGoal"]}
+Follow-up research directions: {chr(10).join(processed_results["followUpQuestions"])}
+            """.strip()
+            heapq.heappush(queue, (-novelty, next(sequence), {
+                "kind": "expand", "query": next_query, "path": item["path"], "depth": item["depth"] - 1
+            }))
+
+    return {
+        "learnings": store.learnings,
+        "sources": list(dict.fromkeys(all_sources))
+    }
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sys
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from llm_provider import embed_texts, embedding_backend, EMBEDDING_MODEL
+
+# The brace scan is shared with the function chunker of the RAG index, at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from c_chunker import top_level_blocks
+
+# Source files that get indexed, and directories that never do
+SOURCE_EXTENSIONS = (".c", ".h")
+SKIP_DIRS = {'build', 'build_esp32_default', '.git', 'cmake-build'}
+
+# Longer functions are split into sub-chunks prefixed by their signature line
+MAX_CHUNK_LINES = 60
+# Top-level lines between functions are grouped up to this many lines
+MAX_GAP_LINES = 30
+EMBED_BATCH_SIZE = 64
+
+DEFAULT_INDEX_DIR = os.getenv("SEMANTIC_INDEX_DIR", ".semantic_index")
+
+def split_c_source(lines: List[str]) -> List[Tuple[int, int, int]]:
+    """
+    Split C source into function-level chunks.
+
+    A chunk is a top-level brace block (function, struct, initializer) with
+    the lines that lead up to it, i.e. its signature and comment. Blocks
+    longer than MAX_CHUNK_LINES are cut into several chunks.
+
+    Args:
+        lines: Lines of the file
+
+    Returns:
+        List of (start, end, block_start) line ranges, 0-based and end-exclusive,
+        where block_start is the start of the block a sub-chunk was cut from
+    """
+    ranges = []
+    start = 0
+    for open_line, close_line in top_level_blocks(lines) + [(len(lines) + 1, None)]:
+        if open_line == close_line:
+            # A one-line block stays with the top-level lines around it
+            continue
+        while open_line - 1 - start >= MAX_GAP_LINES:
+            ranges.append((start, start + MAX_GAP_LINES))
+            start += MAX_GAP_LINES
+        if close_line is not None:
+            ranges.append((start, close_line))
+            start = close_line
+    if start < len(lines):
+        ranges.append((start, len(lines)))
+
+    chunks = []
+    for start, end in ranges:
+        for sub_start in range(start, end, MAX_CHUNK_LINES):
+            chunks.append((sub_start, min(end, sub_start + MAX_CHUNK_LINES), start))
+    return chunks
+
+def _signature(lines: List[str], start: int) -> str:
+    """First non-blank, non-comment line of a chunk, used to prefix its sub-chunks."""
+    for line in lines[start:start + MAX_CHUNK_LINES]:
+        stripped = line.strip()
+        if stripped and not stripped.startswith(("/*", "*", "//")):
+            return stripped
+    return ""
+
+def walk_sources(directory: str):
+    """Yields the paths of all indexable source files under a directory."""
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for file in files:
+            if file.endswith(SOURCE_EXTENSIONS):
+                yield os.path.join(root, file)
+
+class SemanticIndex:
+    """
+    Persistent chunk-level vector index over a source tree.
+
+    Chunks and their embeddings are stored in `index_dir` (meta.json and
+    vectors.npy). `update` only re-embeds files whose mtime or size changed
+    since the last run. The index is rebuilt when the embedding backend or
+    its dimension changed, e.g. once sentence-transformers gets installed
+    after an index was built with the hashed fallback.
+    """
+
+    def __init__(self, directory: str, index_dir: str = DEFAULT_INDEX_DIR, model_name: str = EMBEDDING_MODEL):
+        self.directory = os.path.abspath(directory)
+        self.index_dir = index_dir
+        self.model_name = model_name
+        self.backend = embedding_backend(model_name)
+        self.files: Dict[str, List[float]] = {}
+        self.chunks: List[Dict[str, Any]] = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self._load()
+
+    def _load(self):
+        meta_path = os.path.join(self.index_dir, "meta.json")
+        vectors_path = os.path.join(self.index_dir, "vectors.npy")
+        if not (os.path.exists(meta_path) and os.path.exists(vectors_path)):
+            return
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if (meta.get("directory") != self.directory or meta.get("model") != self.model_name
+                or meta.get("backend") != self.backend["backend"] or meta.get("dim") != self.backend["dim"]):
+            # Index of another tree or embedding space, rebuild from scratch
+            return
+        vectors = np.load(vectors_path)
+        if len(vectors) != len(meta["chunks"]) or (len(vectors) and vectors.shape[1] != self.backend["dim"]):
+            return
+        self.files = meta["files"]
+        self.chunks = meta["chunks"]
+        self.vectors = vectors
+
+    def _save(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(os.path.join(self.index_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "directory": self.directory,
+                "model": self.model_name,
+                "backend": self.backend["backend"],
+                "dim": self.backend["dim"],
+                "files": self.files,
+                "chunks": self.chunks,
+            }, f)
+        np.save(os.path.join(self.index_dir, "vectors.npy"), self.vectors)
+
+    def update(self) -> int:
+        """
+        Bring the index in sync with the source tree.
+
+        Returns:
+            Number of chunks that were (re-)embedded
+        """
+        current = {}
+        for path in walk_sources(self.directory):
+            stat = os.stat(path)
+            current[path] = [stat.st_mtime, stat.st_size]
+
+        changed = {path for path, signature in current.items() if self.files.get(path) != signature}
+        removed = set(self.files) - set(current)
+        if not changed and not removed:
+            return 0
+
+        keep = [i for i, chunk in enumerate(self.chunks) if chunk["file"] not in changed | removed]
+        chunks = [self.chunks[i] for i in keep]
+        vectors = [self.vectors[keep]] if keep else []
+
+        new_chunks = []
+        for path in sorted(changed):
+            try:
+                with open(path, "r", encoding="utf-8", errors="replace") as f:
+                    lines = f.readlines()
+            except OSError:
+                continue
+            for start, end, block_start in split_c_source(lines):
+                text = "".join(lines[start:end])
+                if not text.strip():
+                    continue
+                signature = _signature(lines, block_start)
+                new_chunks.append({"file": path, "start": start + 1, "end": end, "text": text, "signature": signature})
+
+        for batch_start in range(0, len(new_chunks), EMBED_BATCH_SIZE):
+            batch = new_chunks[batch_start:batch_start + EMBED_BATCH_SIZE]
+            texts = [f"{os.path.relpath(c['file'], self.directory)}\n{c['signature']}\n{c['text']}" for c in batch]
+            vectors.append(np.asarray(embed_texts(texts, self.model_name), dtype=np.float32))
+
+        self.chunks = chunks + new_chunks
+        self.vectors = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+        self.files = current
+        self._save()
+        return len(new_chunks)
+
+    def search(self, queries: List[str], k: int = 10) -> List[List[Dict[str, Any]]]:
+        """
+        Find the chunks closest to each query.
+
+        All queries are embedded in one batch and scored with one matrix product.
+
+        Args:
+            queries: Search queries
+            k: Number of chunks per query
+
+        Returns:
+            For each query, a list of chunk dicts with an added "score", best first
+        """
+        if not queries or not self.chunks:
+            return [[] for _ in queries]
+        query_vectors = np.asarray(embed_texts(queries, self.model_name), dtype=np.float32)
+        scores = query_vectors @ self.vectors.T
+        k = min(k, len(self.chunks))
+
+        results = []
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k]
+            top = top[np.argsort(-row[top])]
+            results.append([dict(self.chunks[i], score=float(row[i])) for i in top])
+        return results
+
+@lru_cache(maxsize=None)
+def get_semantic_index(directory: str, index_dir: Optional[str] = None) -> SemanticIndex:
+    """
+    Returns the index for a directory, updated once per process.
+
+    Args:
+        directory: Source tree to index
+        index_dir: Where the index is stored (SEMANTIC_INDEX_DIR by default)
+    """
+    index = SemanticIndex(directory, index_dir or DEFAULT_INDEX_DIR)
+    index.update()
+    return index
+
+def format_chunk(chunk: Dict[str, Any]) -> str:
+    """Format a chunk like a text search hit, so both can be processed the same way."""
+    lines = chunk["text"].splitlines()
+    context_str = "".join(
+        f"{j:4d} | {line.rstrip()}\n" for j, line in enumerate(lines, start=chunk["start"])
+    )
+    return f"Found match in: {chunk['file']}\n{context_str}"
+
+def reciprocal_rank_fusion(rankings: List[List[Any]], k: int = 60) -> List[Tuple[Any, float]]:
+    """
+    Fuse several rankings of hashable keys by reciprocal rank fusion.
+
+    Args:
+        rankings: Lists of keys, best first
+        k: RRF damping constant
+
+    Returns:
+        (key, score) pairs, best first
+    """
+    scores: Dict[Any, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: -item[1])
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+# Prices in USD per million tokens, used to estimate the cost of a run
+PROMPT_TOKEN_PRICE = float(os.getenv("PROMPT_TOKEN_PRICE", "0"))
+COMPLETION_TOKEN_PRICE = float(os.getenv("COMPLETION_TOKEN_PRICE", "0"))
+
+# Counters collected for every stage, in export order
+COUNTERS = [
+    ("calls", "Number of times the stage ran"),
+    ("seconds", "Wall time spent in the stage"),
+    ("llm_calls", "Number of LLM requests"),
+    ("prompt_tokens", "Prompt tokens sent to the LLM"),
+    ("completion_tokens", "Completion tokens received from the LLM"),
+    ("cached_tokens", "Prompt tokens served from the provider prompt cache"),
+    ("cache_hits", "LLM requests that reported cached prompt tokens"),
+    ("first_token_seconds", "Time to the first streamed token, summed over LLM requests"),
+    ("llm_retries", "LLM requests repeated after a malformed completion was aborted"),
+    ("bytes_searched", "Bytes of source files scanned by the search tools"),
+    ("cost_usd", "Estimated LLM cost"),
+]
+
+_current_stage: ContextVar[Optional[Dict[str, Any]]] = ContextVar("current_stage", default=None)
+
+def _new_record(stage: str, depth: Optional[int]) -> Dict[str, Any]:
+    record = {"stage": stage, "depth": depth}
+    record.update({name: 0 for name, _ in COUNTERS})
+    return record
+
+class Telemetry:
+    """
+    Collects wall time, token usage and search volume for each research stage.
+
+    Stages are opened with the `stage` context manager. While a stage is open,
+    `record_usage` and `record_bytes_searched` calls anywhere in the same task
+    are attributed to it.
+    """
+
+    def __init__(self):
+        self.records: List[Dict[str, Any]] = []
+
+    @contextmanager
+    def stage(self, name: str, depth: Optional[int] = None):
+        """
+        Measure one run of a stage.
+
+        Args:
+            name: Stage name, e.g. "query_generation" or "local_search"
+            depth: Remaining research depth the stage runs at
+        """
+        record = _new_record(name, depth)
+        record["calls"] = 1
+        token = _current_stage.set(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            _current_stage.reset(token)
+            self.records.append(record)
+
+    def aggregate(self) -> List[Dict[str, Any]]:
+        """
+        Sum the stage records per (stage, depth).
+
+        Returns:
+            One record per stage and depth level, in first-seen order
+        """
+        totals: Dict[tuple, Dict[str, Any]] = {}
+        for record in self.records:
+            key = (record["stage"], record["depth"])
+            if key not in totals:
+                totals[key] = _new_record(*key)
+            for name, _ in COUNTERS:
+                totals[key][name] += record[name]
+        return list(totals.values())
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals over the whole run."""
+        total = _new_record("total", None)
+        for record in self.records:
+            for name, _ in COUNTERS:
+                total[name] += record[name]
+        return total
+
+    def to_json(self, path: str):
+        """Write the per-stage records, aggregates and totals as JSON."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "stages": self.records,
+                "by_depth": self.aggregate(),
+                "total": self.summary(),
+            }, f, indent=2)
+
+    def to_prometheus(self, path: str, prefix: str = "deep_research"):
+        """
+        Write the aggregated counters in the Prometheus textfile format.
+
+        The file is written to a temporary name first and renamed, so the
+        node_exporter textfile collector never reads a partial file.
+        """
+        lines = []
+        aggregates = self.aggregate()
+        for name, help_text in COUNTERS:
+            metric = f"{prefix}_stage_{name}_total"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for record in aggregates:
+                depth = "" if record["depth"] is None else record["depth"]
+                lines.append(f'{metric}{{stage="{record["stage"]}",depth="{depth}"}} {record[name]}')
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+def record_usage(usage: Any, first_token_seconds: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    Add the token usage of an LLM response to the current stage.
+
+    Every call is also kept in the stage's "requests" list, so cache hits
+    can be compared call by call.
+
+    Args:
+        usage: The `usage` object of an OpenAI-compatible chat completion (may be None)
+        first_token_seconds: Time to the first streamed token, if streamed
+
+    Returns:
+        The recorded call (prompt, cached and completion tokens, time to first token), or None without usage
+    """
+    if usage is None:
+        return None
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+    call = {
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "completion_tokens": completion_tokens,
+        "first_token_seconds": first_token_seconds or 0.0,
+    }
+
+    record = _current_stage.get()
+    if record is None:
+        return call
+    record.setdefault("requests", []).append(call)
+    record["llm_calls"] += 1
+    record["first_token_seconds"] += call["first_token_seconds"]
+    record["prompt_tokens"] += prompt_tokens
+    record["completion_tokens"] += completion_tokens
+    record["cached_tokens"] += cached_tokens
+    record["cache_hits"] += 1 if cached_tokens else 0
+    record["cost_usd"] += (prompt_tokens * PROMPT_TOKEN_PRICE + completion_tokens * COMPLETION_TOKEN_PRICE) / 1e6
+    return call
+
+def record_retry():
+    """Count a completion that was aborted and requested again in the current stage."""
+    record = _current_stage.get()
+    if record is not None:
+        record["llm_retries"] += 1
+
+def record_bytes_searched(num_bytes: int):
+    """Add the size of a scanned file to the current stage."""
+    record = _current_stage.get()
+    if record is not None:
+        record["bytes_searched"] += num_bytes
+
+# Telemetry of the current research run
+telemetry = Telemetry()
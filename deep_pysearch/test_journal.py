@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from journal import ResearchJournal
+
+QUERIES = [{"query": "tcp retransmission", "researchGoal": "timers"}]
+
+def test_resume_after_kill_mid_write(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ResearchJournal(path)
+    journal.record_queries("0", "topic", QUERIES)
+    journal.close()
+
+    # Killed in the middle of writing the next entry
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"type": "node", "path": "0.0", "query": "tc')
+
+    journal = ResearchJournal(path, resume=True)
+    assert len(journal) == 1
+    assert journal.get_queries("0", "topic") == QUERIES
+    journal.record_queries("0.1", "follow-up", QUERIES)
+    journal.close()
+
+    # Resumed again, the entry written after the first resume survives
+    journal = ResearchJournal(path, resume=True)
+    assert len(journal) == 2
+    assert journal.get_queries("0", "topic") == QUERIES
+    assert journal.get_queries("0.1", "follow-up") == QUERIES
+    journal.close()
+
+def test_journal_without_resume_starts_empty(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = ResearchJournal(path)
+    journal.record_queries("", "topic", QUERIES)
+    journal.close()
+
+    journal = ResearchJournal(path)
+    assert len(journal) == 0
+    assert journal.get_queries("", "topic") is None
+    journal.close()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from json_stream import IncrementalJsonParser, JsonStreamError
+
+SCHEMA = {
+    "type": "object",
+    "properties": {"answer": {"type": "string"}},
+    "required": ["answer"],
+}
+
+# Responses json.loads rejects: a raw newline and an invalid escape inside a string
+INVALID_STRINGS = ['{"answer": "line one\nline two"}', '{"answer": "bad \\x41 escape"}']
+
+def feed_chunks(parser, text, size):
+    for i in range(0, len(text), size):
+        parser.feed(text[i:i + size])
+    return parser.close()
+
+@pytest.mark.parametrize("text", INVALID_STRINGS)
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_invalid_string_raises_stream_error(text, size):
+    with pytest.raises(JsonStreamError):
+        feed_chunks(IncrementalJsonParser(SCHEMA), text, size)
+
+@pytest.mark.parametrize("text", INVALID_STRINGS)
+def test_invalid_key_raises_stream_error(text):
+    with pytest.raises(JsonStreamError):
+        feed_chunks(IncrementalJsonParser(), text.replace('"answer": ', "").replace("{", '{"k": 1, ') + "}", 1000)
+
+@pytest.mark.parametrize("size", [1, 2, 5, 1000])
+def test_escapes_split_across_chunks(size):
+    text = '{"answer": "tab\\there \\"quoted\\" \\u00e9\\ud83d\\ude00 \\\\ \\/"}'
+    assert feed_chunks(IncrementalJsonParser(SCHEMA), text, size) == {"answer": 'tab\there "quoted" é\U0001F600 \\ /'}
+
+# Responses with a brace in the text before the JSON
+PREAMBLES = [
+    'Results for {topic}:\n{"answer": "ok"}',
+    '<think>if (x) { return 1; } and [1]</think>\n```json\n{"answer": "ok"}\n```',
+    '{ {"answer": "ok"}',
+]
+
+@pytest.mark.parametrize("text", PREAMBLES)
+@pytest.mark.parametrize("size", [1, 4, 1000])
+def test_preamble_with_brace_is_skipped(text, size):
+    assert feed_chunks(IncrementalJsonParser(SCHEMA), text, size) == {"answer": "ok"}
+
+@pytest.mark.parametrize("size", [1, 1000])
+def test_error_after_first_member_still_raises(size):
+    with pytest.raises(JsonStreamError):
+        feed_chunks(IncrementalJsonParser(SCHEMA), 'Results for {topic}: {"answer": 5}', size)
+
+@pytest.mark.parametrize("text", INVALID_STRINGS)
+def test_generate_with_schema_retries_invalid_string(monkeypatch, text):
+    pytest.importorskip("dotenv")
+    import llm_provider
+
+    responses = iter([text, '{"answer": "ok"}'])
+    retries = []
+
+    def stream_with_schema(*args, **kwargs):
+        yield next(responses)
+
+    monkeypatch.setattr(llm_provider, "stream_with_schema", stream_with_schema)
+    monkeypatch.setattr(llm_provider, "record_retry", lambda: retries.append(1))
+    assert llm_provider.generate_with_schema({}, "prompt", SCHEMA) == {"answer": "ok"}
+    assert retries == [1]
+
+@pytest.mark.parametrize("text", PREAMBLES)
+def test_generate_with_schema_skips_preamble_without_retry(monkeypatch, text):
+    pytest.importorskip("dotenv")
+    import llm_provider
+
+    retries = []
+
+    def stream_with_schema(*args, **kwargs):
+        for i in range(0, len(text), 3):
+            yield text[i:i + 3]
+
+    monkeypatch.setattr(llm_provider, "stream_with_schema", stream_with_schema)
+    monkeypatch.setattr(llm_provider, "record_retry", lambda: retries.append(1))
+    assert llm_provider.generate_with_schema({}, "prompt", SCHEMA) == {"answer": "ok"}
+    assert retries == []
@@ -0,0 +1,351 @@
+"""
+Record/replay layer for the OpenAI-compatible chat completion API.
+
+All agents in this repository talk to the LLM through `client.chat.completions.create`.
+Creating the client with `openai_client()` instead of `OpenAI()` makes them
+recordable and replayable, controlled by environment variables:
+
+    LLM_REPLAY_MODE=record   call the real endpoint and store every request/response pair
+    LLM_REPLAY_MODE=replay   answer from the store only, no network (missing pairs raise)
+    LLM_REPLAY_DIR           store directory (default: ./llm_recordings)
+    LLM_REPLAY_LATENCY       "recorded" to replay the recorded timing, or a fixed number of seconds
+    LLM_REPLAY_LATENCY_SCALE multiplier for the recorded timing (default 1.0, 0 disables sleeping)
+
+Requests are matched by a hash of the model, messages and sampling parameters, with
+volatile text such as the timestamps in system prompts masked out. Streamed and
+non-streamed calls share recordings; the missing form is synthesized on replay.
+
+Code that can't be changed can be pointed at a local stand-in server instead:
+
+    python llm_replay.py serve --port 8000 --store llm_recordings
+    export BASE_URL=http://127.0.0.1:8000/v1
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+
+DEFAULT_STORE = os.environ.get("LLM_REPLAY_DIR", "llm_recordings")
+
+# Masked before hashing a request, so recordings survive e.g. "Today is <now>" in prompts
+VOLATILE_PATTERNS = [
+    re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d+)?"),
+    re.compile(r"(?<=Today is )\d{4}-\d{2}-\d{2}"),
+]
+
+# Request fields that do not change the answer
+IGNORED_FIELDS = {"stream", "stream_options", "timeout", "extra_headers"}
+
+# Characters per synthesized stream chunk when a non-streamed recording is replayed as a stream
+SYNTHETIC_CHUNK_CHARS = 16
+
+class ReplayMissError(KeyError):
+    """No recording exists for a request in replay mode."""
+
+def _mask(value: Any) -> Any:
+    if isinstance(value, str):
+        for pattern in VOLATILE_PATTERNS:
+            value = pattern.sub("<volatile>", value)
+        return value
+    if isinstance(value, dict):
+        return {k: _mask(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_mask(v) for v in value]
+    return value
+
+def request_key(request: Dict[str, Any]) -> str:
+    """Stable hash of the parts of a request that determine the response."""
+    relevant = {k: v for k, v in request.items() if k not in IGNORED_FIELDS and v is not None}
+    canonical = json.dumps(_mask(relevant), sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+def to_namespace(value: Any) -> Any:
+    """Recursively convert parsed JSON into objects with attribute access, like the OpenAI types."""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: to_namespace(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [to_namespace(v) for v in value]
+    return value
+
+def _dump(obj: Any) -> Any:
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if isinstance(obj, SimpleNamespace):
+        return {k: _dump(v) for k, v in vars(obj).items()}
+    return obj
+
+class RecordingStore:
+    """
+    Directory of recordings, one JSON file per request key.
+
+    A key can hold several recordings (e.g. the same prompt sampled twice);
+    they are replayed in order and then cycled.
+    """
+
+    def __init__(self, directory: str = DEFAULT_STORE):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._cursors: Dict[str, int] = {}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def add(self, key: str, request: Dict[str, Any], recording: Dict[str, Any]):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            entry = self._load(key) or {"request": _mask(request), "recordings": []}
+            entry["recordings"].append(recording)
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, indent=1, default=str)
+            os.replace(tmp_path, self._path(key))
+
+    def next(self, key: str) -> Dict[str, Any]:
+        with self._lock:
+            entry = self._load(key)
+            if not entry or not entry["recordings"]:
+                raise ReplayMissError(f"No recording for request {key} in {self.directory}")
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            return entry["recordings"][cursor % len(entry["recordings"])]
+
+class LatencyModel:
+    """Simulated response timing for replayed calls."""
+
+    def __init__(self, latency: Optional[str] = None, scale: Optional[float] = None):
+        latency = latency if latency is not None else os.environ.get("LLM_REPLAY_LATENCY", "recorded")
+        self.fixed = None if latency == "recorded" else float(latency)
+        self.scale = scale if scale is not None else float(os.environ.get("LLM_REPLAY_LATENCY_SCALE", "1.0"))
+
+    def total(self, recording: Dict[str, Any]) -> float:
+        if self.fixed is not None:
+            return self.fixed
+        return recording.get("elapsed", 0.0) * self.scale
+
+    def first_token(self, recording: Dict[str, Any]) -> float:
+        if self.fixed is not None:
+            return self.fixed
+        return recording.get("first_token", recording.get("elapsed", 0.0)) * self.scale
+
+def _completion_from_chunks(chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Assemble a chat completion from recorded stream chunks."""
+    content = []
+    usage = None
+    base = {}
+    for chunk in chunks:
+        base = base or chunk
+        usage = chunk.get("usage") or usage
+        for choice in chunk.get("choices") or []:
+            piece = (choice.get("delta") or {}).get("content")
+            if piece:
+                content.append(piece)
+    return {
+        "id": base.get("id"),
+        "object": "chat.completion",
+        "created": base.get("created"),
+        "model": base.get("model"),
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": "".join(content)}}],
+        "usage": usage,
+    }
+
+def _chunks_from_completion(response: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Split a recorded chat completion into stream chunks."""
+    content = response["choices"][0]["message"].get("content") or ""
+    common = {"id": response.get("id"), "object": "chat.completion.chunk",
+              "created": response.get("created"), "model": response.get("model")}
+    chunks = [
+        dict(common, choices=[{"index": 0, "delta": {"content": content[i:i + SYNTHETIC_CHUNK_CHARS]}, "finish_reason": None}])
+        for i in range(0, len(content), SYNTHETIC_CHUNK_CHARS)
+    ]
+    chunks.append(dict(common, choices=[], usage=response.get("usage")))
+    return chunks
+
+def replay_chunks(recording: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return recording["chunks"] if recording.get("stream") else _chunks_from_completion(recording["response"])
+
+def replay_response(recording: Dict[str, Any]) -> Dict[str, Any]:
+    return _completion_from_chunks(recording["chunks"]) if recording.get("stream") else recording["response"]
+
+def _paced(chunks: List[Any], first_token: float, total: float) -> Iterator[Any]:
+    """Yield chunks with the first one after first_token seconds, the rest spread until total."""
+    if first_token > 0:
+        time.sleep(first_token)
+    gap = max(0.0, total - first_token) / max(1, len(chunks) - 1)
+    for i, chunk in enumerate(chunks):
+        if i and gap:
+            time.sleep(gap)
+        yield chunk
+
+class _Completions:
+    def __init__(self, owner: "ReplayClient"):
+        self._owner = owner
+
+    def create(self, **request):
+        owner = self._owner
+        key = request_key(request)
+        stream = bool(request.get("stream"))
+
+        if owner.mode == "replay":
+            recording = owner.store.next(key)
+            if stream:
+                chunks = [to_namespace(c) for c in replay_chunks(recording)]
+                return _paced(chunks, owner.latency.first_token(recording), owner.latency.total(recording))
+            delay = owner.latency.total(recording)
+            if delay > 0:
+                time.sleep(delay)
+            return to_namespace(replay_response(recording))
+
+        start = time.perf_counter()
+        response = owner.client.chat.completions.create(**request)
+        if not stream:
+            owner.store.add(key, request, {"stream": False, "response": _dump(response),
+                                           "elapsed": time.perf_counter() - start})
+            return response
+        return self._record_stream(key, request, response, start)
+
+    def _record_stream(self, key, request, stream, start):
+        chunks = []
+        first_token = None
+        # A consumer that stops early (or fails) closes this generator, which must close the HTTP stream;
+        # only a stream read to the end is recorded
+        try:
+            for chunk in stream:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                chunks.append(_dump(chunk))
+                yield chunk
+        finally:
+            stream.close()
+        self._owner.store.add(key, request, {"stream": True, "chunks": chunks, "first_token": first_token or 0.0,
+                                             "elapsed": time.perf_counter() - start})
+
+class ReplayClient:
+    """
+    Stand-in for an OpenAI client that records or replays chat completions.
+
+    Only `chat.completions.create` is intercepted, which is all the agents use.
+    """
+
+    def __init__(self, client: Any = None, mode: str = "replay", store: Optional[RecordingStore] = None,
+                 latency: Optional[LatencyModel] = None):
+        if mode == "record" and client is None:
+            raise ValueError("Recording needs a real client")
+        self.client = client
+        self.mode = mode
+        self.store = store or RecordingStore()
+        self.latency = latency or LatencyModel()
+        self.api_key = getattr(client, "api_key", None) or "replay"
+        self.chat = SimpleNamespace(completions=_Completions(self))
+
+def openai_client(api_key: Optional[str] = None, base_url: Optional[str] = None, mode: Optional[str] = None):
+    """
+    Create a chat client honouring LLM_REPLAY_MODE.
+
+    Args:
+        api_key: API key for the real endpoint
+        base_url: Base URL of the real endpoint
+        mode: "record", "replay" or "off"; defaults to LLM_REPLAY_MODE
+
+    Returns:
+        An OpenAI client, or a ReplayClient in record/replay mode
+    """
+    mode = mode or os.environ.get("LLM_REPLAY_MODE", "off")
+    if mode == "replay":
+        # No real client needed, replay works without an API key or network
+        return ReplayClient(mode="replay")
+
+    from openai import OpenAI
+    client = OpenAI(api_key=api_key, base_url=base_url)
+    if mode == "record":
+        return ReplayClient(client, mode="record")
+    return client
+
+def serve(port: int = 8000, store: Optional[RecordingStore] = None, latency: Optional[LatencyModel] = None,
+          host: str = "127.0.0.1"):
+    """
+    Run a local OpenAI-compatible server that answers chat completions from the store.
+
+    Supports both plain JSON and server-sent-event streaming responses.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    store = store or RecordingStore()
+    latency = latency or LatencyModel()
+
+    class Handler(BaseHTTPRequestHandler):
+        def _json(self, status: int, body: Dict[str, Any]):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._json(404, {"error": {"message": f"Unsupported endpoint {self.path}"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            try:
+                recording = store.next(request_key(request))
+            except ReplayMissError as e:
+                self._json(404, {"error": {"message": str(e), "type": "replay_miss"}})
+                return
+
+            if not request.get("stream"):
+                delay = latency.total(recording)
+                if delay > 0:
+                    time.sleep(delay)
+                self._json(200, replay_response(recording))
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            for chunk in _paced(replay_chunks(recording), latency.first_token(recording), latency.total(recording)):
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Replaying {store.directory} on http://{host}:{port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Replay recorded LLM responses')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Run a local OpenAI-compatible replay server")
+    serve_parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    serve_parser.add_argument('--store', default=DEFAULT_STORE, help='Recording directory')
+    serve_parser.add_argument('--latency', default=None,
+                              help='"recorded" or a fixed number of seconds per response')
+    serve_parser.add_argument('--latency-scale', type=float, default=None,
+                              help='Multiplier for the recorded timing')
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.port, RecordingStore(args.store), LatencyModel(args.latency, args.latency_scale))
@@ -1,9 +1,17 @@
-from openai import OpenAI
 import mdns_parser
 import os
+import time
 import re
+import sys
+import struct
 import subprocess
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from mdns_harness import MAX_PACKET_SIZE, MdnsHarness, load_packets
+
+# The record/replay layer is shared with the other tools, at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from llm_replay import openai_client
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Generate and run mDNS test cases')
@@ -12,20 +20,98 @@ def parse_args():
                        help='Directory containing gcov files')
     parser.add_argument('--max-runs', type=int, default=10,
                        help='Maximum number of test generation runs')
+    parser.add_argument('--batch-harness',
+                       help='mdns_harness.c built with -DMDNS_BATCH_STDIN (e.g. ./test_batch), runs all packets in a few long-lived processes '
+                            'instead of one test_sim per packet')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                       help='Batch harness processes the packets are sharded across')
+    parser.add_argument('--shared-harness',
+                       help='mdns_harness.c built with -DMDNS_SHARED_LIB (e.g. ./libmdns_harness.so), parses the packets '
+                            'in-process through ctypes')
     return parser.parse_args()
 
-def run_test_cases(run_dir, parent_dir):
+# Function to frame packets for the batch harness: 4-byte little-endian length, then the payload
+def frame_packets(packets):
+    return b"".join(struct.pack("<I", len(packet)) + packet for packet in packets)
+
+# Acknowledgement of a parsed packet by the batch harness, a whole line with the packet index.
+# The NUL prefix can't come from mdns log output, which may be printed on the same stdout.
+ACK_LINE = re.compile(rb"\x00MDNS_ACK (\d+)\n")
+
+# Function to run a shard of packets through one batch harness process, restarting it after a crash
+def run_batch_shard(harness, parent_dir, bin_paths):
+    """
+    Feed packets to the batch harness, one process for the whole shard.
+
+    The harness acknowledges every parsed packet with a line on stdout, so a
+    crash is attributed to the packet after the last acknowledgement; the
+    harness is then restarted with the remaining packets. A crash after the
+    last packet was acknowledged happened in the harness teardown.
+
+    Returns:
+        Tuple of (number of harness processes started, list of (description, return code) of the crashes)
+    """
+    packets = []
+    for bin_path in bin_paths:
+        with open(bin_path, "rb") as f:
+            packets.append(f.read()[:MAX_PACKET_SIZE])
+
+    processes = 0
+    crashes = []
+    position = 0
+    while position < len(packets):
+        processes += 1
+        result = subprocess.run([harness], cwd=parent_dir, input=frame_packets(packets[position:]),
+                                stdout=subprocess.PIPE)
+        acknowledged = [int(index) for index in ACK_LINE.findall(result.stdout)]
+        if acknowledged != list(range(len(acknowledged))):
+            raise RuntimeError(f"{harness} acknowledged packets out of order: {acknowledged[:10]}")
+        if result.returncode != 0 and position + len(acknowledged) == len(packets):
+            crashes.append((f"teardown after {bin_paths[-1]}", result.returncode))
+        position += len(acknowledged)
+        if result.returncode != 0:
+            if position < len(packets):
+                crashes.append((bin_paths[position], result.returncode))
+            position += 1
+        elif not acknowledged:
+            # A clean exit without parsing anything, the harness is not a batch build
+            raise RuntimeError(f"{harness} did not acknowledge any packet, was it built with -DMDNS_BATCH_STDIN?")
+    return processes, crashes
+
+def run_test_cases(run_dir, parent_dir, batch_harness=None, workers=1, shared_harness=None):
     # Execute test cases and collect coverage
-    bin_files = [f for f in os.listdir(run_dir) if f.endswith(".bin")]
+    bin_files = sorted(f for f in os.listdir(run_dir) if f.endswith(".bin"))
     print("\nbin_files:")
     print(bin_files)
 
-    if bin_files:
+    if bin_files and shared_harness:
+        # Parse in-process, then write this run's coverage and zero the counters for the next one
+        buffer, packets = load_packets([os.path.join(run_dir, bin_file) for bin_file in bin_files])
+        start = time.perf_counter()
+        count = shared_harness.parse_many(packets)
+        print(f"\nParsed {count} packets in-process in {time.perf_counter() - start:.3f}s")
+        if not shared_harness.dump_coverage():
+            print("Shared harness built without -DMDNS_GCOV, gcov will not see these packets")
+        shared_harness.reset_coverage()
+    elif bin_files and batch_harness:
+        # Shard the packets across a few long-lived harness processes
+        bin_paths = [os.path.join(run_dir, bin_file) for bin_file in bin_files]
+        shards = [bin_paths[i::workers] for i in range(min(workers, len(bin_paths)))]
+        print(f"\nRunning {batch_harness} with {len(bin_paths)} packets in {len(shards)} processes")
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            results = list(executor.map(lambda shard: run_batch_shard(batch_harness, parent_dir, shard), shards))
+        processes = sum(started for started, _ in results)
+        crashes = [crash for _, shard_crashes in results for crash in shard_crashes]
+        print(f"{len(bin_paths)} packets in {processes} harness processes, {len(crashes)} crashes")
+        for where, returncode in crashes:
+            print(f"Harness crashed (return code {returncode}) on {where}")
+    elif bin_files:
         for bin_file in bin_files:
             bin_path = os.path.join(run_dir, bin_file)
             print(f"\nRunning test_sim with {bin_path}")
             subprocess.run(["./test_sim", bin_path], cwd=parent_dir, check=True)
 
+    if bin_files:
         # Update coverage info
         print("\nRunning gcov to update coverage info...")
         subprocess.run(["gcov", "mdns_receive.c"], cwd=parent_dir, check=True)
@@ -33,6 +119,8 @@ def run_test_cases(run_dir, parent_dir):
 def main():
     args = parse_args()
     gcov_file = os.path.join(args.gcov_dir, "mdns_receive.c.gcov")
+    # mdns is set up once per process, the library stays loaded across runs
+    shared_harness = MdnsHarness(args.shared_harness) if args.shared_harness else None
 
     for run_id in range(args.max_runs):
         print(f"Run {run_id}")
@@ -88,8 +176,11 @@ Please output only directly executable python code (you can add comments and pri
             }
         ]
 
-        # Initialize OpenAI client
-        client = OpenAI(api_key=os.environ["API_KEY"], base_url=os.environ["BASE_URL"])
+        # Initialize OpenAI client (LLM_REPLAY_MODE=record/replay captures or replays the completions)
+        if os.environ.get("LLM_REPLAY_MODE") == "replay":
+            client = openai_client()
+        else:
+            client = openai_client(api_key=os.environ["API_KEY"], base_url=os.environ["BASE_URL"])
         model = os.environ["MODEL"]
 
         # Get completion from API
@@ -123,10 +214,13 @@ Please output only directly executable python code (you can add comments and pri
                 print(f"Error executing generated script: {e}")
                 print("...but let's continue, maybe we have some valid test cases.")
 
-            run_test_cases(run_dir, parent_dir)
+            run_test_cases(run_dir, parent_dir, args.batch_harness, args.workers, shared_harness)
         else:
             print("No valid Python code found in the completion output.")
 
+    if shared_harness:
+        shared_harness.close()
+
 if __name__ == "__main__":
     main()
 
@@ -0,0 +1,213 @@
+/*
+ * Persistent harnesses of the mdns receive test, used by make_cases.py
+ *
+ * test.c (components/mdns/tests/test_afl_fuzz_host) runs one packet per
+ * process. This file reuses its helpers, globals and mdns setup, and parses
+ * many packets per process instead. Build it in that directory with the same
+ * mdns sources, include paths and flags as test_sim, adding -DINSTR_IS_OFF so
+ * that the included AFL main builds without AFL:
+ *
+ *   batch harness, packets on stdin (make_cases.py --batch-harness ./test_batch):
+ *     gcc -DINSTR_IS_OFF -DMDNS_BATCH_STDIN --coverage <test_sim flags and sources> -o test_batch mdns_harness.c
+ *
+ *   shared library, packets through ctypes (make_cases.py --shared-harness ./libmdns_harness.so, mdns_harness.py):
+ *     gcc -DINSTR_IS_OFF -DMDNS_SHARED_LIB -DMDNS_GCOV --coverage -shared -fPIC <test_sim flags and sources> -o libmdns_harness.so mdns_harness.c
+ *
+ * Drop -DMDNS_GCOV --coverage for a library without coverage counters.
+ */
+
+// The helpers and globals of the AFL test, with its main renamed out of the way
+#define main mdns_afl_test_main
+#include "test.c"
+#undef main
+
+#define MDNS_HARNESS_MAX_PACKET 1460
+
+// Set up mdns with the hostname, delegated hosts and services the packets are checked against
+static void mdns_harness_setup(void)
+{
+    const char *mdns_hostname = "minifritz";
+    const char *mdns_instance = "Hristo's Time Capsule";
+    mdns_txt_item_t arduTxtData[4] = {
+        {"board", "esp32"},
+        {"tcp_check", "no"},
+        {"ssh_upload", "no"},
+        {"auth_upload", "no"}
+    };
+
+    const uint8_t mac[6] = {0xDE, 0xAD, 0xBE, 0xEF, 0x00, 0x32};
+
+    char winstance[21 + strlen(mdns_hostname)];
+
+    sprintf(winstance, "%s [%02x:%02x:%02x:%02x:%02x:%02x]", mdns_hostname, mac[0], mac[1], mac[2], mac[3], mac[4], mac[5]);
+
+    // Init depencency injected methods
+    mdns_test_init_di();
+    mdns_querier_test_init_di();
+
+    if (mdns_init()) {
+        abort();
+    }
+
+    if (mdns_test_hostname_set(mdns_hostname)) {
+        abort();
+    }
+
+    if (mdns_test_add_delegated_host(mdns_hostname) || mdns_test_add_delegated_host("megafritz")) {
+        abort();
+    }
+
+#ifndef MDNS_NO_SERVICES
+
+    if (mdns_test_sub_service_add("_server", "_fritz", "_tcp", 22)) {
+        abort();
+    }
+
+    if (mdns_test_service_add("_telnet", "_tcp", 22)) {
+        abort();
+    }
+
+    if (mdns_test_service_add("_workstation", "_tcp", 9)) {
+        abort();
+    }
+    if (mdns_test_service_instance_name_set("_workstation", "_tcp", winstance)) {
+        abort();
+    }
+
+    if (mdns_test_service_add("_arduino", "_tcp", 3232)) {
+        abort();
+    }
+
+    if (mdns_test_service_txt_set("_arduino", "_tcp", 4, arduTxtData)) {
+        abort();
+    }
+
+    if (mdns_test_service_add("_http", "_tcp", 80)) {
+        abort();
+    }
+
+    if (mdns_test_service_instance_name_set("_http", "_tcp", "ESP WebServer")) {
+        abort();
+    }
+
+    if (
+        mdns_test_service_add("_afpovertcp", "_tcp", 548)
+        || mdns_test_service_add("_rfb", "_tcp", 885)
+        || mdns_test_service_add("_smb", "_tcp", 885)
+        || mdns_test_service_add("_adisk", "_tcp", 885)
+        || mdns_test_service_add("_airport", "_tcp", 885)
+        || mdns_test_service_add("_printer", "_tcp", 885)
+        || mdns_test_service_add("_airplay", "_tcp", 885)
+        || mdns_test_service_add("_raop", "_tcp", 885)
+        || mdns_test_service_add("_uscan", "_tcp", 885)
+        || mdns_test_service_add("_uscans", "_tcp", 885)
+        || mdns_test_service_add("_ippusb", "_tcp", 885)
+        || mdns_test_service_add("_scanner", "_tcp", 885)
+        || mdns_test_service_add("_ipp", "_tcp", 885)
+        || mdns_test_service_add("_ipps", "_tcp", 885)
+        || mdns_test_service_add("_pdl-datastream", "_tcp", 885)
+        || mdns_test_service_add("_ptp", "_tcp", 885)
+        || mdns_test_service_add("_sleep-proxy", "_udp", 885)) {
+        abort();
+    }
+#endif
+}
+
+// Feed one received packet to the parser, as the AFL test does
+static void mdns_harness_packet(const uint8_t *data, size_t len)
+{
+    mypbuf.payload = malloc(len);
+    memcpy(mypbuf.payload, data, len);
+    mypbuf.len = len;
+    g_packet.pb = &mypbuf;
+    mdns_test_query("minifritz", "_fritz", "_tcp", MDNS_TYPE_ANY);
+    mdns_test_query(NULL, "_fritz", "_tcp", MDNS_TYPE_PTR);
+    mdns_test_query(NULL, "_afpovertcp", "_tcp", MDNS_TYPE_PTR);
+    mdns_parse_packet(&g_packet);
+    free(mypbuf.payload);
+}
+
+static void mdns_harness_cleanup(void)
+{
+#ifndef MDNS_NO_SERVICES
+    mdns_service_remove_all();
+#endif
+    ForceTaskDelete();
+    mdns_free();
+}
+
+#if defined(MDNS_SHARED_LIB)
+
+#if defined(MDNS_GCOV)
+// gcov runtime entry points (libgcov)
+extern void __gcov_dump(void);
+extern void __gcov_reset(void);
+#endif
+
+void mdns_harness_init(void)
+{
+    mdns_harness_setup();
+}
+
+void mdns_harness_parse(const uint8_t *data, size_t len)
+{
+    mdns_harness_packet(data, len > MDNS_HARNESS_MAX_PACKET ? MDNS_HARNESS_MAX_PACKET : len);
+}
+
+void mdns_harness_teardown(void)
+{
+    mdns_harness_cleanup();
+}
+
+// Write the counters to the .gcda files (merged with their contents), 0 without coverage
+int mdns_harness_coverage_dump(void)
+{
+#if defined(MDNS_GCOV)
+    __gcov_dump();
+    return 1;
+#else
+    return 0;
+#endif
+}
+
+// Zero the counters, so that a following dump adds only what ran since
+int mdns_harness_coverage_reset(void)
+{
+#if defined(MDNS_GCOV)
+    __gcov_reset();
+    return 1;
+#else
+    return 0;
+#endif
+}
+
+#elif defined(MDNS_BATCH_STDIN)
+
+// Packets on stdin, each a 4-byte little-endian length followed by the payload.
+// Every parsed packet is acknowledged on stdout with a NUL-prefixed "MDNS_ACK <index>" line,
+// which mdns log output can't produce, so the runner can pin a crash to the packet after the last one.
+int main(int argc, char **argv)
+{
+    uint8_t buf[MDNS_HARNESS_MAX_PACKET];
+    uint8_t header[4];
+    unsigned long index;
+    size_t len;
+
+    mdns_harness_setup();
+    for (index = 0; fread(header, 1, 4, stdin) == 4; index++) {
+        len = header[0] | header[1] << 8 | header[2] << 16 | (size_t)header[3] << 24;
+        if (len > sizeof(buf) || fread(buf, 1, len, stdin) != len) {
+            break;
+        }
+        mdns_harness_packet(buf, len);
+        fputc('\0', stdout);
+        printf("MDNS_ACK %lu\n", index);
+        fflush(stdout);
+    }
+    mdns_harness_cleanup();
+    return 0;
+}
+
+#else
+#error "Build with -DMDNS_BATCH_STDIN or -DMDNS_SHARED_LIB"
+#endif
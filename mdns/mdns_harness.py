@@ -0,0 +1,125 @@
+"""
+In-process mdns_parse_packet through the harness built as a shared library.
+
+mdns_harness.c, compiled with -DMDNS_SHARED_LIB next to the AFL test.c,
+exports init/parse/teardown entry points instead of main, plus the gcov
+dump/reset of its coverage counters (see its header for the build):
+
+    gcc -DINSTR_IS_OFF -DMDNS_SHARED_LIB -DMDNS_GCOV --coverage -shared -fPIC <test_sim flags and sources> -o libmdns_harness.so mdns_harness.c
+
+Packets are passed as buffers (bytes, bytearray, memoryview) without copying
+them on the Python side, so thousands of packets per second are parsed
+without a process spawn each. A crash in the parser takes down the calling
+process; the batch harness of make_cases.py (--batch-harness) pins it to a
+packet.
+
+    python mdns_harness.py ./libmdns_harness.so run_0/*.bin --repeat 100
+"""
+import ctypes
+import os
+import sys
+import time
+
+# Largest packet the harness accepts (its receive buffer)
+MAX_PACKET_SIZE = 1460
+
+class MdnsHarness:
+    """
+    The mdns receive harness loaded from a shared library.
+
+    mdns keeps global state, so the library is initialized once per process:
+    the hostname, delegated hosts and services are set up on construction
+    and removed by close().
+    """
+
+    def __init__(self, lib_path):
+        """
+        Args:
+            lib_path: mdns_harness.c built with -DMDNS_SHARED_LIB (and -DMDNS_GCOV --coverage for coverage)
+        """
+        self.lib = ctypes.CDLL(os.path.abspath(lib_path))
+        self.lib.mdns_harness_init.restype = None
+        self.lib.mdns_harness_parse.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        self.lib.mdns_harness_parse.restype = None
+        self.lib.mdns_harness_teardown.restype = None
+        self.lib.mdns_harness_coverage_dump.restype = ctypes.c_int
+        self.lib.mdns_harness_coverage_reset.restype = ctypes.c_int
+        self.lib.mdns_harness_init()
+        self.closed = False
+
+    def parse(self, packet):
+        """
+        Feed one packet to mdns_parse_packet.
+
+        bytes and writable buffers (bytearray, mmap, memoryviews of them) are
+        passed by address; a read-only memoryview is copied once.
+        """
+        if isinstance(packet, bytes):
+            self.lib.mdns_harness_parse(packet, len(packet))
+            return
+        view = memoryview(packet).cast("B")
+        if view.readonly:
+            data = view.tobytes()
+            self.lib.mdns_harness_parse(data, len(data))
+        elif len(view):
+            self.lib.mdns_harness_parse(ctypes.addressof(ctypes.c_char.from_buffer(view)), len(view))
+        else:
+            self.lib.mdns_harness_parse(None, 0)
+
+    def parse_many(self, packets):
+        """Feed packets to mdns_parse_packet, returns the number parsed."""
+        count = 0
+        for packet in packets:
+            self.parse(packet)
+            count += 1
+        return count
+
+    def dump_coverage(self):
+        """Merge the coverage counters into the .gcda files, False if the library was built without -DMDNS_GCOV."""
+        return bool(self.lib.mdns_harness_coverage_dump())
+
+    def reset_coverage(self):
+        """Zero the coverage counters, so that the next dump covers only the packets parsed since."""
+        return bool(self.lib.mdns_harness_coverage_reset())
+
+    def close(self):
+        if not self.closed:
+            self.lib.mdns_harness_teardown()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Function to load packet files into one buffer, returns the buffer and a memoryview slice per packet
+def load_packets(bin_paths, max_size=MAX_PACKET_SIZE):
+    buffer = bytearray()
+    ranges = []
+    for bin_path in bin_paths:
+        with open(bin_path, "rb") as f:
+            data = f.read(max_size)
+        ranges.append((len(buffer), len(buffer) + len(data)))
+        buffer += data
+    view = memoryview(buffer)
+    return buffer, [view[start:end] for start, end in ranges]
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Parse packet files in-process with the shared library harness')
+    parser.add_argument('lib', help='mdns_harness.c built with -DMDNS_SHARED_LIB')
+    parser.add_argument('packets', nargs='+', help='Packet files (.bin)')
+    parser.add_argument('--repeat', type=int, default=1, help='Parse the packets this many times')
+    args = parser.parse_args()
+
+    buffer, packets = load_packets(args.packets)
+    with MdnsHarness(args.lib) as harness:
+        harness.reset_coverage()
+        start = time.perf_counter()
+        count = sum(harness.parse_many(packets) for _ in range(args.repeat))
+        elapsed = time.perf_counter() - start
+        print(f"{count} packets in {elapsed:.3f}s ({count / elapsed:.0f} packets/s)")
+        if not harness.dump_coverage():
+            print("Library built without -DMDNS_GCOV, no coverage written", file=sys.stderr)
@@ -0,0 +1,185 @@
+"""
+Benchmark of the detailed-description extraction in doxyparse.py.
+
+Compares parse_member() with the previous extractor, which serialized every
+detaileddescription with ET.tostring, cut the parameter lists and simple
+sections out with regular expressions and parsed the rest again. Both run
+over the same function memberdefs and must give identical results.
+
+Runs on real Doxygen output, or on a generated XML set:
+
+    python bench_doxyparse.py ./xml
+    python bench_doxyparse.py --compounds 400 --functions 60
+"""
+import xml.etree.ElementTree as ET
+import argparse
+import os
+import random
+import re
+import tempfile
+import time
+from io import StringIO
+
+from doxyparse import iter_compounds, parse_member
+
+def legacy_parse_member(member):
+    """The serialize/regex/reparse extractor parse_member() replaced, kept as the reference."""
+    function_name = member.find("name").text
+
+    location = member.find("location")
+    file_path = location.get("file") if location is not None else "Unknown"
+    start_line = int(location.get("line")) if location is not None and location.get("line") else None
+
+    definition = member.find("definition")
+    prototype = definition.text if definition is not None else "Unknown"
+
+    brief_doc = member.find("briefdescription")
+    detailed_doc = member.find("detaileddescription")
+    brief_text = "".join(brief_doc.itertext()).strip() if brief_doc is not None else ""
+
+    detailed_text = ""
+    param_text = ""
+    return_text = ""
+
+    if detailed_doc is not None:
+        param_list = detailed_doc.find(".//parameterlist[@kind='param']")
+        if param_list is not None:
+            param_text = "Parameters:\n"
+            for param_item in param_list.findall("parameteritem"):
+                name = param_item.find(".//parametername").text if param_item.find(".//parametername") is not None else "Unknown"
+                desc = "".join(param_item.find(".//parameterdescription").itertext()).strip() if param_item.find(".//parameterdescription") is not None else "No description"
+                param_text += f"- *{name}* {desc}\n"
+
+        return_sect = detailed_doc.find(".//simplesect[@kind='return']")
+        if return_sect is not None:
+            return_value = "".join(return_sect.itertext()).strip()
+            if return_value:
+                return_text = f"Returns:\n{return_value}"
+
+        detailed_xml = ET.tostring(detailed_doc, encoding='utf-8').decode('utf-8')
+        detailed_xml = re.sub(r'<parameterlist.*?</parameterlist>', '', detailed_xml, flags=re.DOTALL)
+        detailed_xml = re.sub(r'<simplesect.*?</simplesect>', '', detailed_xml, flags=re.DOTALL)
+        temp_tree = ET.parse(StringIO(f'<root>{detailed_xml}</root>'))
+        detailed_text = "".join(temp_tree.getroot().itertext()).strip()
+        detailed_text = re.sub(r'\s+', ' ', detailed_text).strip()
+
+    doxy_comment = brief_text
+    if detailed_text:
+        doxy_comment += "\n\n" + detailed_text
+    if param_text:
+        doxy_comment += "\n\n" + param_text
+    if return_text:
+        doxy_comment += "\n\n" + return_text
+
+    return {
+        "name": function_name,
+        "file": file_path,
+        "line": start_line,
+        "prototype": prototype,
+        "doc": doxy_comment,
+    }
+
+def generate_xml(xml_dir, compounds=400, functions=60, seed=0):
+    """
+    Write a synthetic Doxygen XML set shaped like the lwip output.
+
+    Every compound is a file with `functions` documented functions (brief,
+    detailed paragraphs with inline markup, parameter lists, return and note
+    sections, references) and as many variables.
+    """
+    rng = random.Random(seed)
+    os.makedirs(xml_dir, exist_ok=True)
+    index = ['<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n<doxygenindex version="1.9.1">']
+    member_id = 0
+    for c in range(compounds):
+        refid = f"tcp_{c}_8c"
+        index.append(f'  <compound refid="{refid}" kind="file"><name>tcp_{c}.c</name>')
+        body = [f'<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n<doxygen version="1.9.1">\n'
+                f'  <compounddef id="{refid}" kind="file" language="C++">\n    <compoundname>tcp_{c}.c</compoundname>']
+        for section, kind in (("func", "function"), ("var", "variable")):
+            body.append(f'    <sectiondef kind="{section}">')
+            for k in range(functions):
+                member_id += 1
+                name = f"tcp_{rng.choice(['input', 'output', 'rexmit', 'update'])}_{c}_{k}"
+                params = "".join(
+                    f'<parameteritem><parameternamelist><parametername>arg{i}</parametername></parameternamelist>'
+                    f'<parameterdescription>\n<para>the <ref refid="struct_pcb" kindref="compound">pcb</ref> '
+                    f'argument {i} &amp; its state </para>\n</parameterdescription></parameteritem>'
+                    for i in range(rng.randint(0, 4))
+                )
+                params = f'<parameterlist kind="param">{params}</parameterlist>' if params else ""
+                returns = '<simplesect kind="return"><para>ERR_OK on <bold>success</bold>, ERR_MEM otherwise</para></simplesect>' if rng.random() < 0.6 else ""
+                note = '<simplesect kind="note"><para>Must be called with the core lock held.</para></simplesect>' if rng.random() < 0.3 else ""
+                detailed = (
+                    f'<detaileddescription>\n<para>Called by <ref refid="x" kindref="member">tcp_input</ref> when a segment\n'
+                    f'   arrives for <computeroutput>{name}</computeroutput>. Congestion window is updated (RFC 5681).{params}{returns}{note}</para>\n'
+                    f'<para>Second paragraph with <emphasis>details</emphasis>.</para>\n</detaileddescription>'
+                    if rng.random() < 0.8 else '<detaileddescription>\n</detaileddescription>'
+                )
+                references = "".join(
+                    f'<references refid="r{j}" compoundref="c" startline="{j}" endline="{j + 5}">tcp_output_{j}</references>'
+                    for j in range(rng.randint(0, 5))
+                )
+                body.append(
+                    f'      <memberdef kind="{kind}" id="{refid}_{member_id}" prot="public" static="no">\n'
+                    f'        <type>err_t</type>\n        <definition>err_t {name}</definition>\n'
+                    f'        <argsstring>(struct tcp_pcb *pcb)</argsstring>\n        <name>{name}</name>\n'
+                    f'        <briefdescription>\n<para>Brief description of {name}. </para>\n        </briefdescription>\n'
+                    f'        {detailed}\n        <inbodydescription>\n        </inbodydescription>\n'
+                    f'        <location file="src/core/tcp_{c}.c" line="{k * 20 + 1}" column="1" bodyfile="src/core/tcp_{c}.c" '
+                    f'bodystart="{k * 20 + 2}" bodyend="{k * 20 + 18}"/>\n        {references}\n      </memberdef>'
+                )
+            body.append('    </sectiondef>')
+        body.append('  </compounddef>\n</doxygen>\n')
+        with open(os.path.join(xml_dir, refid + ".xml"), "w", encoding="utf-8") as f:
+            f.write("\n".join(body))
+        index.append('  </compound>')
+    index.append('</doxygenindex>\n')
+    with open(os.path.join(xml_dir, "index.xml"), "w", encoding="utf-8") as f:
+        f.write("\n".join(index))
+
+def load_members(xml_dir):
+    """All function memberdefs of an XML set, fully parsed up front so only the extraction is timed."""
+    members = []
+    for refid, kind in iter_compounds(os.path.join(xml_dir, "index.xml")):
+        path = os.path.join(xml_dir, refid + ".xml")
+        if os.path.exists(path):
+            members.extend(ET.parse(path).getroot().iterfind(".//memberdef[@kind='function']"))
+    return members
+
+def time_extractor(extractor, members, repeat):
+    """Best wall time of running the extractor over all members."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for member in members:
+            extractor(member)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the detailed-description extraction of doxyparse.py')
+    parser.add_argument('xml_dir', nargs='?', help='Doxygen XML output (default: a generated XML set)')
+    parser.add_argument('--compounds', type=int, default=400, help='Compounds of the generated XML set')
+    parser.add_argument('--functions', type=int, default=60, help='Functions per generated compound')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per extractor, the best one counts')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="doxyparse_bench_") as tmp:
+        xml_dir = args.xml_dir
+        if not xml_dir:
+            xml_dir = os.path.join(tmp, "xml")
+            generate_xml(xml_dir, args.compounds, args.functions)
+        members = load_members(xml_dir)
+
+    mismatches = [m.find("name").text for m in members if legacy_parse_member(m) != parse_member(m)]
+    legacy = time_extractor(legacy_parse_member, members, args.repeat)
+    single_pass = time_extractor(parse_member, members, args.repeat)
+
+    print(f"{len(members)} functions, {len(mismatches)} mismatches{': ' + ', '.join(mismatches[:5]) if mismatches else ''}")
+    print(f"serialize/regex/reparse: {legacy:.3f}s ({legacy / max(1, len(members)) * 1e6:.1f} us/function)")
+    print(f"single pass:             {single_pass:.3f}s ({single_pass / max(1, len(members)) * 1e6:.1f} us/function)")
+    print(f"speedup: {legacy / single_pass:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Call graph of the functions in a Doxygen XML output directory.
+
+Doxygen lists, for every memberdef, the members it references
+(<references>) and the members referencing it (<referencedby>). The edges
+between functions are stored in compressed sparse row (CSR) arrays in both
+directions, so callers, callees and everything reachable from a function
+are found without touching the XML or the sources again.
+
+    python callgraph.py ./xml --callers tcp_output
+    python callgraph.py ./xml --callees tcp_input --depth 2
+"""
+import xml.etree.ElementTree as ET
+import os
+import pickle
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from doxyparse import COMPOUNDS_PER_TASK, iter_compounds, log
+
+DEFAULT_CALLGRAPH_CACHE = os.getenv("CALLGRAPH_CACHE", "callgraph.pickle")
+
+def parse_compound_references(compound_path):
+    """
+    Extract the reference edges of the functions of one compound XML file.
+
+    Returns:
+        List of (id, name, file, line, referenced ids, referencing ids) per function memberdef
+    """
+    functions = []
+    for event, elem in ET.iterparse(compound_path, events=("end",)):
+        if elem.tag == "memberdef":
+            if elem.get("kind") == "function":
+                location = elem.find("location")
+                line = location.get("line") if location is not None else None
+                functions.append((
+                    elem.get("id"),
+                    elem.findtext("name"),
+                    location.get("file") if location is not None else "Unknown",
+                    int(line) if line else None,
+                    [ref.get("refid") for ref in elem.iterfind("references")],
+                    [ref.get("refid") for ref in elem.iterfind("referencedby")],
+                ))
+            elem.clear()
+        elif elem.tag == "sectiondef":
+            elem.clear()
+    return functions
+
+def _parse_compound_references(compound_paths):
+    return [parse_compound_references(path) for path in compound_paths]
+
+class CallGraph:
+    """
+    Function call graph in CSR form.
+
+    Functions are numbered 0..n-1. The callees of function i are
+    callee_targets[callee_offsets[i]:callee_offsets[i + 1]], the callers
+    likewise in caller_offsets/caller_targets. Functions sharing a name
+    (static functions in different files) are separate nodes.
+    """
+
+    def __init__(self, ids, names, files, lines, edges):
+        """
+        Args:
+            ids: Doxygen member id of every function
+            names: Name of every function
+            files: Source file of every function
+            lines: Line of every function
+            edges: Iterable of (caller, callee) node numbers, duplicates allowed
+        """
+        self.ids = ids
+        self.names = names
+        self.files = files
+        self.lines = lines
+        edges = sorted(set(edges))
+        self.callee_offsets, self.callee_targets = self._csr(edges)
+        self.caller_offsets, self.caller_targets = self._csr(sorted((callee, caller) for caller, callee in edges))
+        self._index_names()
+
+    # Attributes stored in the cache, by_name is rebuilt on load
+    STATE = ("ids", "names", "files", "lines", "callee_offsets", "callee_targets", "caller_offsets", "caller_targets")
+
+    def __getstate__(self):
+        # Plain lists and arrays, so the cache does not depend on the module the class was pickled from
+        return {key: getattr(self, key) for key in self.STATE}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._index_names()
+
+    def _index_names(self):
+        self.by_name = {}
+        for node, name in enumerate(self.names):
+            self.by_name.setdefault(name, []).append(node)
+
+    def _csr(self, edges):
+        """Offsets and targets of sorted (source, target) edges."""
+        offsets = array("l", [0] * (len(self.ids) + 1))
+        for source, target in edges:
+            offsets[source + 1] += 1
+        for node in range(len(self.ids)):
+            offsets[node + 1] += offsets[node]
+        return offsets, array("l", (target for source, target in edges))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def num_edges(self):
+        return len(self.callee_targets)
+
+    def nodes(self, name):
+        """Node numbers of the functions with this name."""
+        return self.by_name.get(name, [])
+
+    def node_info(self, node):
+        return {"name": self.names[node], "file": self.files[node], "line": self.lines[node]}
+
+    def callees(self, node):
+        """Node numbers of the functions called by a node."""
+        return self.callee_targets[self.callee_offsets[node]:self.callee_offsets[node + 1]]
+
+    def callers(self, node):
+        """Node numbers of the functions calling a node."""
+        return self.caller_targets[self.caller_offsets[node]:self.caller_offsets[node + 1]]
+
+    def reachable(self, nodes, direction="callees", max_depth=None):
+        """
+        Breadth-first walk of the transitive callees (or callers) of some nodes.
+
+        Args:
+            nodes: Start nodes
+            direction: "callees" or "callers"
+            max_depth: Stop after this many calls (default: the whole closure)
+
+        Returns:
+            Dict mapping every reached node to its call distance, start nodes excluded
+        """
+        offsets, targets = ((self.callee_offsets, self.callee_targets) if direction == "callees"
+                            else (self.caller_offsets, self.caller_targets))
+        visited = bytearray(len(self.ids))
+        for node in nodes:
+            visited[node] = 1
+        reached = {}
+        queue = deque((node, 0) for node in nodes)
+        while queue:
+            node, depth = queue.popleft()
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for target in targets[offsets[node]:offsets[node + 1]]:
+                if not visited[target]:
+                    visited[target] = 1
+                    reached[target] = depth + 1
+                    queue.append((target, depth + 1))
+        return reached
+
+def build_call_graph(xml_dir, workers=None, verbose=False):
+    """
+    Build the call graph of a Doxygen XML output directory.
+
+    Compound files are parsed in a process pool like parse_doxygen_functions.
+    References to members that are not functions (variables, macros) are
+    dropped, and a function listed in several compounds is one node.
+
+    Args:
+        xml_dir: Doxygen XML output directory (containing index.xml)
+        workers: Number of worker processes (default: CPU count, 1 parses in-process)
+        verbose: Print a line for every compound
+
+    Returns:
+        CallGraph
+    """
+    workers = workers or os.cpu_count() or 1
+    compound_paths = []
+    for refid, kind in iter_compounds(os.path.join(xml_dir, "index.xml")):
+        compound_path = os.path.join(xml_dir, refid + ".xml")
+        if os.path.exists(compound_path):
+            log(verbose, f"Found compound: {refid} of kind: {kind}")
+            compound_paths.append(compound_path)
+
+    if workers == 1 or len(compound_paths) <= COMPOUNDS_PER_TASK:
+        results = _parse_compound_references(compound_paths)
+    else:
+        batches = [compound_paths[i:i + COMPOUNDS_PER_TASK] for i in range(0, len(compound_paths), COMPOUNDS_PER_TASK)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = [functions for batch in executor.map(_parse_compound_references, batches) for functions in batch]
+
+    nodes = {}
+    ids, names, files, lines, references = [], [], [], [], []
+    for compound_functions in results:
+        for member_id, name, file, line, refs, referenced_by in compound_functions:
+            if member_id not in nodes:
+                nodes[member_id] = len(ids)
+                ids.append(member_id)
+                names.append(name)
+                files.append(file)
+                lines.append(line)
+                references.append((refs, referenced_by))
+            else:
+                # Listed in another compound (e.g. declared in a header), merge its references
+                merged_refs, merged_referenced_by = references[nodes[member_id]]
+                references[nodes[member_id]] = (merged_refs + refs, merged_referenced_by + referenced_by)
+
+    edges = []
+    for node, (refs, referenced_by) in enumerate(references):
+        edges.extend((node, nodes[refid]) for refid in refs if refid in nodes)
+        edges.extend((nodes[refid], node) for refid in referenced_by if refid in nodes)
+    return CallGraph(ids, names, files, lines, edges)
+
+def _index_signature(xml_dir):
+    stat = os.stat(os.path.join(xml_dir, "index.xml"))
+    return [os.path.abspath(xml_dir), stat.st_mtime, stat.st_size]
+
+def load_call_graph(xml_dir, cache_path=DEFAULT_CALLGRAPH_CACHE, workers=None, verbose=False):
+    """
+    Load the call graph from its cache, or build and cache it when the
+    cache is missing or older than the index.xml of the XML directory.
+    """
+    signature = _index_signature(xml_dir)
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+        if cached.get("signature") == signature:
+            graph = CallGraph.__new__(CallGraph)
+            graph.__setstate__(cached["graph"])
+            return graph
+    graph = build_call_graph(xml_dir, workers=workers, verbose=verbose)
+    if cache_path:
+        with open(cache_path, "wb") as f:
+            pickle.dump({"signature": signature, "graph": graph.__getstate__()}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return graph
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Query the call graph of a Doxygen XML output directory')
+    parser.add_argument('xml_dir', nargs='?', default="./xml", help='Doxygen XML output directory')
+    parser.add_argument('--cache', default=DEFAULT_CALLGRAPH_CACHE, help='Call graph cache file (default: CALLGRAPH_CACHE or callgraph.pickle)')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+    parser.add_argument('--callers', help='Show the functions calling this one')
+    parser.add_argument('--callees', help='Show the functions called by this one')
+    parser.add_argument('--depth', type=int, default=1, help='Call distance to follow, 0 for the whole closure')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    graph = load_call_graph(args.xml_dir, args.cache, workers=args.workers)
+    print(f"{len(graph)} functions, {graph.num_edges} calls, loaded in {time.perf_counter() - start:.2f}s")
+
+    for direction, name in (("callers", args.callers), ("callees", args.callees)):
+        if not name:
+            continue
+        start = time.perf_counter()
+        reached = graph.reachable(graph.nodes(name), direction, max_depth=args.depth or None)
+        elapsed = time.perf_counter() - start
+        print(f"{len(reached)} {direction} of {name} in {elapsed * 1e6:.0f} us")
+        for node, depth in sorted(reached.items(), key=lambda item: (item[1], graph.names[item[0]])):
+            info = graph.node_info(node)
+            print(f"{'  ' * depth}{info['name']}  ({info['file']}:{info['line']})")
@@ -1,125 +1,271 @@
 import xml.etree.ElementTree as ET
 import os
 import re
-from io import StringIO
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-def parse_doxygen_functions(xml_dir):
-    functions = {}
+# Compound kinds whose members are parsed (C/C++ files)
+COMPOUND_KINDS = ("file", "namespace")
+# Compound files handed to a worker process at a time
+COMPOUNDS_PER_TASK = 8
+
+def log(verbose, *args):
+    """Print only when verbose logging was requested."""
+    if verbose:
+        print(*args)
+
+def iter_compounds(index_path, kinds=COMPOUND_KINDS):
+    """
+    Stream the compounds listed in a Doxygen index.xml.
+
+    Elements are cleared as soon as they have been read, so memory stays
+    flat regardless of the size of the index.
+
+    Yields:
+        (refid, kind) for every compound of the requested kinds
+    """
+    for event, elem in ET.iterparse(index_path, events=("end",)):
+        if elem.tag == "compound":
+            if elem.get("kind") in kinds:
+                yield elem.get("refid"), elem.get("kind")
+            elem.clear()
+
+# Sections of a detailed description that are rendered separately, not as part of its text
+EXCLUDED_SECTIONS = ("parameterlist", "simplesect")
+
+def _collect_text(elem, parts, sections):
+    """
+    Collect the text of a description subtree in one walk.
+
+    Excluded sections are skipped in place (their tail text is kept); the
+    first parameter list and return section are handed back in `sections`.
+    """
+    if elem.text:
+        parts.append(elem.text)
+    for child in elem:
+        if child.tag in EXCLUDED_SECTIONS:
+            kind = "param" if child.tag == "parameterlist" else "return"
+            if child.get("kind") == kind and kind not in sections:
+                sections[kind] = child
+        else:
+            _collect_text(child, parts, sections)
+        if child.tail:
+            parts.append(child.tail)
+
+def _text(elem):
+    return "".join(elem.itertext()).strip() if elem is not None else ""
+
+def parse_member(member):
+    """
+    Extract the details of a function memberdef element.
+
+    The detailed description is walked once, collecting its text while the
+    parameter lists and simple sections (return, note, ...) are skipped in
+    place; parameters and the return value are read from the skipped subtrees.
+
+    Args:
+        member: The <memberdef kind="function"> element
+
+    Returns:
+        Dict with the name, file, line, prototype and doc of the function
+    """
+    function_name = member.find("name").text
+
+    location = member.find("location")
+    file_path = location.get("file") if location is not None else "Unknown"
+    start_line = int(location.get("line")) if location is not None and location.get("line") else None
+
+    # Extract prototype
+    definition = member.find("definition")
+    prototype = definition.text if definition is not None else "Unknown"
+
+    # Get brief description
+    brief_text = _text(member.find("briefdescription"))
+
+    # Process detailed description section by section
+    detailed_text = ""
+    param_text = ""
+    return_text = ""
+
+    detailed_doc = member.find("detaileddescription")
+    if detailed_doc is not None:
+        parts = []
+        sections = {}
+        _collect_text(detailed_doc, parts, sections)
+        detailed_text = re.sub(r'\s+', ' ', "".join(parts)).strip()
+
+        # Get parameters
+        param_list = sections.get("param")
+        if param_list is not None:
+            param_text = "Parameters:\n"
+            for param_item in param_list.findall("parameteritem"):
+                name = param_item.find(".//parametername")
+                desc = param_item.find(".//parameterdescription")
+                name = name.text if name is not None else "Unknown"
+                desc = _text(desc) if desc is not None else "No description"
+                param_text += f"- *{name}* {desc}\n"
+
+        # Get return value
+        return_value = _text(sections.get("return"))
+        if return_value:
+            return_text = f"Returns:\n{return_value}"
+
+    # Combine all sections
+    doxy_comment = brief_text
+
+    if detailed_text:
+        doxy_comment += "\n\n" + detailed_text
+
+    if param_text:
+        doxy_comment += "\n\n" + param_text
+
+    if return_text:
+        doxy_comment += "\n\n" + return_text
+
+    return {
+        "name": function_name,
+        "file": file_path,
+        "line": start_line,
+        "prototype": prototype,
+        "doc": doxy_comment,
+    }
+
+def parse_compound(compound_path, verbose=False):
+    """
+    Parse the functions of one compound XML file.
+
+    The file is streamed with iterparse and every memberdef is cleared once
+    it has been extracted, so only one member is held in memory at a time.
+
+    Args:
+        compound_path: Path of the compound XML file
+        verbose: Print a line for every function
+
+    Returns:
+        List of function dicts in document order (see parse_member)
+    """
+    functions = []
+    for event, elem in ET.iterparse(compound_path, events=("end",)):
+        if elem.tag == "memberdef":
+            if elem.get("kind") == "function":
+                function = parse_member(elem)
+                functions.append(function)
+                log(verbose, f"Added function: {function['name']}, File: {function['file']}, Line: {function['line']}")
+            elem.clear()
+        elif elem.tag == "sectiondef":
+            # Cleared members stay attached to their section, drop them too once the section ends
+            elem.clear()
+    return functions
+
+def _parse_compounds(compound_paths, verbose):
+    return [parse_compound(path, verbose) for path in compound_paths]
+
+def parse_compounds(compound_paths, workers=None, verbose=False):
+    """
+    Parse several compound files, in a process pool when there are enough of them.
+
+    Args:
+        compound_paths: Paths of the compound XML files
+        workers: Number of worker processes (default: CPU count, 1 parses in-process)
+        verbose: Print a line for every function
+
+    Returns:
+        One list of function dicts per compound, in the order of compound_paths
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(compound_paths) <= COMPOUNDS_PER_TASK:
+        return _parse_compounds(compound_paths, verbose)
+    batches = [compound_paths[i:i + COMPOUNDS_PER_TASK] for i in range(0, len(compound_paths), COMPOUNDS_PER_TASK)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [functions for batch in executor.map(_parse_compounds, batches, [verbose] * len(batches))
+                for functions in batch]
+
+def _peak_rss_kb(children=False):
+    """Peak resident set size in KB (of the largest finished child process if children), None without the resource module."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def parse_doxygen_functions(xml_dir, workers=None, verbose=False, stats=None):
+    """
+    Parse all functions from a Doxygen XML output directory.
+
+    The index is streamed and the compound files are distributed across a
+    process pool, in batches of COMPOUNDS_PER_TASK. Results are merged in
+    index order, so a function defined in several compounds resolves the
+    same way as in a sequential parse.
+
+    Args:
+        xml_dir: Doxygen XML output directory (containing index.xml)
+        workers: Number of worker processes (default: CPU count, 1 parses in-process)
+        verbose: Print a line for every compound and function
+        stats: Optional dict that receives the compound and function counts,
+               the wall time and the peak RSS (KB) of this process and of the workers
+
+    Returns:
+        Dict mapping function names to file, line, prototype and doc
+    """
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
 
     # Load the XML index
     index_path = os.path.join(xml_dir, "index.xml")
-    print(f"Loading XML index from: {index_path}")  # Debug print
-    tree = ET.parse(index_path)
-    root = tree.getroot()
-
-    # Extract function details from each XML file
-    for compound in root.findall(".//compound"):
-        print(f"Found compound: {compound.get('refid')} of kind: {compound.get('kind')}")  # Debug print
-        if compound.get("kind") in ["file", "namespace"]:  # Limit to C/C++ files
-            refid = compound.get("refid") + ".xml"
-            compound_path = os.path.join(xml_dir, refid)
-
-            if not os.path.exists(compound_path):
-                print(f"Warning: XML file {compound_path} not found!")  # Debug print
-                continue
-
-            compound_tree = ET.parse(compound_path)
-            compound_root = compound_tree.getroot()
-
-            for member in compound_root.findall(".//memberdef[@kind='function']"):
-                function_name = member.find("name").text
-
-                location = member.find("location")
-                file_path = location.get("file") if location is not None else "Unknown"
-                start_line = int(location.get("line")) if location is not None and location.get("line") else None
-
-                # Extract prototype
-                definition = member.find("definition")
-                prototype = definition.text if definition is not None else "Unknown"
-
-                # Extract Doxygen comments (if available)
-                brief_doc = member.find("briefdescription")
-                detailed_doc = member.find("detaileddescription")
-
-                # Get brief description
-                brief_text = "".join(brief_doc.itertext()).strip() if brief_doc is not None else ""
-
-                # Process detailed description section by section
-                detailed_text = ""
-                param_text = ""
-                return_text = ""
-
-                if detailed_doc is not None:
-                    # Get parameters
-                    param_list = detailed_doc.find(".//parameterlist[@kind='param']")
-                    if param_list is not None:
-                        param_text = "Parameters:\n"
-                        for param_item in param_list.findall("parameteritem"):
-                            name = param_item.find(".//parametername").text if param_item.find(".//parametername") is not None else "Unknown"
-                            desc = "".join(param_item.find(".//parameterdescription").itertext()).strip() if param_item.find(".//parameterdescription") is not None else "No description"
-                            param_text += f"- *{name}* {desc}\n"
-
-                    # Get return value
-                    return_sect = detailed_doc.find(".//simplesect[@kind='return']")
-                    if return_sect is not None:
-                        return_value = "".join(return_sect.itertext()).strip()
-                        if return_value:
-                            return_text = f"Returns:\n{return_value}"
-
-                    # Extract detailed description text without parameters and return value
-                    # We'll use a different approach - convert to string and manually clean up
-
-                    # Convert the detailed_doc to string
-                    detailed_xml = ET.tostring(detailed_doc, encoding='utf-8').decode('utf-8')
-
-                    # Remove parameterlist sections
-                    detailed_xml = re.sub(r'<parameterlist.*?</parameterlist>', '', detailed_xml, flags=re.DOTALL)
-
-                    # Remove simplesect (return) sections
-                    detailed_xml = re.sub(r'<simplesect.*?</simplesect>', '', detailed_xml, flags=re.DOTALL)
-
-                    # Convert back to element
-                    temp_tree = ET.parse(StringIO(f'<root>{detailed_xml}</root>'))
-                    temp_root = temp_tree.getroot()
-
-                    # Extract text
-                    detailed_text = "".join(temp_root.itertext()).strip()
-
-                    # Clean up extra whitespace
-                    detailed_text = re.sub(r'\s+', ' ', detailed_text).strip()
-
-                # Combine all sections
-                doxy_comment = brief_text
-
-                if detailed_text:
-                    doxy_comment += "\n\n" + detailed_text
-
-                if param_text:
-                    doxy_comment += "\n\n" + param_text
-
-                if return_text:
-                    doxy_comment += "\n\n" + return_text
-
-                # Store function details
-                functions[function_name] = {
-                    "file": file_path,
-                    "line": start_line,
-                    "prototype": prototype,
-                    "doc": doxy_comment,
-                }
-                print(f"Added function: {function_name}, File: {file_path}, Line: {start_line}")  # Debug print
-
-    print(f"Total functions parsed: {len(functions)}")  # Debug print
+    log(verbose, f"Loading XML index from: {index_path}")
+
+    compound_paths = []
+    for refid, kind in iter_compounds(index_path):
+        log(verbose, f"Found compound: {refid} of kind: {kind}")
+        compound_path = os.path.join(xml_dir, refid + ".xml")
+        if not os.path.exists(compound_path):
+            print(f"Warning: XML file {compound_path} not found!")
+            continue
+        compound_paths.append(compound_path)
+
+    functions = {}
+    for compound_functions in parse_compounds(compound_paths, workers, verbose):
+        for function in compound_functions:
+            functions[function.pop("name")] = function
+
+    log(verbose, f"Total functions parsed: {len(functions)}")
+    if stats is not None:
+        stats.update({
+            "compounds": len(compound_paths),
+            "functions": len(functions),
+            "workers": workers,
+            "seconds": time.perf_counter() - start,
+            "peak_rss_kb": _peak_rss_kb(),
+            "peak_rss_workers_kb": _peak_rss_kb(children=True),
+        })
     return functions
 
-# Example usage
-xml_output_dir = "./xml"  # Adjust this if your doxygen XML is in another folder
-function_data = parse_doxygen_functions(xml_output_dir)
-
-for func, details in function_data.items():
-    print(f"Function: {func}")
-    print(f"File: {details['file']}, Line: {details['line']}")
-    print(f"Prototype: {details['prototype']}")
-    if details["doc"]:
-        print(f"Documentation:\n{details['doc']}")
-    print("-" * 50)
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Extract function details from Doxygen XML output')
+    parser.add_argument('xml_dir', nargs='?', default="./xml",
+                        help='Doxygen XML output directory')  # Adjust this if your doxygen XML is in another folder
+    parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+    parser.add_argument('--verbose', action='store_true', help='Log every compound and function while parsing')
+    parser.add_argument('--quiet', action='store_true', help='Only print the summary, not the functions')
+    args = parser.parse_args()
+
+    stats = {}
+    function_data = parse_doxygen_functions(args.xml_dir, workers=args.workers, verbose=args.verbose, stats=stats)
+
+    if not args.quiet:
+        for func, details in function_data.items():
+            print(f"Function: {func}")
+            print(f"File: {details['file']}, Line: {details['line']}")
+            print(f"Prototype: {details['prototype']}")
+            if details["doc"]:
+                print(f"Documentation:\n{details['doc']}")
+            print("-" * 50)
+
+    print(f"Parsed {stats['functions']} functions from {stats['compounds']} compounds "
+          f"in {stats['seconds']:.2f}s with {stats['workers']} workers, "
+          f"peak RSS {stats['peak_rss_kb']} KB (workers {stats['peak_rss_workers_kb']} KB)")
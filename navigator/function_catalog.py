@@ -0,0 +1,304 @@
+"""
+Persistent function catalog built from Doxygen XML output.
+
+The functions extracted by doxyparse.py are stored in a SQLite database, so
+tools can look them up without parsing the XML again. Every compound file
+is tracked by mtime, size and content hash: `update` only re-parses the
+compounds that actually changed (a Doxygen re-run that rewrites identical
+files costs one hash per file) and drops the ones that disappeared.
+
+    python function_catalog.py ./xml --db functions.db
+    python function_catalog.py ./xml --name tcp_input
+    python function_catalog.py ./xml --prefix tcp_ --file tcp_in.c
+"""
+import difflib
+import hashlib
+import os
+import sqlite3
+import time
+
+from doxyparse import iter_compounds, log, parse_compounds
+
+DEFAULT_CATALOG_PATH = os.getenv("FUNCTION_CATALOG", "functions.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS compounds (
+    refid TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS functions (
+    name TEXT NOT NULL,
+    compound TEXT NOT NULL REFERENCES compounds(refid) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    file TEXT,
+    basename TEXT,
+    line INTEGER,
+    prototype TEXT,
+    doc TEXT
+);
+CREATE INDEX IF NOT EXISTS functions_name ON functions(name);
+CREATE INDEX IF NOT EXISTS functions_basename ON functions(basename);
+CREATE INDEX IF NOT EXISTS functions_compound ON functions(compound);
+"""
+
+# Joined with the compound so that duplicates resolve to the last compound in index order
+SELECT_FUNCTIONS = """
+SELECT f.name, f.file, f.line, f.prototype, f.doc FROM functions f JOIN compounds c ON c.refid = f.compound
+"""
+RESOLUTION_ORDER = "c.position DESC, f.position DESC"
+
+def _file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _row_to_function(row):
+    name, file, line, prototype, doc = row
+    return {"name": name, "file": file, "line": line, "prototype": prototype, "doc": doc}
+
+def _first_per_name(rows):
+    """Functions of rows sorted by name and resolution order, one per name."""
+    functions = []
+    for row in rows:
+        if not functions or functions[-1]["name"] != row[0]:
+            functions.append(_row_to_function(row))
+    return functions
+
+class FunctionCatalog:
+    """
+    SQLite catalog of the functions of a Doxygen XML output directory.
+
+    A function defined in several compounds resolves like in
+    parse_doxygen_functions: the last compound in index order wins.
+    """
+
+    def __init__(self, xml_dir, db_path=DEFAULT_CATALOG_PATH):
+        """
+        Args:
+            xml_dir: Doxygen XML output directory (containing index.xml)
+            db_path: SQLite database file, created if missing
+        """
+        self.xml_dir = os.path.abspath(xml_dir)
+        self.db_path = db_path
+        self._names = None
+        self._prefixes = None
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(SCHEMA)
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'xml_dir'").fetchone()
+        if row is not None and row[0] != self.xml_dir:
+            # Catalog of another XML directory, rebuild from scratch
+            with self.conn:
+                self.conn.execute("DELETE FROM compounds")
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('xml_dir', ?)", (self.xml_dir,))
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(DISTINCT name) FROM functions").fetchone()[0]
+
+    def update(self, workers=None, verbose=False):
+        """
+        Bring the catalog in sync with the XML directory.
+
+        Args:
+            workers: Worker processes for parsing changed compounds (see parse_compounds)
+            verbose: Print a line for every re-parsed compound
+
+        Returns:
+            Dict with the number of compounds, changed (re-parsed), removed and
+            touched (new mtime, same content) compounds, and the seconds taken
+        """
+        start = time.perf_counter()
+        self._names = None
+        self._prefixes = None
+        known = {refid: (mtime, size, digest) for refid, mtime, size, digest
+                 in self.conn.execute("SELECT refid, mtime, size, hash FROM compounds")}
+
+        current = {}
+        changed = []
+        touched = []
+        for refid, kind in iter_compounds(os.path.join(self.xml_dir, "index.xml")):
+            path = os.path.join(self.xml_dir, refid + ".xml")
+            if refid in current or not os.path.exists(path):
+                continue
+            stat = os.stat(path)
+            previous = known.get(refid)
+            if previous is not None and previous[:2] == (stat.st_mtime, stat.st_size):
+                current[refid] = (len(current), stat.st_mtime, stat.st_size, previous[2])
+                continue
+            digest = _file_hash(path)
+            current[refid] = (len(current), stat.st_mtime, stat.st_size, digest)
+            if previous is not None and previous[2] == digest:
+                touched.append(refid)
+            else:
+                changed.append(refid)
+        removed = set(known) - set(current)
+
+        parsed = parse_compounds([os.path.join(self.xml_dir, refid + ".xml") for refid in changed], workers, verbose)
+
+        with self.conn:
+            self.conn.executemany("DELETE FROM compounds WHERE refid = ?", [(refid,) for refid in removed | set(changed)])
+            self.conn.executemany(
+                "INSERT INTO compounds (refid, position, mtime, size, hash) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(refid) DO UPDATE SET position = excluded.position, mtime = excluded.mtime, "
+                "size = excluded.size, hash = excluded.hash",
+                [(refid,) + signature for refid, signature in current.items()]
+            )
+            for refid, functions in zip(changed, parsed):
+                log(verbose, f"Ingested {len(functions)} functions from {refid}")
+                self.conn.executemany(
+                    "INSERT INTO functions (name, compound, position, file, basename, line, prototype, doc) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(f["name"], refid, position, f["file"], os.path.basename(f["file"]), f["line"], f["prototype"], f["doc"])
+                     for position, f in enumerate(functions)]
+                )
+
+        return {
+            "compounds": len(current),
+            "changed": len(changed),
+            "removed": len(removed),
+            "touched": len(touched),
+            "seconds": time.perf_counter() - start,
+        }
+
+    def get(self, name):
+        """
+        Look up a function by its exact name.
+
+        Returns:
+            Dict with the name, file, line, prototype and doc, or None
+        """
+        row = self.conn.execute(
+            f"{SELECT_FUNCTIONS} WHERE f.name = ? ORDER BY {RESOLUTION_ORDER} LIMIT 1", (name,)
+        ).fetchone()
+        return _row_to_function(row) if row is not None else None
+
+    def by_prefix(self, prefix, limit=None):
+        """
+        Functions whose name starts with prefix (case-sensitive), sorted by name.
+
+        The prefix is turned into a name range, so the lookup is an index range scan.
+        """
+        if prefix:
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            rows = self.conn.execute(
+                f"{SELECT_FUNCTIONS} WHERE f.name >= ? AND f.name < ? ORDER BY f.name, {RESOLUTION_ORDER}", (prefix, upper)
+            )
+        else:
+            rows = self.conn.execute(f"{SELECT_FUNCTIONS} ORDER BY f.name, {RESOLUTION_ORDER}")
+        functions = _first_per_name(rows)
+        return functions[:limit] if limit is not None else functions
+
+    def by_file(self, path):
+        """
+        Functions defined in a source file, sorted by line.
+
+        Args:
+            path: Source path as reported by Doxygen, or any trailing part of it (e.g. "core/tcp.c")
+        """
+        path = path.replace("\\", "/")
+        rows = self.conn.execute(
+            f"{SELECT_FUNCTIONS} WHERE f.basename = ? ORDER BY f.name, {RESOLUTION_ORDER}", (os.path.basename(path),)
+        )
+        functions = [
+            function for function in _first_per_name(rows)
+            if function["file"] == path or function["file"].endswith("/" + path.lstrip("/"))
+        ]
+        return sorted(functions, key=lambda function: (function["file"], function["line"] or 0))
+
+    def by_module(self, module):
+        """
+        Functions of a module, sorted by file and line.
+
+        Args:
+            module: Source file (see by_file), or a module name without extension ("tcp" for tcp.c and tcp.h)
+        """
+        if os.path.splitext(module)[1]:
+            return self.by_file(module)
+        functions = self.by_file(module + ".c") + self.by_file(module + ".h")
+        return sorted(functions, key=lambda function: (function["file"], function["line"] or 0))
+
+    def names(self):
+        """All function names, sorted, read once per catalog update."""
+        if self._names is None:
+            self._names = [row[0] for row in self.conn.execute("SELECT DISTINCT name FROM functions ORDER BY name")]
+        return self._names
+
+    def prefixes(self):
+        """Lower-cased name prefixes before the first underscore ("tcp" for tcp_output), read once per catalog update."""
+        if self._prefixes is None:
+            self._prefixes = {name.split("_")[0].lower() for name in self.names() if "_" in name.strip("_")}
+            self._prefixes.discard("")
+        return self._prefixes
+
+    def fuzzy(self, query, limit=10):
+        """
+        Function names resembling query, best first.
+
+        Names containing the query (case-insensitive) come first, earliest and
+        shortest match first, then close matches by difflib similarity.
+        """
+        needle = query.lower()
+        contained = sorted(
+            (name for name in self.names() if needle in name.lower()),
+            key=lambda name: (name.lower().index(needle), len(name), name)
+        )
+        matches = contained[:limit]
+        if len(matches) < limit:
+            close = difflib.get_close_matches(query, self.names(), n=limit, cutoff=0.6)
+            matches += [name for name in close if name not in matches][:limit - len(matches)]
+        return matches
+
+    def as_dict(self):
+        """All functions in the format returned by parse_doxygen_functions."""
+        functions = {}
+        rows = self.conn.execute(f"{SELECT_FUNCTIONS} ORDER BY c.position, f.position")
+        for function in map(_row_to_function, rows):
+            functions[function.pop("name")] = function
+        return functions
+
+def open_catalog(xml_dir, db_path=DEFAULT_CATALOG_PATH, workers=None, verbose=False):
+    """Open the catalog of an XML directory and bring it up to date."""
+    catalog = FunctionCatalog(xml_dir, db_path)
+    stats = catalog.update(workers=workers, verbose=verbose)
+    log(verbose, f"Function catalog {db_path}: {stats}")
+    return catalog
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build or query the function catalog of a Doxygen XML output directory')
+    parser.add_argument('xml_dir', nargs='?', default="./xml", help='Doxygen XML output directory')
+    parser.add_argument('--db', default=DEFAULT_CATALOG_PATH, help='SQLite catalog file (default: FUNCTION_CATALOG or functions.db)')
+    parser.add_argument('--workers', type=int, help='Worker processes for parsing changed compounds (default: CPU count)')
+    parser.add_argument('--verbose', action='store_true', help='Log every re-parsed compound')
+    parser.add_argument('--name', help='Show the function with this name')
+    parser.add_argument('--prefix', help='List the functions starting with this prefix')
+    parser.add_argument('--file', help='List the functions defined in this source file')
+    args = parser.parse_args()
+
+    catalog = FunctionCatalog(args.xml_dir, args.db)
+    stats = catalog.update(workers=args.workers, verbose=args.verbose)
+    print(f"{len(catalog)} functions from {stats['compounds']} compounds: {stats['changed']} re-parsed, "
+          f"{stats['touched']} touched, {stats['removed']} removed in {stats['seconds']:.2f}s")
+
+    if args.name:
+        function = catalog.get(args.name)
+        if function is None:
+            print(f"No function named {args.name}")
+        else:
+            print(f"{function['prototype']}  ({function['file']}:{function['line']})")
+            if function["doc"]:
+                print(function["doc"])
+    for function in (catalog.by_prefix(args.prefix) if args.prefix else []) + (catalog.by_file(args.file) if args.file else []):
+        print(f"{function['file']}:{function['line']}: {function['prototype']}")
+    catalog.close()
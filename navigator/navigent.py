@@ -1,11 +1,38 @@
 import os
 import re
-from openai import OpenAI  # Assuming you have the OpenAI Python package
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# The text scanning engine is shared with the other tools, at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import text_scan
+from llm_replay import openai_client
+from function_catalog import DEFAULT_CATALOG_PATH, open_catalog
+from callgraph import DEFAULT_CALLGRAPH_CACHE, load_call_graph
+
+# Longest function definition shown in full, longer ones are cut
+MAX_DEFINITION_LINES = 150
+# Search results larger than this are summarized in chunks (map-reduce)
+SUMMARY_CHUNK_TOKENS = int(os.environ.get("SUMMARY_CHUNK_TOKENS", "8000"))
+# Chunks summarized concurrently
+SUMMARY_WORKERS = int(os.environ.get("SUMMARY_WORKERS", "8"))
+# Rough size of a token, used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+# First line of a search hit, the file it is in is the group key for chunking
+HIT_HEADER = re.compile(r"^(?:Found match in|Definition in): (.*)$|^Error reading (.*?): ", re.MULTILINE)
 
 # --- OpenAI Client Setup ---
 def create_openai_client():
-    """Creates an OpenAI client using environment variables."""
-    return OpenAI(
+    """Creates an OpenAI client using environment variables (LLM_REPLAY_MODE to record or replay)."""
+    if os.environ.get("LLM_REPLAY_MODE") == "replay":
+        return openai_client()
+    return openai_client(
         api_key=os.environ["API_KEY"],
         base_url=os.environ["BASE_URL"]
     )
@@ -22,51 +49,282 @@ class Tool:
 # --- Define the full-text search tool ---
 def full_text_search(query: str, directory: str) -> str:
     """Searches for a query string in all *.c and *.h files under the given directory."""
-    results = []
-    context_lines = 3  # Number of lines to show before and after the match
-    
-    # Skip build directories and other common directories to ignore
-    skip_dirs = {'build', 'build_esp32_default', '.git', 'cmake-build'}
-    
-    for root, dirs, files in os.walk(directory):
-        # Skip build directories
-        dirs[:] = [d for d in dirs if d not in skip_dirs]
-        
-        for file in files:
-            if file.endswith(".c") or file.endswith(".h"):
-                filepath = os.path.join(root, file)
-                # Skip files in build directories
-                if any(skip_dir in filepath for skip_dir in skip_dirs):
-                    continue
-                    
-                try:
-                    with open(filepath, "r", encoding="utf-8") as f:
-                        lines = f.readlines()
-                        for i, line in enumerate(lines):
-                            if query.lower() in line.lower():
-                                # Calculate start and end indices for context
-                                start_idx = max(0, i - context_lines)
-                                end_idx = min(len(lines), i + context_lines + 1)
-                                
-                                # Get the context lines
-                                context = lines[start_idx:end_idx]
-                                
-                                # Format the output with line numbers and highlight the match
-                                context_str = "".join([
-                                    f"{j+1:4d} | {line.rstrip()}\n"
-                                    for j, line in enumerate(context, start=start_idx)
-                                ])
-                                
-                                results.append(f"Found match in: {filepath}\n{context_str}")
-                except Exception as e:
-                    # Only report errors if the file actually exists
-                    if os.path.exists(filepath):
-                        results.append(f"Error reading {filepath}: {e}")
-    return "\n".join(results) if results else "No matches found."
+    return text_scan.full_text_search(query, directory)
 
 # Instantiate the search tool
 search_tool = Tool("search", full_text_search)
 
+# --- Chunking of search results for summarization ---
+def count_tokens(text: str) -> int:
+    """Counts the tokens of a text with the o200k_base encoding, or estimates them from its length."""
+    if tiktoken is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(tiktoken.get_encoding("o200k_base").encode(text, disallowed_special=()))
+
+def split_results(text: str):
+    """
+    Splits search results into hits.
+
+    Returns:
+        List of (file, hit text); text before the first hit header belongs to file ""
+    """
+    hits = []
+    starts = [m.start() for m in HIT_HEADER.finditer(text)]
+    if not starts or starts[0] > 0:
+        starts.insert(0, 0)
+    for start, end in zip(starts, starts[1:] + [len(text)]):
+        hit = text[start:end].strip("\n")
+        if hit:
+            m = HIT_HEADER.match(hit)
+            hits.append(((m.group(1) or m.group(2)) if m else "", hit))
+    return hits
+
+def _split_lines(text: str, max_tokens: int):
+    """Splits an oversized text at line boundaries into pieces of at most max_tokens (single lines excepted)."""
+    pieces, current, size = [], [], 0
+    for line in text.splitlines():
+        tokens = count_tokens(line) + 1
+        if current and size + tokens > max_tokens:
+            pieces.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += tokens
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+def pack(texts, max_tokens: int, min_items: int = 1):
+    """
+    Packs consecutive texts into groups of at most max_tokens.
+
+    A group takes at least min_items texts even if they exceed max_tokens,
+    so repeatedly packing a list always makes it shorter when min_items > 1.
+
+    Returns:
+        List of lists of texts
+    """
+    groups, current, size = [], [], 0
+    for text in texts:
+        tokens = count_tokens(text)
+        if len(current) >= min_items and size + tokens > max_tokens:
+            groups.append(current)
+            current, size = [], 0
+        current.append(text)
+        size += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+def chunk_results(text: str, max_tokens: int = SUMMARY_CHUNK_TOKENS):
+    """
+    Splits search results into chunks of at most max_tokens.
+
+    Hits are grouped by file, so that a chunk covers whole files where
+    possible; the files of a chunk stay in the order of the results. A file
+    with more hits than fit in a chunk is spread over several chunks, and a
+    single oversized hit is cut at line boundaries.
+
+    Returns:
+        List of chunk texts
+    """
+    files = {}
+    for file, hit in split_results(text):
+        if count_tokens(hit) > max_tokens:
+            files.setdefault(file, []).extend(_split_lines(hit, max_tokens))
+        else:
+            files.setdefault(file, []).append(hit)
+    chunks, current, size = [], [], 0
+    for hits in files.values():
+        file_text = "\n".join(hits)
+        tokens = count_tokens(file_text)
+        if tokens > max_tokens:
+            # One file too large for a chunk, pack its hits instead and continue from the last group
+            *full, current = pack(current + hits, max_tokens)
+            chunks.extend("\n".join(group) for group in full)
+            size = count_tokens("\n".join(current))
+            continue
+        if current and size + tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(file_text)
+        size += tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+# --- Define the symbol navigation tools ---
+def read_definition(path: str, line: int, max_lines: int = MAX_DEFINITION_LINES) -> str:
+    """
+    Reads the definition starting at a line: up to the brace that closes its body,
+    or up to the first ';' for a declaration without a body.
+    """
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        lines = f.readlines()
+    depth = 0
+    seen_body = False
+    end = min(len(lines), line - 1 + max_lines)
+    for i in range(line - 1, end):
+        depth += lines[i].count("{") - lines[i].count("}")
+        seen_body = seen_body or "{" in lines[i]
+        if (seen_body and depth <= 0) or (not seen_body and ";" in lines[i]):
+            end = i + 1
+            break
+    hit = text_scan.TextHit(path, line, line, [l.rstrip("\n") for l in lines[line - 1:end]], 0)
+    return hit.format("Definition in")
+
+class SymbolNavigator:
+    """
+    Precise lookups in the function catalog built from the Doxygen output.
+
+    Every tool returns a small, targeted context (a prototype list, one
+    definition, one module's documented API) instead of every line that
+    mentions a word.
+    """
+
+    def __init__(self, catalog, directory: str, graph=None):
+        """
+        Args:
+            catalog: FunctionCatalog of the Doxygen XML output of the source tree
+            directory: Root of the source tree, to resolve relative Doxygen paths
+            graph: Optional CallGraph of the same XML output, enables the caller/callee tools
+        """
+        self.catalog = catalog
+        self.directory = directory
+        self.graph = graph
+
+    def _source_path(self, file: str) -> str:
+        return file if os.path.isabs(file) else os.path.join(self.directory, file)
+
+    def _format(self, function, doc: bool = False) -> str:
+        text = f"{function['file']}:{function['line']}: {function['prototype']}"
+        if doc and function["doc"]:
+            text += "\n" + "\n".join("    " + line for line in function["doc"].splitlines())
+        return text
+
+    def find_function(self, name: str) -> str:
+        """Shows the prototype and documentation of a function by its exact name."""
+        function = self.catalog.get(name)
+        if function is None:
+            return f"No function named {name}."
+        return self._format(function, doc=True)
+
+    def find_prefix(self, prefix: str, limit: int = 50) -> str:
+        """Lists the functions whose name starts with a prefix."""
+        functions = self.catalog.by_prefix(prefix, limit=limit + 1)
+        if not functions:
+            return f"No functions starting with {prefix}."
+        lines = [self._format(function) for function in functions[:limit]]
+        if len(functions) > limit:
+            lines.append(f"... more functions start with {prefix}")
+        return "\n".join(lines)
+
+    def fuzzy_find(self, name: str, limit: int = 10) -> str:
+        """Lists the functions whose name resembles the given one."""
+        names = self.catalog.fuzzy(name, limit=limit)
+        if not names:
+            return f"No functions resembling {name}."
+        return "\n".join(self._format(self.catalog.get(match)) for match in names)
+
+    def show_definition(self, name: str) -> str:
+        """Shows the documentation and source code of a function."""
+        function = self.catalog.get(name)
+        if function is None:
+            return f"No function named {name}."
+        try:
+            definition = read_definition(self._source_path(function["file"]), function["line"])
+        except (OSError, TypeError) as e:
+            definition = f"Error reading {function['file']}: {e}"
+        return f"{function['doc']}\n\n{definition}" if function["doc"] else definition
+
+    def module_api(self, module: str) -> str:
+        """Lists the documented functions of a module (a source file, or a name like "tcp")."""
+        functions = [function for function in self.catalog.by_module(module) if function["doc"]]
+        if not functions:
+            return f"No documented functions in {module}."
+        return "\n\n".join(self._format(function, doc=True) for function in functions)
+
+    def _call_tree(self, name: str, direction: str, depth: int) -> str:
+        if self.graph is None:
+            return "No call graph loaded."
+        nodes = self.graph.nodes(name)
+        if not nodes:
+            return f"No function named {name}."
+        reached = self.graph.reachable(nodes, direction, max_depth=depth)
+        if not reached:
+            return f"No {direction} of {name} found."
+        lines = []
+        for node, distance in sorted(reached.items(), key=lambda item: (item[1], self.graph.names[item[0]])):
+            info = self.graph.node_info(node)
+            lines.append(f"{'  ' * (distance - 1)}{info['file']}:{info['line']}: {info['name']}")
+        return f"{direction.capitalize()} of {name}:\n" + "\n".join(lines)
+
+    def callers(self, name: str, depth: int = 1) -> str:
+        """Lists the functions calling a function, up to depth calls away."""
+        return self._call_tree(name, "callers", depth)
+
+    def callees(self, name: str, depth: int = 1) -> str:
+        """Lists the functions called by a function, up to depth calls away."""
+        return self._call_tree(name, "callees", depth)
+
+    def tools(self):
+        """The navigation tools, by name."""
+        tools = [
+            Tool("find_function", self.find_function),
+            Tool("find_prefix", self.find_prefix),
+            Tool("fuzzy_find", self.fuzzy_find),
+            Tool("show_definition", self.show_definition),
+            Tool("module_api", self.module_api),
+        ]
+        if self.graph is not None:
+            tools += [Tool("callers", self.callers), Tool("callees", self.callees)]
+        return {tool.name: tool for tool in tools}
+
+    def navigate(self, query: str):
+        """
+        Picks the navigation tool for a query.
+
+        Identifiers in the query are tried in order: a known function shows its
+        definition (or its callers/callees when the query asks who calls it or
+        what it calls), "name*" lists a prefix, a module shows its documented
+        API, otherwise the function names closest to an identifier-shaped token
+        are listed.
+
+        Returns:
+            The context found, or None if the catalog knows nothing about the query
+        """
+        identifiers = re.findall(r"[A-Za-z_]\w*\*?", query)
+        for identifier in identifiers:
+            if identifier.endswith("*"):
+                if self.catalog.by_prefix(identifier[:-1], limit=1):
+                    return self.find_prefix(identifier[:-1])
+            elif self.catalog.get(identifier) is not None:
+                if self.graph is not None:
+                    name = re.escape(identifier)
+                    if re.search(rf"\bcallers\b|\b(?:calls?|calling) (?:to )?{name}\b", query):
+                        return self.callers(identifier)
+                    if re.search(rf"\bcallees\b|\bcalled by {name}\b|\b{name} calls?\b|\b{name} call\b", query):
+                        return self.callees(identifier)
+                return self.show_definition(identifier)
+        for identifier in identifiers:
+            if self.catalog.by_module(identifier.rstrip("*")):
+                return self.module_api(identifier.rstrip("*"))
+        for identifier in identifiers:
+            if self._looks_like_symbol(identifier.rstrip("*")) and self.catalog.fuzzy(identifier.rstrip("*"), limit=1):
+                return self.fuzzy_find(identifier.rstrip("*"))
+        return None
+
+    def _looks_like_symbol(self, token: str) -> bool:
+        """
+        True for identifier-shaped tokens worth a fuzzy lookup: containing an
+        underscore or a digit, camel case, or a known module prefix ("pbuf",
+        "netif"), but not plain words of the question like "what" or "does".
+        """
+        if len(token) < 3:
+            return False
+        if "_" in token.strip("_") or any(c.isdigit() for c in token) or any(c.isupper() for c in token[1:]):
+            return True
+        return token.lower() in self.catalog.prefixes()
+
 # --- Base Agent class ---
 class Agent:
     def __init__(self, client, model):
@@ -75,34 +333,43 @@ class Agent:
 
 # --- Researcher Agent ---
 class Researcher(Agent):
-    def __init__(self, client, model, tool: Tool, directory: str):
+    def __init__(self, client, model, tool: Tool, directory: str, navigator: SymbolNavigator = None):
         super().__init__(client, model)
         self.tool = tool
         self.directory = directory
-    
+        self.navigator = navigator
+
     def research(self, query: str) -> str:
-        """Uses the search tool to perform research on the given query."""
+        """
+        Researches the given query with the symbol navigation tools, and falls
+        back to the search tool when the function catalog knows nothing about it.
+        """
+        if self.navigator is not None:
+            context = self.navigator.navigate(query)
+            if context is not None:
+                return context
         return self.tool(query, self.directory)
 
 # --- Summarizer Agent ---
 class Summarizer(Agent):
-    def summarize(self, text: str, query: str) -> str:
-        """Summarizes the given text using the OpenAI API."""
-        messages = [
-            {
-                "role": "system",
-                "content": ( 
-f"""
+    def __init__(self, client, model, chunk_tokens: int = SUMMARY_CHUNK_TOKENS, workers: int = SUMMARY_WORKERS):
+        super().__init__(client, model)
+        self.chunk_tokens = chunk_tokens
+        self.workers = workers
+
+    def _system_prompt(self, query: str) -> str:
+        return f"""
 You are an experienced SW architect, that gives a summary of the partial code search
 given this initial query:
 {query}
 """
-                )
-            },
-            {
-                "role": "user",
-                "content": f"Summarize the following text:\n\n{text}"
-            } ]
+
+    def _complete(self, query: str, content: str) -> str:
+        """Sends one summarization request and returns the answer."""
+        messages = [
+            {"role": "system", "content": self._system_prompt(query)},
+            {"role": "user", "content": content}
+        ]
         response = self.client.chat.completions.create(
             model=self.model,
             messages=messages,
@@ -110,9 +377,57 @@ given this initial query:
         )
         return response.choices[0].message.content
 
+    def summarize(self, text: str, query: str) -> str:
+        """
+        Summarizes the given text using the OpenAI API.
+
+        Text that does not fit in one chunk of chunk_tokens is summarized
+        map-reduce style: the chunks (see chunk_results) are summarized
+        concurrently, then the partial summaries are combined level by level
+        until one remains. Latency grows with the chunk size and the log of
+        the number of chunks instead of the size of the text.
+        """
+        chunks = chunk_results(text, self.chunk_tokens)
+        if len(chunks) <= 1:
+            return self._complete(query, f"Summarize the following text:\n\n{text}")
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            summaries = list(executor.map(
+                lambda chunk: self._complete(
+                    query, f"Summarize the following part of the search results, keep file names and line numbers of the relevant code:\n\n{chunk}"
+                ),
+                chunks
+            ))
+            while len(summaries) > 1:
+                groups = pack(summaries, self.chunk_tokens, min_items=2)
+                summaries = list(executor.map(
+                    lambda group: group[0] if len(group) == 1 else self._complete(
+                        query, "Combine the following summaries of parts of the search results into one summary:\n\n"
+                        + "\n\n---\n\n".join(group)
+                    ),
+                    groups
+                ))
+        return summaries[0]
+
 if __name__ == "__main__":
-    directory = "/home/david/esp/idf/components/lwip"  # start with lwip
-    query = "congestion"
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Research a source tree and summarize the results')
+    parser.add_argument('query', nargs='?', default="congestion", help='Function, module or text to research')
+    parser.add_argument('--directory', default="/home/david/esp/idf/components/lwip",  # start with lwip
+                        help='Source tree to research')
+    parser.add_argument('--xml-dir', help='Doxygen XML output of the source tree, enables the symbol navigation tools')
+    parser.add_argument('--db', default=DEFAULT_CATALOG_PATH, help='Function catalog file (default: FUNCTION_CATALOG or functions.db)')
+    parser.add_argument('--callgraph', default=DEFAULT_CALLGRAPH_CACHE,
+                        help='Call graph cache file, empty to disable the caller/callee tools (default: CALLGRAPH_CACHE or callgraph.pickle)')
+    args = parser.parse_args()
+    directory = args.directory
+    query = args.query
+
+    navigator = None
+    if args.xml_dir:
+        graph = load_call_graph(args.xml_dir, args.callgraph) if args.callgraph else None
+        navigator = SymbolNavigator(open_catalog(args.xml_dir, args.db), directory, graph)
 
     # Create separate OpenAI clients
     researcher_client = create_openai_client()
@@ -122,7 +437,7 @@ if __name__ == "__main__":
     summarizer_model = os.environ["MODEL"]
 
     # Instantiate the agents
-    researcher = Researcher(researcher_client, researcher_model, search_tool, directory)
+    researcher = Researcher(researcher_client, researcher_model, search_tool, directory, navigator)
     summarizer = Summarizer(summarizer_client, summarizer_model)
 
     # Perform research
@@ -0,0 +1,421 @@
+"""
+Persistent FAISS index of the lwip sources for the RAG agent in test_lwip_rag.py.
+"""
+import os
+import hashlib
+import json
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from tqdm import tqdm
+from transformers import AutoTokenizer
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.vectorstores import FAISS
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_community.vectorstores.utils import DistanceStrategy, maximal_marginal_relevance
+import numpy as np
+from c_chunker import split_c_code
+
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:
+    CrossEncoder = None
+
+# Replace with the path to your text files directory
+SOURCE_DIRECTORY = os.environ.get("RAG_SOURCE_DIRECTORY", "/home/david/esp/idf/components/lwip/lwip/src/core")
+SAVE_DIRECTORY = os.environ.get("RAG_INDEX_DIRECTORY", "db")
+EMBEDDING_MODEL_NAME = "thenlper/gte-small"
+# Processes splitting the source files, and chunks embedded per batch
+SPLIT_WORKERS = int(os.environ.get("RAG_SPLIT_WORKERS", str(os.cpu_count() or 1)))
+EMBED_BATCH_SIZE = int(os.environ.get("RAG_EMBED_BATCH_SIZE", "64"))
+
+# Retrieval cascade: FETCH_K nearest chunks, diversified by MMR (lambda 1 is pure relevance) to TOP_K,
+# or to CANDIDATES_K that the cross-encoder reranks to TOP_K when RERANKER_MODEL is set
+FETCH_K = int(os.environ.get("RAG_FETCH_K", "40"))
+CANDIDATES_K = int(os.environ.get("RAG_CANDIDATES_K", "12"))
+TOP_K = int(os.environ.get("RAG_TOP_K", "5"))
+MMR_LAMBDA = float(os.environ.get("RAG_MMR_LAMBDA", "0.6"))
+RERANKER_MODEL = os.environ.get("RAG_RERANKER_MODEL", "")  # e.g. cross-encoder/ms-marco-MiniLM-L-6-v2
+# Query embeddings and rerank scores kept per retriever
+CACHE_SIZE = 4096
+
+# Everything that changes the chunks or their vectors, the index is rebuilt when it changes.
+# "functions" cuts at function boundaries (c_chunker.py), "recursive" is the prose splitter used before.
+SPLITTER_CONFIG = {
+    "version": 4,
+    "embedding_model": EMBEDDING_MODEL_NAME,
+    "splitter": "functions",
+    "chunk_size": 400,
+}
+RECURSIVE_SPLITTER_CONFIG = {
+    "version": 4,
+    "embedding_model": EMBEDDING_MODEL_NAME,
+    "splitter": "recursive",
+    "chunk_size": 200,
+    "chunk_overlap": 20,
+    "separators": ["\n\n", "\n", ".", " ", ""],
+}
+
+# Function to load all c files from lwip directory into Document objects
+def load_text_files(directory_path, file_names=None):
+    file_paths = glob(os.path.join(directory_path, '*.c'))
+    documents = []
+    for file_path in file_paths:
+        if file_names is not None and os.path.basename(file_path) not in file_names:
+            continue
+        with open(file_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        # Use the filename as the source metadata
+        doc = Document(page_content=text, metadata={"source": os.path.basename(file_path), "path": file_path})
+        documents.append(doc)
+    return documents
+
+# Function to create the splitter of a config, returning a function from a Document to its chunk Documents
+def make_splitter(config):
+    tokenizer = AutoTokenizer.from_pretrained(config["embedding_model"])
+    if config["splitter"] == "recursive":
+        text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+            tokenizer,
+            chunk_size=config["chunk_size"],
+            chunk_overlap=config["chunk_overlap"],
+            add_start_index=True,
+            strip_whitespace=True,
+            separators=config["separators"],
+        )
+        return lambda doc: text_splitter.split_documents([doc])
+
+    def count_tokens(text):
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
+    def split(doc):
+        return [
+            Document(
+                page_content=chunk["text"],
+                metadata=dict(doc.metadata, start_line=chunk["start"], end_line=chunk["end"], function=chunk["name"]),
+            )
+            for chunk in split_c_code(doc.page_content, doc.metadata.get("path"), config["chunk_size"], count_tokens)
+            if chunk["text"].strip()
+        ]
+    return split
+
+# Function to hash a chunk text to a 64-bit id (16 hex digits)
+def chunk_id(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+# Metadata of a chunk that locates it in the sources, one entry of the "locations" of its stored document
+LOCATION_KEYS = ("source", "start_line", "end_line", "start_index", "function")
+
+# Function to pick the location of a chunk out of its metadata
+def chunk_location(metadata):
+    return {key: metadata[key] for key in LOCATION_KEYS if key in metadata}
+
+# Splitter of each worker process, created on first use
+_worker_splitters = {}
+
+# Function to split one source file in a worker, returning (chunk id, text, metadata) tuples
+def split_file(file_path, config):
+    key = json.dumps(config, sort_keys=True)
+    if key not in _worker_splitters:
+        _worker_splitters[key] = make_splitter(config)
+    with open(file_path, 'r', encoding='utf-8') as f:
+        doc = Document(page_content=f.read(), metadata={"source": os.path.basename(file_path), "path": file_path})
+    return [(chunk_id(new_doc.page_content), new_doc.page_content, new_doc.metadata)
+            for new_doc in _worker_splitters[key](doc)]
+
+# Function to split files on a process pool, yielding (file path, chunks) in order with a bounded number in flight
+def split_files(file_paths, config, workers=SPLIT_WORKERS):
+    if workers <= 1 or len(file_paths) <= 1:
+        for file_path in file_paths:
+            yield file_path, split_file(file_path, config)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for file_path in file_paths:
+            pending.append((file_path, executor.submit(split_file, file_path, config)))
+            if len(pending) >= 2 * workers:
+                file_path, future = pending.popleft()
+                yield file_path, future.result()
+        while pending:
+            file_path, future = pending.popleft()
+            yield file_path, future.result()
+
+# Function to fingerprint a file by its content
+def file_fingerprint(file_path):
+    with open(file_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+# Function to fingerprint the splitter and embedding configuration
+def config_fingerprint(config=SPLITTER_CONFIG):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+class RagIndex:
+    """
+    FAISS store of the chunks of a source directory, persisted with a manifest.
+
+    The manifest (manifest.json next to the FAISS files) records the config
+    fingerprint and, for every source file, its mtime, size, content hash and
+    its chunks as [id, location] pairs. A chunk id is the 64-bit hash of the
+    chunk text, so identical text is stored and embedded once; the metadata of
+    its document holds the first location at the top level and all of them in
+    "locations", rewritten from the manifest whenever one of its files changes.
+    On start-up only new, changed and removed files are split, and only text
+    not already in the store is embedded: a function moved down by an edit
+    above it keeps its vector. When nothing changed the saved store is loaded
+    as is.
+    """
+
+    def __init__(self, source_directory, save_directory, config=SPLITTER_CONFIG):
+        self.source_directory = source_directory
+        self.save_directory = save_directory
+        self.config = config
+        self.manifest_path = os.path.join(save_directory, "manifest.json")
+        self.embedding_model = HuggingFaceEmbeddings(model_name=config["embedding_model"])
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("config") != config_fingerprint(self.config):
+            print("Splitter or embedding config changed, rebuilding the index")
+            return None
+        return manifest
+
+    def _save(self, vectordb, files):
+        os.makedirs(self.save_directory, exist_ok=True)
+        vectordb.save_local(self.save_directory)
+        with open(self.manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({"config": config_fingerprint(self.config), "files": files}, f)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
+    def _scan(self, previous_files):
+        """Current state of the source files, hashing only those whose mtime or size changed."""
+        files = {}
+        for file_path in glob(os.path.join(self.source_directory, '*.c')):
+            name = os.path.basename(file_path)
+            stat = os.stat(file_path)
+            previous = previous_files.get(name)
+            if previous and previous["mtime"] == stat.st_mtime and previous["size"] == stat.st_size:
+                files[name] = previous
+            else:
+                files[name] = {"mtime": stat.st_mtime, "size": stat.st_size, "hash": file_fingerprint(file_path), "chunks": None}
+                if previous and previous["hash"] == files[name]["hash"]:
+                    files[name]["chunks"] = previous["chunks"]
+        return files
+
+    def _add_batch(self, vectordb, batch):
+        """Embed a batch of (chunk id, text, metadata) and add it to the store, creating the store if needed."""
+        ids, texts, metadatas = zip(*batch)
+        vectors = self.embedding_model.embed_documents(list(texts))
+        if vectordb is None:
+            return FAISS.from_embeddings(
+                list(zip(texts, vectors)),
+                self.embedding_model,
+                metadatas=list(metadatas),
+                ids=list(ids),
+                distance_strategy=DistanceStrategy.COSINE,
+            )
+        vectordb.add_embeddings(list(zip(texts, vectors)), metadatas=list(metadatas), ids=list(ids))
+        return vectordb
+
+    def _update_locations(self, vectordb, files, doc_ids):
+        """Rewrite the locations in the metadata of the stored chunks doc_ids from the manifest files."""
+        locations = {doc_id: [] for doc_id in doc_ids}
+        for name in sorted(files):
+            for doc_id, location in files[name]["chunks"]:
+                if doc_id in locations:
+                    locations[doc_id].append(location)
+        for doc_id, chunk_locations in locations.items():
+            doc = vectordb.docstore.search(doc_id)
+            first = chunk_locations[0]
+            doc.metadata = dict(first, path=os.path.join(self.source_directory, first["source"]),
+                                locations=chunk_locations)
+
+    def load(self):
+        """
+        Load the index, updating it for the files that changed since it was saved.
+
+        Returns:
+            The FAISS vector store
+        """
+        start = time.perf_counter()
+        manifest = self._load_manifest()
+        previous_files = manifest["files"] if manifest else {}
+        files = self._scan(previous_files)
+
+        vectordb = None
+        if manifest is not None and os.path.exists(os.path.join(self.save_directory, "index.faiss")):
+            vectordb = FAISS.load_local(
+                self.save_directory,
+                self.embedding_model,
+                allow_dangerous_deserialization=True,  # our own index, written by _save
+                distance_strategy=DistanceStrategy.COSINE,
+            )
+        else:
+            previous_files = {}
+            for entry in files.values():
+                entry["chunks"] = None
+
+        stale = [name for name, entry in files.items() if entry["chunks"] is None]
+        removed = [name for name in previous_files if name not in files]
+        if not stale and not removed and vectordb is not None:
+            print(f"Vector store loaded in {time.perf_counter() - start:.1f}s, no source changes")
+            return vectordb
+
+        # Split the changed documents on the process pool and stream their new chunks into batched embedding.
+        # Chunks whose text is already in the store or seen earlier in this run are skipped by their 64-bit id,
+        # so only the ids and one batch of texts are held in memory.
+        print(f"Splitting and embedding {len(stale)} changed documents ({len(removed)} removed)...")
+        old_ids = {doc_id for entry in previous_files.values() for doc_id, _ in entry["chunks"] or []}
+        # Chunks that were in a changed or removed file, their locations change even when their text did not
+        moved = {doc_id for name in stale + removed for doc_id, _ in (previous_files.get(name) or {}).get("chunks") or []}
+        seen = set(old_ids)
+        batch = []
+        added = 0
+        stale_paths = [os.path.join(self.source_directory, name) for name in stale]
+        for file_path, chunks in tqdm(split_files(stale_paths, self.config), total=len(stale_paths)):
+            files[os.path.basename(file_path)]["chunks"] = [[doc_id, chunk_location(metadata)] for doc_id, _, metadata in chunks]
+            for chunk in chunks:
+                moved.add(chunk[0])
+                if chunk[0] in seen:
+                    continue
+                seen.add(chunk[0])
+                batch.append(chunk)
+                if len(batch) >= EMBED_BATCH_SIZE:
+                    vectordb = self._add_batch(vectordb, batch)
+                    added += len(batch)
+                    batch = []
+        if batch:
+            vectordb = self._add_batch(vectordb, batch)
+            added += len(batch)
+
+        new_ids = {doc_id for entry in files.values() for doc_id, _ in entry["chunks"]}
+        deleted = list(old_ids - new_ids)
+        if vectordb is not None and deleted:
+            vectordb.delete(deleted)
+        if vectordb is None:
+            raise RuntimeError(f"No C sources found in {self.source_directory}")
+        self._update_locations(vectordb, files, moved & new_ids)
+
+        self._save(vectordb, files)
+        print(f"Vector store updated and saved to {self.save_directory} in {time.perf_counter() - start:.1f}s "
+              f"({added} chunks added, {len(deleted)} removed)")
+        return vectordb
+
+class LRUCache(OrderedDict):
+    """Dict that drops its least recently used entries beyond maxsize."""
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+
+    def put(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+class Retriever:
+    """
+    Two-stage retrieval over the FAISS store.
+
+    A wide candidate set (fetch_k) is taken from the FAISS index and diversified
+    with maximal marginal relevance, so near-duplicate chunks do not crowd
+    out the rest. With a cross-encoder configured, the MMR candidates are
+    reranked by it and cut to k. Query embeddings and rerank scores are
+    cached, so the repeated queries of an agent cost no encoder calls.
+    """
+
+    def __init__(self, vectordb, embedding_model, k=TOP_K, fetch_k=FETCH_K, candidates_k=CANDIDATES_K,
+                 lambda_mult=MMR_LAMBDA, reranker_model=RERANKER_MODEL):
+        self.vectordb = vectordb
+        self.embedding_model = embedding_model
+        self.k = k
+        self.fetch_k = fetch_k
+        self.candidates_k = candidates_k
+        self.lambda_mult = lambda_mult
+        self.reranker = None
+        if reranker_model:
+            if CrossEncoder is None:
+                print(f"sentence-transformers is not installed, not reranking with {reranker_model}")
+            else:
+                self.reranker = CrossEncoder(reranker_model)
+        self.query_cache = LRUCache()
+        self.score_cache = LRUCache()
+
+    def embed_queries(self, queries):
+        """Embeddings of the queries, the uncached ones computed in one encoder call."""
+        missing = list(dict.fromkeys(query for query in queries if query not in self.query_cache))
+        if missing:
+            for query, vector in zip(missing, self.embedding_model.embed_documents(missing)):
+                self.query_cache.put(query, vector)
+        return [self.query_cache.get(query) for query in queries]
+
+    def rerank(self, queries, results):
+        """
+        Sort the documents of every query by cross-encoder score.
+
+        The (query, chunk) pairs not scored before are all scored in one call.
+        """
+        keys = [[(query, chunk_id(doc.page_content)) for doc in docs] for query, docs in zip(queries, results)]
+        missing = {}
+        for query_keys, docs in zip(keys, results):
+            for key, doc in zip(query_keys, docs):
+                if key not in self.score_cache:
+                    missing[key] = doc
+        if missing:
+            scores = self.reranker.predict([(query, doc.page_content) for (query, _), doc in missing.items()])
+            for key, score in zip(missing, scores):
+                self.score_cache.put(key, float(score))
+        return [
+            [doc for _, doc in sorted(zip([self.score_cache.get(key) for key in query_keys], docs), key=lambda pair: -pair[0])]
+            for query_keys, docs in zip(keys, results)
+        ]
+
+    def search_many(self, queries):
+        """
+        Retrieve the chunks for several queries at once.
+
+        The queries are embedded in one encoder call and looked up in one
+        FAISS search; MMR then runs per query on its candidates, and the
+        reranker scores all queries in one call.
+
+        Returns:
+            For each query, up to k Documents, best first
+        """
+        if not queries:
+            return []
+        vectors = np.asarray(self.embed_queries(queries), dtype=np.float32)
+        _, indices = self.vectordb.index.search(vectors, self.fetch_k)
+        keep = self.candidates_k if self.reranker is not None else self.k
+
+        results = []
+        for vector, row in zip(vectors, indices):
+            row = [int(i) for i in row if i != -1]
+            if not row:
+                results.append([])
+                continue
+            candidates = np.vstack([self.vectordb.index.reconstruct(i) for i in row])
+            picked = maximal_marginal_relevance(vector, candidates, k=min(keep, len(row)), lambda_mult=self.lambda_mult)
+            results.append([self.vectordb.docstore.search(self.vectordb.index_to_docstore_id[row[j]]) for j in picked])
+
+        if self.reranker is not None:
+            results = self.rerank(queries, results)
+        return [docs[:self.k] for docs in results]
+
+    def search(self, query):
+        """
+        Retrieve the chunks for a query.
+
+        Returns:
+            Up to k Documents, best first
+        """
+        return self.search_many([query])[0]
@@ -1,70 +1,9 @@
 # pip install pandas langchain langchain-community sentence-transformers faiss-cpu smolagents --upgrade
 #
-import os
-from glob import glob
-from tqdm import tqdm
-from transformers import AutoTokenizer
-from langchain.docstore.document import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores.utils import DistanceStrategy
-
-# Function to load all c files from lwip directory into Document objects
-def load_text_files(directory_path):
-    file_paths = glob(os.path.join(directory_path, '*.c'))
-    documents = []
-    for file_path in file_paths:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
-        # Use the filename as the source metadata
-        doc = Document(page_content=text, metadata={"source": os.path.basename(file_path)})
-        documents.append(doc)
-    return documents
-
-# Load the db
-# embedding_model = HuggingFaceEmbeddings(model_name="thenlper/gte-small")
-# vectordb = FAISS.load_local(save_directory, embedding_model)
-# print("Vector store loaded successfully!")
-
-# Replace with the path to your text files directory
-source_docs = load_text_files("/home/david/esp/idf/components/lwip/lwip/src/core")
-
-# Initialize a HuggingFace tokenizer and a text splitter that uses it
-tokenizer = AutoTokenizer.from_pretrained("thenlper/gte-small")
-text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
-    tokenizer,
-    chunk_size=200,
-    chunk_overlap=20,
-    add_start_index=True,
-    strip_whitespace=True,
-    separators=["\n\n", "\n", ".", " ", ""],
-)
-
-# Split the loaded documents into chunks while filtering out duplicates
-print("Splitting documents...")
-docs_processed = []
-unique_texts = {}
-for doc in tqdm(source_docs):
-    new_docs = text_splitter.split_documents([doc])
-    for new_doc in new_docs:
-        if new_doc.page_content not in unique_texts:
-            unique_texts[new_doc.page_content] = True
-            docs_processed.append(new_doc)
-
-# Build the vector store using FAISS with cosine similarity
-print("Embedding documents... This may take several minutes.")
-embedding_model = HuggingFaceEmbeddings(model_name="thenlper/gte-small")
-vectordb = FAISS.from_documents(
-    documents=docs_processed,
-    embedding=embedding_model,
-    distance_strategy=DistanceStrategy.COSINE,
-)
+from rag_index import RagIndex, Retriever, SOURCE_DIRECTORY, SAVE_DIRECTORY
 
-print("Vector store created successfully!")
-save_directory = "db"
-vectordb.save_local(save_directory)
-print("Vector store saved to", save_directory)
+rag_index = RagIndex(SOURCE_DIRECTORY, SAVE_DIRECTORY)
+vectordb = rag_index.load()
 
 from smolagents import Tool
 from langchain_core.vectorstores import VectorStore
@@ -73,30 +12,58 @@ from langchain_core.vectorstores import VectorStore
 class RetrieverTool(Tool):
     name = "retriever"
     # description = "Using semantic similarity, retrieves some documents from the knowledge base that have the closest embeddings to the input query."
-    description = "Using semantic similarity, retrieves lwip core sources from the codebase that have the closest embeddings to the input query."
+    description = "Using semantic similarity, retrieves lwip core sources from the codebase that have the closest embeddings to the input queries. Pass all the concepts you want to look up at once."
     inputs = {
-        "query": {
-            "type": "string",
-            "description": "The query to perform. This should be semantically close to your target documents. Use the affirmative form rather than a question.",
+        "queries": {
+            "type": "array",
+            "description": "The queries to perform, a list of strings (a single string is accepted too). Each should be semantically close to your target documents. Use the affirmative form rather than a question.",
         }
     }
     output_type = "string"
 
-    def __init__(self, vectordb: VectorStore, **kwargs):
+    def __init__(self, vectordb: VectorStore, embedding_model, **kwargs):
         super().__init__(**kwargs)
         self.vectordb = vectordb
-
-    def forward(self, query: str) -> str:
-        assert isinstance(query, str), "Your search query must be a string"
-
-        docs = self.vectordb.similarity_search(
-            query,
-            k=7,
-        )
-
-        return "\nRetrieved documents:\n" + "".join(
-            [f"===== Document {str(i)} =====\n" + doc.page_content for i, doc in enumerate(docs)]
-        )
+        # Wide FAISS candidate set, MMR and the optional cross-encoder (see rag_index.Retriever)
+        self.retriever = Retriever(vectordb, embedding_model)
+
+    def forward(self, queries: list) -> str:
+        if isinstance(queries, str):
+            queries = [queries]
+        assert all(isinstance(query, str) for query in queries), "Your search queries must be strings"
+
+        # All queries are embedded and searched together; a document found for several
+        # queries is shown once and referenced by its number afterwards
+        output = "\nRetrieved documents:\n"
+        numbers = {}
+        for query, docs in zip(queries, self.retriever.search_many(queries)):
+            output += f"##### Query: {query}\n"
+            for doc in docs:
+                key = (self._location(doc), doc.page_content)
+                if key in numbers:
+                    output += f"(Document {numbers[key]} also matches)\n"
+                    continue
+                numbers[key] = len(numbers)
+                output += f"===== Document {numbers[key]}: {self._location(doc)} =====\n" + doc.page_content + "\n"
+        return output
+
+    @staticmethod
+    def _location(doc) -> str:
+        location = RetrieverTool._format_location(doc.metadata)
+        # Identical text in other places is stored once, rag_index lists all its locations
+        others = [RetrieverTool._format_location(other) for other in doc.metadata.get("locations", [])[1:]]
+        if others:
+            location += ", also in " + ", ".join(others)
+        return location
+
+    @staticmethod
+    def _format_location(metadata) -> str:
+        location = metadata.get("source", "")
+        if "start_line" in metadata:
+            location += f":{metadata['start_line']}-{metadata['end_line']}"
+        if metadata.get("function"):
+            location += f" ({metadata['function']})"
+        return location
 
 from smolagents import CodeAgent, DuckDuckGoSearchTool, VisitWebpageTool, OpenAIServerModel
 from smolagents import LiteLLMModel, ToolCallingAgent
@@ -113,7 +80,7 @@ model = LiteLLMModel(
     api_key=os.environ["API_KEY"]
 )
 
-retriever_tool = RetrieverTool(vectordb)
+retriever_tool = RetrieverTool(vectordb, rag_index.embedding_model)
 # agent = ToolCallingAgent(tools=[retriever_tool], model=model, verbose=True)
 agent = CodeAgent(
     tools=[retriever_tool], model=model, max_steps=4, verbosity_level=2
@@ -0,0 +1,265 @@
+"""
+Shared full-text scanning engine for the search tools.
+
+Files are memory-mapped and searched in place as raw bytes with
+case-insensitive patterns, so no file is copied, decoded or lower-cased in
+Python. Line numbers are only computed for hits, by counting newlines
+between consecutive hits. Files are scanned on a thread pool shared by all
+searches and hits are yielded as a generator in directory walk order.
+"""
+import mmap
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+SOURCE_EXTENSIONS = (".c", ".h")
+SKIP_DIRS = {'build', 'build_esp32_default', '.git', 'cmake-build'}
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+# Smaller files are read in one call, mapping them costs more than it saves
+MMAP_THRESHOLD = 256 * 1024
+# Files handed to a worker at a time, to keep the executor overhead low
+FILES_PER_TASK = 64
+
+# A pattern is either a literal without letters or a compiled bytes regex, see literal_pattern()
+Pattern = Union[bytes, "re.Pattern"]
+
+# Thread pool of the scans with DEFAULT_WORKERS, created on first use
+_executor = None
+_executor_lock = threading.Lock()
+
+class TextHit(NamedTuple):
+    path: str
+    line: int            # 1-based line of the match
+    start_line: int      # 1-based line of the first context line
+    lines: List[str]     # context lines, without line endings
+    pattern: int         # index of the pattern that matched
+    error: Optional[str] = None
+
+    def format(self, header: str = "Found match in") -> str:
+        """Format the hit the way the search tools always have."""
+        if self.error:
+            return f"Error reading {self.path}: {self.error}"
+        context_str = "".join(
+            f"{j:4d} | {line.rstrip()}\n" for j, line in enumerate(self.lines, start=self.start_line)
+        )
+        return f"{header}: {self.path}\n{context_str}"
+
+def literal_pattern(query: str) -> Pattern:
+    """
+    Pattern that matches the query literally and case-insensitively.
+
+    A query without letters stays a bytes literal, searched with find. Other
+    queries become an IGNORECASE bytes regex, which searches a memory-mapped
+    file in place. IGNORECASE only folds ASCII in bytes patterns, so every
+    non-ASCII letter is matched as an alternation of its UTF-8 case variants.
+    """
+    if query.lower() == query.upper():
+        return query.encode("utf-8")
+    parts = []
+    for char in query:
+        variants = {char, char.lower(), char.upper()}
+        if char.isascii() or len(variants) == 1:
+            parts.append(re.escape(char.encode("utf-8")))
+        else:
+            parts.append(b"(?:" + b"|".join(re.escape(v.encode("utf-8")) for v in sorted(variants)) + b")")
+    return re.compile(b"".join(parts), re.IGNORECASE)
+
+def iter_source_files(directory: str, extensions: Sequence[str] = SOURCE_EXTENSIONS,
+                      skip_dirs=SKIP_DIRS) -> Iterator[str]:
+    """Yield source files under a directory, skipping build directories."""
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if d not in skip_dirs]
+        for file in files:
+            if file.endswith(tuple(extensions)):
+                filepath = os.path.join(root, file)
+                if any(skip_dir in filepath for skip_dir in skip_dirs):
+                    continue
+                yield filepath
+
+def scan_file(filepath: str, patterns: Sequence[Pattern], context_lines: int = 3) -> List[TextHit]:
+    """
+    Find all lines of a file that match any of the patterns.
+
+    Each line is reported at most once per pattern. Hits are ordered by
+    pattern, then by position.
+
+    Args:
+        filepath: File to scan
+        patterns: Patterns from literal_pattern() or compiled bytes regexes
+        context_lines: Number of lines to include before and after each hit
+
+    Returns:
+        List of hits (a single hit with `error` set if the file can't be read)
+    """
+    return _scan_file(filepath, patterns, context_lines)[1]
+
+def _scan_file(filepath: str, patterns: Sequence[Pattern], context_lines: int = 3) -> Tuple[int, List[TextHit]]:
+    try:
+        with open(filepath, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return 0, []
+            if size < MMAP_THRESHOLD:
+                return size, _scan_buffer(filepath, f.read(), size, patterns, context_lines)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return size, _scan_buffer(filepath, data, size, patterns, context_lines)
+    except (OSError, ValueError) as e:
+        # Only report errors if the file actually exists
+        if os.path.exists(filepath):
+            return 0, [TextHit(filepath, 0, 0, [], -1, str(e))]
+        return 0, []
+
+def _literal_positions(haystack, needle: bytes, size: int) -> Iterator[int]:
+    """Positions of the first occurrence of needle on every line that contains it."""
+    pos = haystack.find(needle)
+    while pos >= 0:
+        yield pos
+        # One hit per line, continue on the next line
+        line_end = haystack.find(b"\n", pos + max(1, len(needle)) - 1)
+        if line_end < 0:
+            return
+        pos = haystack.find(needle, line_end + 1)
+
+def _scan_files(filepaths: List[str], patterns: Sequence[Pattern], context_lines: int) -> List[Tuple[int, List[TextHit]]]:
+    return [_scan_file(filepath, patterns, context_lines) for filepath in filepaths]
+
+def _regex_positions(data, pattern: "re.Pattern", size: int) -> Iterator[int]:
+    """Positions of the first match of pattern on every line that contains one."""
+    pos = 0
+    while pos < size:
+        match = pattern.search(data, pos)
+        if match is None:
+            return
+        yield match.start()
+        # One hit per line, continue on the next line
+        line_end = data.find(b"\n", max(match.start(), match.end() - 1))
+        if line_end < 0:
+            return
+        pos = line_end + 1
+
+def _scan_buffer(filepath, data, size, patterns, context_lines) -> List[TextHit]:
+    hits = []
+    for index, pattern in enumerate(patterns):
+        if isinstance(pattern, bytes):
+            positions = _literal_positions(data, pattern, size)
+        else:
+            positions = _regex_positions(data, pattern, size)
+
+        # Line numbers are counted incrementally between hits, in C
+        last_pos, last_line, reported = 0, 0, -1
+        for pos in positions:
+            if isinstance(data, bytes):
+                newlines = data.count(b"\n", last_pos, pos)
+            else:
+                # mmap has no count(), copy just the span since the last hit
+                newlines = data[last_pos:pos].count(b"\n")
+            line = last_line + newlines  # 0-based
+            last_pos, last_line = pos, line
+            if line == reported:
+                continue
+            reported = line
+
+            # Walk back and forward over the context lines
+            begin = data.rfind(b"\n", 0, pos) + 1
+            first = line
+            while first > line - context_lines and begin > 0:
+                begin = data.rfind(b"\n", 0, begin - 1) + 1
+                first -= 1
+            end = pos
+            for _ in range(context_lines + 1):
+                newline = data.find(b"\n", end)
+                if newline < 0 or newline + 1 >= size:
+                    end = size
+                    break
+                end = newline + 1
+
+            segment = data[begin:end]
+            if segment.endswith(b"\n"):
+                segment = segment[:-1]
+            lines = segment.decode("utf-8", errors="replace").split("\n")
+            hits.append(TextHit(filepath, line + 1, first + 1, lines, index))
+    return hits
+
+def scan_directory(directory: str, patterns: Sequence[Pattern], context_lines: int = 3,
+                   workers: int = DEFAULT_WORKERS,
+                   extensions: Sequence[str] = SOURCE_EXTENSIONS,
+                   on_file: Optional[Callable[[str, int], None]] = None) -> Iterator[TextHit]:
+    """
+    Scan all source files under a directory on a thread pool.
+
+    Hits are yielded lazily in directory walk order; closing the generator
+    early (e.g. once enough results were collected) cancels pending files.
+
+    Args:
+        directory: Root directory to scan
+        patterns: Patterns from literal_pattern() or compiled bytes regexes
+        context_lines: Number of lines to include before and after each hit
+        workers: Number of scanning threads (DEFAULT_WORKERS uses the shared pool)
+        extensions: File extensions to scan
+        on_file: Called with (path, size in bytes) for every scanned file, in the caller's thread
+
+    Yields:
+        TextHit for every matching line
+    """
+    files = list(iter_source_files(directory, extensions))
+    batches = [files[i:i + FILES_PER_TASK] for i in range(0, len(files), FILES_PER_TASK)]
+    # The default pool is shared by all searches, other sizes get their own
+    executor = _shared_executor() if workers == DEFAULT_WORKERS else ThreadPoolExecutor(max_workers=workers)
+    futures = []
+    try:
+        futures = [executor.submit(_scan_files, batch, patterns, context_lines) for batch in batches]
+        for batch, future in zip(batches, futures):
+            for filepath, (size, hits) in zip(batch, future.result()):
+                if on_file:
+                    on_file(filepath, size)
+                yield from hits
+    finally:
+        for future in futures:
+            future.cancel()
+        if executor is not _executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def _shared_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS, thread_name_prefix="text_scan")
+        return _executor
+
+def full_text_search(query: str, directory: str, max_results: Optional[int] = None,
+                     on_file: Optional[Callable[[str, int], None]] = None) -> str:
+    """
+    Searches for a query string in all *.c and *.h files under the given directory.
+
+    Output is identical to the per-line implementations the tools used before.
+    """
+    results = []
+    for hit in scan_directory(directory, [literal_pattern(query)], on_file=on_file):
+        results.append(hit.format())
+        if max_results is not None and len(results) >= max_results:
+            break
+    return "\n".join(results) if results else "No matches found."
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) < 3:
+        print(f"Usage: {sys.argv[0]} <directory> <query> [workers]")
+        sys.exit(1)
+
+    directory, query = sys.argv[1], sys.argv[2]
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_WORKERS
+    scanned = [0, 0]
+
+    def count_file(filepath, size):
+        scanned[0] += 1
+        scanned[1] += size
+
+    start = time.perf_counter()
+    num_hits = sum(1 for _ in scan_directory(directory, [literal_pattern(query)], workers=workers, on_file=count_file))
+    elapsed = time.perf_counter() - start
+    print(f"{num_hits} hits in {scanned[0]} files ({scanned[1] / 1e6:.1f} MB) in {elapsed:.3f}s "
+          f"({scanned[1] / 1e6 / elapsed:.0f} MB/s, {workers} workers)")